@@ -33,7 +33,9 @@ Par exemple, si `h` vaut initialement `20`, le programme doit afficher :
 
 ==
 
-grader==#|python|
+# les cas de test et leurs affichages attendus sont calculés une fois pour
+# toutes à la construction de l'exercice (voir utils/cases.py)
+testcases==#|python|
 def expected_output(h):
     res = ""
     nb = 0
@@ -45,9 +47,9 @@ def expected_output(h):
 
 def tests(hauteurs):
     for h in hauteurs:
-        run(title = f'Rebonds depuis {h} cm',
-            globals = {'h': h}, 
-            output = expected_output(h))
+        case(title = f'Rebonds depuis {h} cm',
+             globals = {'h': h},
+             output = expected_output(h))
 
 begin_test_group("Hauteurs fixées")
 tests([20, 3, 5, 20, 400])
@@ -42,29 +42,18 @@ saisies_avec_erreurs = [
     ["-4", "-10", "10"],
     ["-4", "-10", "-10", "-1", "-3", "1"]]
 
-def affichage_attendu(saisie):
-    i = 0
-    res = ""
-    while i < len(saisie) and int(saisie[i]) < 0: 
-        res += f"Saisir un entier positif : {saisie[i]}\n"
-        res += "Mauvaise saisie\n"
-        i += 1
-    res += f"Saisir un entier positif : {saisie[i]}\n"
-    n = int(saisie[i])
-    somme = 0
-    for i in range(n + 1):
-        somme += i
-    res += f"La somme des entiers de 1 à {n} vaut {somme}\n"
-    return res
+# les affichages attendus sont ceux de la solution, exécutée dans le même
+# contexte que le code de l'étudiant
+set_reference(solution)
 
 begin_test_group("Saisies sans erreur")
 for saisie in saisies_sans_erreur:
-    run(inputs=saisie, output=affichage_attendu(saisie))
+    run(inputs=saisie, reference=True)
 
 begin_test_group("Saisies avec erreurs")
 run(inputs=["bonjour"], exception=Exception)
 for saisie in saisies_avec_erreurs:
-    run(inputs=saisie, output=affichage_attendu(saisie))
+    run(inputs=saisie, reference=True)
 
 ==
 
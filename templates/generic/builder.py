@@ -26,6 +26,20 @@ if __name__ == "__main__":
         except BuilderError as e:
             print(e, file=sys.stderr)
 
+    if 'testcases' in context:
+        # expected values are computed once per exercise instance
+        import cases
+        try:
+            context['cases'] = cases.bake(context['testcases'], context)
+        except cases.CaseError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    if 'doctests' in context:
+        # doctest examples are parsed once per exercise instance
+        import doctests
+        context['doctest_examples'] = doctests.parse(context['doctests'])
+
     output_json = sys.argv[2]
     with open(output_json, "w+") as f:
         f.write(jsonpickle.encode(context, unpicklable=False))
@@ -3,8 +3,23 @@
 @ grader.py
 @ utils/test.py
 @ utils/mockinput.py
-@ utils/testgroup.html
-@ utils/testitem.html
+@ utils/ast_analyzer.py
+@ utils/refcache.py
+@ utils/cases.py
+@ utils/doctests.py
+@ utils/timing.py
+@ utils/fingerprint.py
+@ utils/fixtures.py
+@ utils/budget.py
+@ utils/checkpoint.py
+@ utils/precheck.py
+@ utils/resultstore.py
+@ utils/sessiontrace.py
+@ utils/linecov.py
+@ utils/formatting.py
+@ utils/renderers.py
+@ jinja/testgroup.html
+@ jinja/testitem.html
 
 title = <em>(Pas de titre défini)</em>
 text = <em>(Pas d'énoncé défini)</em>
@@ -24,7 +39,19 @@ form==
 {{editor|component}}
 ==
 
-# définition de la procédure de validation
+# contraintes vérifiées avant l'exécution des tests (voir utils/precheck.py) :
+# fonctions à définir et constructions ou fonctions interdites, par exemple
+# required_functions = somme, moyenne
+# forbidden = while, sorted
+
+# définition de la procédure de validation (par défaut, exécute les tests
+# déclarés dans la clé testcases, voir utils/cases.py, et les exemples de la
+# clé doctests, voir utils/doctests.py)
 grader==
-begin_test_group("L'exercice n'a pas défini de procédure de validation.")
+if "cases" in pl_context:
+    run_cases(pl_context["cases"])
+if "doctest_examples" in pl_context:
+    run_doctests(pl_context["doctest_examples"])
+if "cases" not in pl_context and "doctest_examples" not in pl_context:
+    begin_test_group("L'exercice n'a pas défini de procédure de validation.")
 ==
@@ -7,20 +7,29 @@
 # TODO: allow easy / easier translation of feedback
 # TODO: check whether other stuff should be mocked (notably stderr) and possibly
 #  use a new patch-decorated function
-# TODO: implement comparison facilities with trusted code
 # TODO: add comments to individual tests
 # TODO: write documentation
 # TODO: allow hidden tests (no information on inputs / args / globs)
-# TODO: implement plaintext output, markdown rendering...
 # TODO: check whether cumulative context changes are such a good idea
 # TODO: better feedback appearance
 
-import ast
-import inspect
-import importlib
+# Only lightweight modules are imported here: the grader runs in a fresh
+# interpreter for every submission, so heavier dependencies (jinja2,
+# traceback...) are imported where needed.
 import os
+import time
+import checkpoint
+import formatting
+import linecov
+import precheck
+import resultstore
+import sessiontrace
 import test
-import traceback
+import timing
+
+# additional feedback formats (comma-separated, e.g. "json,md") written next
+# to the HTML feedback file, for instance for analytics
+_reports_env_var = 'PL_GRADER_REPORTS'
 
 
 def _get_student_code(exercise_context: dict):
@@ -31,28 +40,125 @@ def _get_student_code(exercise_context: dict):
     return answers[editor_id]["code"]
 
 
-def grade_this(code: str, tests: str, context: dict):
-    # instantiate a unique TestSession instance and copy all its bound methods
-    # to the global namespace for use in the validation script
-    session = test.TestSession(code)
-    methods = inspect.getmembers(session, predicate=inspect.ismethod)
+def _session_methods(session: test.TestSession) -> dict:
+    """Return the public bound methods of `session` by name. Unlike
+    `inspect.getmembers`, does not evaluate the session's lazy properties."""
+    cls = type(session)
+    return {name: getattr(session, name) for name in dir(cls)
+            if not name.startswith('_') and callable(getattr(cls, name))}
+
+
+def report_paths(feedback_path: str) -> dict:
+    """Map the formats requested in `PL_GRADER_REPORTS` to report files
+    next to `feedback_path` (e.g. feedback.json for json). Unknown formats
+    are skipped with a warning on stderr, rather than failing gradings."""
+    formats = os.environ.get(_reports_env_var, '')
+    if not formats:
+        return {}
+    import sys
+    from renderers import get_renderer
+    base = os.path.splitext(feedback_path)[0]
+    res = {}
+    for fmt in map(str.strip, formats.split(',')):
+        if not fmt:
+            continue
+        try:
+            res[fmt] = base + '.' + get_renderer(fmt).extension
+        except ValueError as e:
+            print("{} (ignored, see {})".format(e, _reports_env_var),
+                  file=sys.stderr)
+    return res
+
+
+def grade_this(code: str, tests: str, context: dict, reports: dict = None,
+               feedback=None, checkpoint=None, store=None, trace=None,
+               coverage=None):
+    start = time.perf_counter()
+    session = None
+    recorded = False
 
-    # prepare namespace for code execution
-    namespace = globals().copy()
-    namespace.update(methods)
-    namespace["pl_context"] = context
+    def finish(grade: float, message: str = None):
+        # the outcome is recorded by each sink, then the feedback is
+        # returned: `message` if the tests could not complete, the feedback
+        # on the session otherwise
+        nonlocal recorded
+        if checkpoint is not None:
+            checkpoint.finish(grade)
+        if trace is not None:
+            trace.finish(grade)
+        if store is not None:
+            # grading history (see the resultstore module)
+            store.record(session, context, code, grade,
+                         time.perf_counter() - start)
+            recorded = True
+        if message is None:
+            if feedback is None:
+                return grade, session.render()
+            session.finish_stream()
+            return grade, feedback
+        if feedback is None:
+            return grade, message
+        feedback.write(message)
+        return grade, feedback
+
+    def abort(grade: float):
+        # the grader is interrupted (see sandboxio.on_interrupt) and exits
+        # without running exit handlers: killed gradings, the slowest ones,
+        # are stored too, with the tests run so far
+        if not recorded:
+            store.record(session, context, code, grade,
+                         time.perf_counter() - start)
+        store.close()
+
+    if store is not None and feedback is not None:
+        feedback.abort = abort
+
+    # code which cannot be parsed or does not meet the structural
+    # requirements of the exercise is not run (see the precheck module)
+    with timing.grader.phase('precheck'):
+        checked = precheck.check_context(code, context)
+    if not checked.ok:
+        return finish(0, checked.feedback())
 
     try:
-        exec(tests, namespace)
+        # instantiate a unique TestSession instance and copy all its bound
+        # methods to the global namespace for use in the validation script
+        session = test.TestSession(code, checked.tree)
+        if feedback is not None:
+            # feedback is written to this stream as tests complete, and
+            # returned instead of a string
+            session.stream_to(feedback)
+        if checkpoint is not None:
+            # completed tests are recorded to recover from a killed grader
+            session.checkpoint_to(checkpoint)
+        if trace is not None:
+            # tests are recorded to be replayed in case of dispute
+            session.trace_to(trace)
+        if coverage is not None:
+            # lines executed by the tests (see the linecov module)
+            session.measure_coverage(coverage)
+        methods = _session_methods(session)
+
+        # prepare namespace for code execution
+        namespace = globals().copy()
+        namespace.update(methods)
+        namespace["pl_context"] = context
+
+        with timing.grader.phase('validation'):
+            exec(tests, namespace)
     except test.StopGrader:
         pass
     except Exception:
+        import traceback
         msg = "Une erreur s'est produite pendant la validation."
         msg += "Veuillez contacter un enseignant.<br/>"
-        msg += "<pre>{}</pre>".format(traceback.format_exc())
-        return 0, msg
+        msg += "<pre>{}</pre>".format(
+            formatting.escape(traceback.format_exc()))
+        return finish(0, msg)
 
-    return session.get_grade(), session.render()
+    for fmt, path in (reports or {}).items():
+        session.write_report(path, fmt)
+    return finish(session.get_grade())
 
 
 def create_student_file(code: str, modulename: str):
@@ -61,6 +167,7 @@ def create_student_file(code: str, modulename: str):
 
 
 if __name__ == "__main__":
+    import sys
     import sandboxio
 
     missing_editor = """Impossible d'identifier le composant CodeEditor dans 
@@ -68,11 +175,26 @@ if __name__ == "__main__":
     d'utiliser ou de vous inspirer du template generic.pl pour utiliser ce 
     grader. """
 
-    pl_context = sandboxio.get_context()
-    student_code = _get_student_code(pl_context)
+    with timing.grader.phase('context'):
+        pl_context = sandboxio.get_context()
+        student_code = _get_student_code(pl_context)
     student_modulename = "student"
     create_student_file(student_code, student_modulename)
     validation_script = pl_context["grader"]
-    grade, feedback = grade_this(student_code,
-                                 validation_script, pl_context)
+    feedback_stream = sandboxio.FeedbackWriter(sys.argv[4])
+    sandboxio.on_interrupt(feedback_stream)
+    student_coverage = linecov.default_coverage(student_code)
+    with timing.grader.phase('grading'):
+        grade, feedback = grade_this(student_code, validation_script,
+                                     pl_context, report_paths(sys.argv[4]),
+                                     feedback_stream,
+                                     checkpoint.default_checkpoint(),
+                                     resultstore.default_store(),
+                                     sessiontrace.default_trace(),
+                                     student_coverage)
+    # the report is written even if the tests executed no line (0 %), as
+    # long as the code could be compiled (the precheck is memoized)
+    if student_coverage is not None \
+            and precheck.check_context(student_code, pl_context).ok:
+        student_coverage.write(linecov.sidecar_path(sys.argv[4]))
     sandboxio.output(grade, feedback)
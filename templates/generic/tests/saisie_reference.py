@@ -0,0 +1,42 @@
+from grader import grade_this
+
+student_code = r"""
+n = int(input("Saisir un entier positif : "))
+while n < 0:
+    print("Mauvaise saisie")
+    n = int(input("Saisir un entier positif : "))
+print("La somme des entiers de 1 à " + str(n) + " vaut " + str(n * (n + 1) // 2))
+"""
+
+validation_code = r"""
+solution = '''
+n = int(input("Saisir un entier positif : "))
+while n < 0:
+    print("Mauvaise saisie")
+    n = int(input("Saisir un entier positif : "))
+somme = 0
+for i in range(n + 1):
+    somme += i
+print("La somme des entiers de 1 à " + str(n) + " vaut " + str(somme))
+'''
+
+# outputs, results and exceptions are compared with those of the solution
+set_reference(solution)
+
+begin_test_group("Saisies")
+for saisie in [["10"], ["0"], ["-4", "-10", "10"], ["bonjour"]]:
+    run(inputs=saisie, reference=True)
+end_test_group()
+
+# final global variables can also be compared (fails here, since the student
+# code does not define somme and i)
+set_globals()
+run(inputs=["3"])
+assert_same_as_reference("output", "globals")
+"""
+
+
+if __name__ == "__main__":
+    grade, fb = grade_this(student_code, validation_code, globals())
+    print(grade)
+    print(fb)
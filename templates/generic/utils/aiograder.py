@@ -0,0 +1,144 @@
+# coding: utf-8
+"""
+Asynchronous grading API, for embedding the grader in an asyncio service.
+
+`grader.grade_this` is synchronous and relies on process-global state
+(`sys.stdout` patching, test numbering, the `student` module), so that
+concurrent gradings must each run in their own worker. `AsyncGrader` grades
+each submission with an isolating execution backend (see the backends
+module) and returns the same `(grade, feedback)` pair as `grade_this`:
+
+- with the fork backend, each submission is graded in a child process forked
+  from the (warmed-up) service process, whose result is read without
+  blocking the event loop; the child is killed when its deadline expires or
+  when the grading is cancelled;
+- with the sub-interpreter backend, submissions are graded in parallel by a
+  pool of threads, each running a sub-interpreter. Sub-interpreters cannot
+  be interrupted: a grading which times out or is cancelled still runs to
+  completion in its thread, its result being discarded, so that a looping
+  submission holds a thread (and prevents the process from exiting) for
+  good. This backend is thus only suited to submissions known to terminate,
+  e.g. ones the grader limits itself.
+
+At most `concurrency` submissions are graded at once, the following ones
+waiting for a free worker; when `max_pending` submissions are already
+waiting or being graded, new ones are rejected with `GraderBusy`, so that an
+overloaded service can answer immediately (e.g. with HTTP 503)::
+
+    async with AsyncGrader(directory, concurrency=8, timeout=10) as grader:
+        grade, feedback = await grader.grade(code, context['grader'], context)
+"""
+
+import asyncio
+import os
+import signal
+from typing import Optional, Tuple
+
+import backends
+from backends import BackendError
+
+
+class GraderBusy(BackendError):
+    """Exception raised when too many submissions are pending."""
+    pass
+
+
+class AsyncGrader:
+    """Grades submissions concurrently in isolated workers (see the module's
+    documentation)."""
+
+    def __init__(self, directory: str, concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 max_pending: Optional[int] = None,
+                 backend: Optional[str] = 'fork'):
+        """
+        :param directory: Sandbox directory containing the grader files
+            (becomes the current directory).
+        :param concurrency: Maximal number of simultaneous gradings
+            (defaults to the number of CPUs).
+        :param timeout: Default deadline of a grading (s), None for none.
+        :param max_pending: Maximal number of submissions waiting or being
+            graded, None for no limit.
+        :param backend: 'fork' or 'subinterpreter' (None for the value of
+            `PL_GRADER_BACKEND`); an unavailable backend falls back to the
+            next one, the in-process backend being refused as it cannot
+            grade concurrently.
+        """
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.backend = backends.get_backend(backend, directory)
+        if isinstance(self.backend, backends.InProcessBackend):
+            self.backend.close()
+            raise ValueError("The in-process backend cannot grade "
+                             "concurrently")
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = None
+        if not isinstance(self.backend, backends.ForkBackend):
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(self.concurrency)
+
+    async def grade(self, code: str, tests: str, context: dict,
+                    timeout: Optional[float] = None) -> Tuple[float, str]:
+        """
+        Grades a submission.
+
+        :param code: Student code.
+        :param tests: Validation script (usually `context['grader']`).
+        :param context: Built context of the exercise.
+        :param timeout: Deadline of this grading (s), overriding the default
+            one. The time spent waiting for a free worker is not counted.
+        :return: tuple `(grade, feedback)`.
+        :raise GraderBusy: If `max_pending` submissions are pending.
+        :raise BackendError: If the grading failed or timed out.
+        """
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            raise GraderBusy("Trop de corrections en attente")
+        timeout = self.timeout if timeout is None else timeout
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                if self._executor is None:
+                    work = self._grade_forked(code, tests, context)
+                else:
+                    work = asyncio.get_running_loop().run_in_executor(
+                        self._executor, self.backend.grade, code, tests,
+                        context)
+                try:
+                    return await asyncio.wait_for(work, timeout)
+                except asyncio.TimeoutError:
+                    raise BackendError("Délai de correction dépassé")
+        finally:
+            self.pending -= 1
+
+    async def _grade_forked(self, code: str, tests: str, context: dict
+                            ) -> Tuple[float, str]:
+        loop = asyncio.get_running_loop()
+        pid, fd = self.backend.spawn(code, tests, context)
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader),
+            os.fdopen(fd, 'rb', 0))
+        try:
+            data = await reader.read()
+        except BaseException:  # cancelled or timed out
+            os.kill(pid, signal.SIGKILL)
+            raise
+        finally:
+            transport.close()
+            # the child exits as soon as its result is written
+            await loop.run_in_executor(None, os.waitpid, pid, 0)
+        return backends.read_result(data)
+
+    def close(self) -> None:
+        """Releases the workers (pending gradings are not waited for)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.backend.close()
+
+    async def __aenter__(self) -> 'AsyncGrader':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
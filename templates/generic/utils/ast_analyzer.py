@@ -77,6 +77,27 @@ class AstAnalyzer:
         return False
 
 
+def has_no_loop(source: str, keywords=("for", "while"), scope=None):
+    """Return True if `source` (or its function or class named `scope`)
+    contains no loop of the kinds listed in `keywords` (comprehensions count
+    as 'for' loops)."""
+    tree = AstAnalyzer(source).clip(scope)
+    if tree is None:
+        return True
+    for node in walk(tree):
+        if isinstance(node, While) and 'while' in keywords:
+            return False
+        if isinstance(node, AstAnalyzer._for_classes) and 'for' in keywords:
+            return False
+    return True
+
+
+def is_simple_recursive(source: str, funcname: str):
+    """Return True if function `funcname` defined in `source` calls itself
+    directly."""
+    return AstAnalyzer(source).is_simple_recursive(funcname)
+
+
 if __name__ == "__main__":
     from textwrap import dedent
 
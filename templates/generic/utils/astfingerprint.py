@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Fingerprints of submissions, for deduplicating and comparing a cohort.
+
+Submissions are compared through their abstract syntax tree (e.g.
+`TestSession.ast`), so that formatting and comments do not matter:
+
+- `exact_hash` hashes the tree itself: submissions with the same exact hash
+  behave identically (they only differ by formatting and comments), so
+  that a batch grader may grade one of them for all (see `regrade plan
+  --dedup`);
+- `normalized_hash` hashes the tree with identifiers renamed by order of
+  first occurrence (builtins and attributes are kept): submissions which
+  only differ by variable names have the same normalized hash. They may
+  not get the same grade (an exercise may require a given function name),
+  but are one solution for a teacher;
+- `winnow` selects fingerprints of the k-grams of the normalized tree
+  (winnowing, as in MOSS), whose overlap measures the similarity of
+  submissions which differ by more than names.
+
+`FingerprintIndex` stores the fingerprints of a cohort in an SQLite
+database, with an inverted index of k-gram fingerprints, so that clusters
+of identical submissions and submissions similar to a given one are found
+without comparing all pairs:
+
+    python3 astfingerprint.py index cohort.db submissions.jsonl
+    python3 astfingerprint.py clusters cohort.db [--exercise E]
+    python3 astfingerprint.py similar cohort.db KEY [--threshold 0.5]
+
+where submissions are given as for regrade.py (JSON Lines of `{"key": ...,
+"exercise": ..., "code": ...}` objects).
+"""
+
+import ast
+import builtins
+import json
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple
+from hashlib import blake2b
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# names kept by the normalization
+_builtin_names = frozenset(dir(builtins))
+
+Fingerprint = namedtuple('Fingerprint', ['exact', 'normalized', 'grams'])
+Fingerprint.__doc__ = """Exact and identifier-normalized hashes of a tree,
+and its winnowed k-gram fingerprints."""
+
+
+def _hash(text: str) -> str:
+    return blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def exact_hash(tree: ast.AST) -> str:
+    """Hash of a tree, ignoring positions (hence formatting and
+    comments)."""
+    return _hash(ast.dump(tree))
+
+
+def tokens(tree: ast.AST) -> List[str]:
+    """
+    Preorder sequence of the node types of a tree, interleaved with its
+    identifiers renamed by order of first occurrence (`_0`, `_1`...) and its
+    constants. Builtin names and attribute names are kept, docstrings and
+    other string statements are dropped.
+    """
+    names: Dict[str, str] = {}
+    res = []
+
+    def name(identifier: str) -> str:
+        if identifier in _builtin_names:
+            return identifier
+        return names.setdefault(identifier, '_{}'.format(len(names)))
+
+    def visit(node: ast.AST) -> None:
+        if (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str)):
+            return
+        res.append(type(node).__name__)
+        if isinstance(node, ast.Name):
+            res.append(name(node.id))
+        elif isinstance(node, ast.arg):
+            res.append(name(node.arg))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                               ast.ClassDef)):
+            res.append(name(node.name))
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            res.extend(name(identifier) for identifier in node.names)
+        elif isinstance(node, ast.Attribute):
+            res.append(node.attr)
+        elif isinstance(node, ast.Constant):
+            res.append(repr(node.value))
+        for child in ast.iter_child_nodes(node):
+            visit(child)
+
+    visit(tree)
+    return res
+
+
+def normalized_hash(tree: ast.AST) -> str:
+    """Hash of a tree up to the renaming of identifiers (see `tokens`)."""
+    return _hash(' '.join(tokens(tree)))
+
+
+def winnow(sequence: List[str], k: int = 5, window: int = 4) -> Set[int]:
+    """
+    Winnowed fingerprints of the k-grams of a sequence: the minimal hash of
+    each window of `window` consecutive k-grams (so that any common
+    subsequence of at least `k + window - 1` tokens shares a fingerprint).
+
+    :return: Set of 63-bit fingerprints.
+    """
+    hashes = [int.from_bytes(blake2b(' '.join(sequence[i:i + k]).encode(),
+                                     digest_size=8).digest(), 'big') >> 1
+              for i in range(max(1, len(sequence) - k + 1))]
+    if len(hashes) <= window:
+        return {min(hashes)}
+    return {min(hashes[i:i + window])
+            for i in range(len(hashes) - window + 1)}
+
+
+def fingerprint(tree: ast.AST, k: int = 5, window: int = 4) -> Fingerprint:
+    """Fingerprint of a tree (e.g. `TestSession.ast`)."""
+    sequence = tokens(tree)
+    return Fingerprint(exact_hash(tree), _hash(' '.join(sequence)),
+                       winnow(sequence, k, window))
+
+
+def fingerprint_code(code: str, k: int = 5, window: int = 4
+                     ) -> Optional[Fingerprint]:
+    """Fingerprint of some code, None if it cannot be parsed."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    return fingerprint(tree, k, window)
+
+
+def similarity(a: Set[int], b: Set[int]) -> float:
+    """Jaccard similarity of two sets of fingerprints."""
+    if not a and not b:
+        return 1.
+    return len(a & b) / len(a | b)
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS submissions (
+    key TEXT PRIMARY KEY,
+    exercise TEXT NOT NULL,
+    exact TEXT,
+    normalized TEXT,
+    grams INTEGER
+);
+CREATE TABLE IF NOT EXISTS grams (
+    exercise TEXT NOT NULL,
+    gram INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (exercise, gram, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS grams_key ON grams (key);
+CREATE INDEX IF NOT EXISTS submissions_exact ON submissions (exercise, exact);
+CREATE INDEX IF NOT EXISTS submissions_normalized
+    ON submissions (exercise, normalized);
+"""
+
+
+class FingerprintIndex:
+    """On-disk index of the fingerprints of a cohort (see the module's
+    documentation)."""
+
+    def __init__(self, path: str):
+        import sqlite3
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(_schema)
+
+    def add(self, submissions: Iterable[dict]) -> int:
+        """
+        Indexes submissions (replacing those already indexed with the same
+        keys) in a single transaction. Submissions which cannot be parsed
+        are indexed without fingerprints.
+
+        :param submissions: Dictionaries with `key`, `exercise` and `code`.
+        :return: Number of indexed submissions.
+        """
+        count = 0
+        with self.connection:
+            for submission in submissions:
+                key, exercise = submission['key'], submission['exercise']
+                self.connection.execute('DELETE FROM grams WHERE key = ?',
+                                        (key,))
+                fp = fingerprint_code(submission['code'])
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO submissions '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, exercise, fp and fp.exact, fp and fp.normalized,
+                     len(fp.grams) if fp else 0))
+                if fp:
+                    self.connection.executemany(
+                        'INSERT INTO grams VALUES (?, ?, ?)',
+                        [(exercise, gram, key) for gram in fp.grams])
+                count += 1
+        return count
+
+    def clusters(self, exercise: Optional[str] = None,
+                 column: str = 'normalized', min_size: int = 2
+                 ) -> List[Tuple[str, str, List[str]]]:
+        """
+        Groups of submissions with the same hash.
+
+        :param exercise: Exercise, None for all.
+        :param column: 'normalized' (same code up to names) or 'exact'.
+        :param min_size: Minimal number of submissions of a group.
+        :return: List of `(exercise, hash, keys)`, largest groups first.
+        """
+        if column not in ('normalized', 'exact'):
+            raise ValueError("Unknown hash: {}".format(column))
+        where = 'AND exercise = ?' if exercise is not None else ''
+        rows = self.connection.execute(
+            'SELECT exercise, {0}, group_concat(key, char(0)) AS keys, '
+            'COUNT(*) AS n FROM submissions WHERE {0} IS NOT NULL {1} '
+            'GROUP BY exercise, {0} HAVING n >= ? ORDER BY n DESC'.format(
+                column, where),
+            ((exercise,) if exercise is not None else ()) + (min_size,))
+        return [(row[0], row[1], sorted(row[2].split('\0'))) for row in rows]
+
+    def similar(self, key: str, threshold: float = .5, limit: int = 10
+                ) -> List[Tuple[str, float]]:
+        """
+        Submissions of the same exercise similar to a given one, found
+        through the fingerprints they share (submissions sharing none are
+        never considered).
+
+        :return: List of `(key, similarity)` of the submissions whose
+            similarity (see `similarity`) is at least `threshold`, most
+            similar first.
+        """
+        row = self.connection.execute(
+            'SELECT exercise, grams FROM submissions WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        exercise, size = row
+        rows = self.connection.execute(
+            'SELECT other.key, COUNT(*), s.grams FROM grams AS mine '
+            'JOIN grams AS other ON other.exercise = mine.exercise '
+            'AND other.gram = mine.gram AND other.key != mine.key '
+            'JOIN submissions AS s ON s.key = other.key '
+            'WHERE mine.exercise = ? AND mine.key = ? GROUP BY other.key',
+            (exercise, key))
+        res = []
+        for other, shared, other_size in rows:
+            score = shared / (size + other_size - shared)
+            if score >= threshold:
+                res.append((other, score))
+        res.sort(key=lambda item: (-item[1], item[0]))
+        return res[:limit]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('index', help='index submissions')
+    p.add_argument('database', help='SQLite index file')
+    p.add_argument('submissions', help='JSON Lines file of submissions')
+    p = commands.add_parser('clusters', help='list identical submissions')
+    p.add_argument('database', help='SQLite index file')
+    p.add_argument('--exercise', help='only this exercise')
+    p.add_argument('--exact', action='store_true',
+                   help='compare exactly (names included)')
+    p = commands.add_parser('similar', help='list similar submissions')
+    p.add_argument('database', help='SQLite index file')
+    p.add_argument('key', help='key of the submission')
+    p.add_argument('--threshold', type=float, default=.5,
+                   help='minimal similarity')
+    p.add_argument('--limit', type=int, default=10,
+                   help='maximal number of submissions listed')
+    args = parser.parse_args()
+
+    index = FingerprintIndex(args.database)
+    try:
+        if args.command == 'index':
+            with open(args.submissions, encoding='utf-8') as f:
+                count = index.add(json.loads(line) for line in f
+                                  if line.strip())
+            print("{} submissions indexed".format(count))
+        elif args.command == 'clusters':
+            for exercise, _, keys in index.clusters(
+                    args.exercise, 'exact' if args.exact else 'normalized'):
+                print("{} ({}): {}".format(exercise, len(keys),
+                                           ' '.join(keys)))
+        else:
+            for key, score in index.similar(args.key, args.threshold,
+                                            args.limit):
+                print("{:.2f} {}".format(score, key))
+    except KeyError as e:
+        print("Unknown submission: {}".format(e), file=sys.stderr)
+        return 1
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
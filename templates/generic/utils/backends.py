@@ -0,0 +1,340 @@
+# coding: utf-8
+"""
+Execution backends, for tools grading many submissions in one process
+(batch regrading, benchmarks, load tests).
+
+A backend grades a submission like `grader.grade_this` (its `grade` method
+takes the student code, the validation script and the built context, and
+returns `(grade, feedback)`), with more or less isolation:
+
+- `InProcessBackend` calls `grade_this` directly: cheapest, but the student
+  code runs in the interpreter of the caller (modules, builtins and memory
+  are shared between submissions);
+- `ForkBackend` calls it in a forked child process (POSIX only), which
+  sends the result back through a pipe: isolated, at the cost of a process
+  per submission, and the only backend enforcing a timeout;
+- `SubinterpreterBackend` calls it in a sub-interpreter with its own GIL
+  (CPython 3.13 and later), taken from a pool of interpreters in which the
+  grader modules are already imported. Sub-interpreters have their own
+  modules and are not allowed to fork (`os.fork`, `subprocess`; C-level
+  calls such as `os.system` are not prevented), and the result comes back
+  as JSON through a pipe. Several submissions may be graded in parallel
+  from different threads.
+
+Backends run the grader files of a sandbox directory (see
+`plsandbox.prepare_sandbox`). `get_backend` returns a backend by name,
+falling back to the next available backend (in the above order, reversed)
+when the requested one is not supported by the running interpreter; the
+`PL_GRADER_BACKEND` environment variable sets the default name.
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+from typing import Any, Optional, Tuple
+
+_env_var = 'PL_GRADER_BACKEND'
+
+_utils_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class BackendError(Exception):
+    """Exception raised when a submission could not be graded by a
+    backend."""
+    pass
+
+
+def _prepare(directory: str) -> None:
+    """Makes the grader files of `directory` importable, and `directory` the
+    current directory (where the grader looks for its templates)."""
+    directory = os.path.abspath(directory)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    os.chdir(directory)
+
+
+class Backend:
+    """Base class of execution backends."""
+    name = ''
+
+    @staticmethod
+    def available() -> bool:
+        """Whether the backend is supported by the running interpreter."""
+        return True
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Sandbox directory containing the grader files
+            (becomes the current directory).
+        """
+        self.directory = os.path.abspath(directory)
+        _prepare(self.directory)
+
+    def grade(self, code: str, tests: str, context: dict
+              ) -> Tuple[float, str]:
+        """
+        Grades a submission.
+
+        :param code: Student code.
+        :param tests: Validation script (usually `context['grader']`).
+        :param context: Built context of the exercise.
+        :return: tuple `(grade, feedback)`.
+        :raise BackendError: If the grading failed.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessBackend(Backend):
+    """Grades submissions in the current interpreter."""
+    name = 'inprocess'
+
+    def grade(self, code, tests, context):
+        import grader
+        grade, feedback = grader.grade_this(code, tests, context)
+        return grade, str(feedback)
+
+
+class ForkBackend(Backend):
+    """Grades each submission in a forked child process."""
+    name = 'fork'
+
+    @staticmethod
+    def available():
+        return hasattr(os, 'fork')
+
+    def __init__(self, directory: str, timeout: Optional[float] = None):
+        """
+        :param directory: Sandbox directory containing the grader files.
+        :param timeout: Time after which the child is killed (s).
+        """
+        super().__init__(directory)
+        self.timeout = timeout
+        import grader  # imported once, before forking
+
+    def spawn(self, code: str, tests: str, context: dict) -> Tuple[int, int]:
+        """
+        Starts grading a submission in a child process.
+
+        :return: tuple `(pid, fd)`, the child writing its result (see
+            `read_result`) to the file descriptor `fd` before exiting.
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                # another backend of this process may have changed the
+                # current directory since this one was created
+                os.chdir(self.directory)
+                _write_result(write_fd, code, tests, context)
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        return pid, read_fd
+
+    def grade(self, code, tests, context):
+        import select
+        import signal
+        pid, read_fd = self.spawn(code, tests, context)
+        chunks = []
+        try:
+            while True:
+                ready, _, _ = select.select([read_fd], [], [], self.timeout)
+                if not ready:
+                    os.kill(pid, signal.SIGKILL)
+                    raise BackendError("Délai de correction dépassé")
+                chunk = os.read(read_fd, 1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+        return read_result(b''.join(chunks))
+
+
+def _write_result(fd: int, code: str, tests: str, context: dict) -> None:
+    """Grades a submission and writes `[grade, feedback]` (or `[None,
+    error]`) as JSON to the file descriptor `fd`."""
+    try:
+        import grader
+        grade, feedback = grader.grade_this(code, tests, context)
+        data = [grade, str(feedback)]
+    except BaseException as e:
+        data = [None, "{}: {}".format(type(e).__name__, e)]
+    view = memoryview(json.dumps(data).encode())
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def read_result(data: bytes) -> Tuple[float, str]:
+    """Decodes the result written by `_write_result`.
+
+    :raise BackendError: If there is no result, or the grading failed.
+    """
+    try:
+        grade, feedback = json.loads(data)
+    except ValueError:
+        raise BackendError("Pas de résultat de correction")
+    if grade is None:
+        raise BackendError(feedback)
+    return grade, feedback
+
+
+# run in each sub-interpreter of the pool when it is created
+_warm_up_script = """
+import sys
+sys.path.insert(0, {directory!r})
+sys.path.append({utils!r})
+import json, os
+import backends, grader
+try:
+    import jinja2  # feedback templates
+except ImportError:
+    pass
+"""
+
+# run in a sub-interpreter to grade a submission (see _write_result)
+_grade_script = """
+backends._write_result(fd, code, tests, json.loads(context))
+"""
+
+
+def _interpreters_module():
+    """Low-level sub-interpreters module of the running CPython, if any.
+
+    The `_xxsubinterpreters` module of CPython 3.12 is not used: destroying
+    an interpreter which imported `threading` (as Jinja2 does) from another
+    thread hangs, and extension modules such as MarkupSafe's are not safe in
+    its isolated interpreters.
+    """
+    try:
+        import _interpreters
+        return _interpreters
+    except ImportError:
+        return None
+
+
+class SubinterpreterBackend(Backend):
+    """Grades each submission in a fresh sub-interpreter, from a pool of
+    warmed-up interpreters replenished in the background."""
+    name = 'subinterpreter'
+
+    @staticmethod
+    def available():
+        return _interpreters_module() is not None
+
+    def __init__(self, directory: str, size: int = 2):
+        """
+        :param directory: Sandbox directory containing the grader files.
+        :param size: Number of warmed-up interpreters kept ready.
+        """
+        super().__init__(directory)
+        self._interpreters = _interpreters_module()
+        self._pool: 'queue.Queue[Any]' = queue.Queue()
+        self._replenishers = []  # threads creating interpreters
+        for _ in range(size):
+            self._pool.put(self._create())
+
+    def _run(self, interpreter, script: str, shared: dict) -> None:
+        error = self._interpreters.exec(interpreter, script, shared)
+        if error is not None:
+            raise BackendError(getattr(error, 'formatted', None)
+                               or str(error))
+
+    def _create(self):
+        """Creates a warmed-up sub-interpreter."""
+        interpreter = self._interpreters.create()  # isolated by default
+        try:
+            self._run(interpreter, _warm_up_script.format(
+                directory=self.directory, utils=_utils_dir), {})
+        except BackendError:
+            self._interpreters.destroy(interpreter)
+            raise
+        return interpreter
+
+    def _replenish(self) -> None:
+        try:
+            self._pool.put(self._create())
+        except BackendError:
+            pass
+
+    def grade(self, code, tests, context):
+        try:
+            interpreter = self._pool.get_nowait()
+        except queue.Empty:
+            interpreter = self._create()
+        self._replenishers = [thread for thread in self._replenishers
+                              if thread.is_alive()]
+        thread = threading.Thread(target=self._replenish, daemon=True)
+        thread.start()
+        self._replenishers.append(thread)
+
+        chunks = []
+        read_fd, write_fd = os.pipe()
+        # the pipe is drained by a thread, so that a large feedback does
+        # not block the interpreter
+        reader = threading.Thread(target=_drain, args=(read_fd, chunks))
+        reader.start()
+        try:
+            self._run(interpreter, _grade_script,
+                      {'fd': write_fd, 'code': code, 'tests': tests,
+                       'context': json.dumps(context)})
+        finally:
+            os.close(write_fd)
+            reader.join()
+            os.close(read_fd)
+            self._interpreters.destroy(interpreter)
+        return read_result(b''.join(chunks))
+
+    def close(self):
+        # let interpreters being created join the pool before destroying it
+        for thread in self._replenishers:
+            thread.join()
+        while True:
+            try:
+                self._interpreters.destroy(self._pool.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _drain(fd: int, chunks: list) -> None:
+    while True:
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            return
+        chunks.append(chunk)
+
+
+# backends by name, from the least to the most isolated, and fallbacks
+BACKENDS = {'inprocess': InProcessBackend, 'fork': ForkBackend,
+            'subinterpreter': SubinterpreterBackend}
+_fallbacks = ['subinterpreter', 'fork', 'inprocess']
+
+
+def get_backend(name: Optional[str], directory: str, **options) -> Backend:
+    """
+    Returns a backend by name, or the first available backend following it
+    in the order subinterpreter, fork, inprocess.
+
+    :param name: Backend name ('inprocess', 'fork' or 'subinterpreter'),
+        'auto' for the most isolated available backend, or None for the
+        value of `PL_GRADER_BACKEND` (defaults to 'auto').
+    :param directory: Sandbox directory containing the grader files.
+    :param options: Options of the backend's constructor, used only if it
+        is the requested one.
+    """
+    name = name or os.environ.get(_env_var) or 'auto'
+    if name != 'auto' and name not in BACKENDS:
+        raise ValueError("Unknown execution backend: {}".format(name))
+    start = 0 if name == 'auto' else _fallbacks.index(name)
+    for fallback in _fallbacks[start:]:
+        cls = BACKENDS[fallback]
+        if cls.available():
+            return cls(directory, **(options if fallback == name else {}))
+    raise AssertionError("the in-process backend is always available")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Benchmark of the grader over the exercise catalogue.
+
+Every exercise extending the generic template is built with builder.py, then
+a set of canned submissions (correct, wrong, slow, crashing and
+output-flooding programs) is graded through grader.py, each in a fresh
+interpreter as in the sandbox. Latency percentiles, peak memory and feedback
+size are reported per exercise and submission, and can be saved as a JSON
+baseline against which later runs are checked. With `--backend`, the
+submissions are also graded in the benchmark process by the given execution
+backends (see the backends module), reported as e.g. `correct@fork`.
+
+Usage: python3 benchmark.py [--repeat N] [--save FILE] [--baseline FILE]
+                            [--backend NAME]...
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from typing import Dict, List, Sequence
+
+import backends
+import plsandbox
+
+_template_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_repository_dir = os.path.dirname(os.path.dirname(_template_dir))
+
+# canned submissions (the correct one is the exercise's solution)
+SUBMISSIONS = {
+    'wrong': 'print("réponse fausse")\n',
+    'slow': 'x = 0\nfor i in range(2 * 10 ** 6):\n    x += i\n',
+    'crashing': 'raise RuntimeError("plantage")\n',
+    'flooding': 'for i in range(10 ** 5):\n    print(i, "x" * 80)\n',
+}
+
+# measures compared to the baseline
+MEASURES = ('p50', 'maxrss', 'feedback')
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Percentile `p` (between 0 and 100) of `values`, by nearest rank."""
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def _maxrss() -> int:
+    """Peak memory of this process and its children (kB)."""
+    import resource
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def bench_backend(name: str, directory: str, built: dict,
+                  submissions: Dict[str, str], repeat: int,
+                  timeout: float) -> dict:
+    """
+    Grades each submission `repeat` times with an execution backend.
+
+    :return: Dictionary mapping `<kind>@<backend>` to measures (see
+        `bench_exercise`), a grading failure giving a None grade.
+    """
+    cwd = os.getcwd()
+    backend = backends.get_backend(
+        name, directory, **({'timeout': timeout} if name == 'fork' else {}))
+    results = {}
+    try:
+        for kind, code in submissions.items():
+            latencies, size, grade = [], 0, None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    grade, feedback = backend.grade(code, built['grader'],
+                                                    built)
+                    size = max(size, len(feedback.encode()))
+                except backends.BackendError:
+                    grade = None
+                latencies.append(time.perf_counter() - start)
+            results['{}@{}'.format(kind, backend.name)] = {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': max(latencies),
+                'maxrss': _maxrss(),
+                'feedback': size,
+                'grade': grade}
+    finally:
+        backend.close()
+        os.chdir(cwd)
+    return results
+
+
+def bench_exercise(path: str, repeat: int, timeout: float,
+                   env: Dict[str, str], backend_names: Sequence[str] = ()
+                   ) -> dict:
+    """
+    Builds an exercise and grades each canned submission `repeat` times,
+    in the sandbox and with the given execution backends.
+
+    :return: Dictionary mapping submission kinds to their measures: latency
+        percentiles and maximum (s), peak memory (kB), feedback size (bytes)
+        and grade.
+    """
+    context, files, _ = plsandbox.load_pl(path)
+    submissions = dict(SUBMISSIONS)
+    solution = plsandbox.solution_of(context)
+    if solution is not None:
+        submissions = dict(correct=solution, **submissions)
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='plbench-') as directory:
+        plsandbox.prepare_sandbox(files, directory)
+        built, res = plsandbox.build(directory, context, timeout, env)
+        results['build'] = {'p50': res.elapsed, 'maxrss': res.maxrss}
+        for kind, code in submissions.items():
+            latencies, maxrss, size, grade = [], 0, 0, None
+            for _ in range(repeat):
+                res = plsandbox.grade(directory, built, code, timeout, env)
+                latencies.append(res.process.elapsed)
+                maxrss = max(maxrss, res.process.maxrss)
+                size = max(size, len(res.feedback.encode()))
+                grade = res.grade
+            results[kind] = {'p50': percentile(latencies, 50),
+                             'p90': percentile(latencies, 90),
+                             'p99': percentile(latencies, 99),
+                             'max': max(latencies),
+                             'maxrss': maxrss,
+                             'feedback': size,
+                             'grade': grade}
+        for name in backend_names:
+            results.update(bench_backend(name, directory, built, submissions,
+                                         repeat, timeout))
+    return results
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Lists the measures of `results` exceeding their `baseline` value by
+    more than `threshold` (relative)."""
+    found = []
+    for exercise, kinds in results.items():
+        for kind, measures in kinds.items():
+            reference = baseline.get(exercise, {}).get(kind, {})
+            for measure in MEASURES:
+                old, new = reference.get(measure), measures.get(measure)
+                if old and new is not None and new > old * (1 + threshold):
+                    found.append("{} [{}] {}: {:.4g} -> {:.4g} (+{:.0%})".format(
+                        exercise, kind, measure, old, new, new / old - 1))
+    return found
+
+
+def print_report(results: dict) -> None:
+    header = "{:<55} {:<24} {:>7} {:>7} {:>7} {:>9} {:>10} {:>5}"
+    row = "{:<55} {:<24} {:>7.3f} {:>7.3f} {:>7.3f} {:>9} {:>10} {:>5}"
+    print(header.format('exercise', 'kind', 'p50', 'p90', 'max', 'maxrss',
+                        'feedback', 'grade'))
+    for exercise, kinds in results.items():
+        for kind, m in kinds.items():
+            print(row.format(exercise[-55:], kind, m['p50'],
+                             m.get('p90', m['p50']), m.get('max', m['p50']),
+                             m['maxrss'], m.get('feedback', '-'),
+                             str(m.get('grade', '-'))))
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--exercises',
+                        default=os.path.join(_repository_dir, 'exercises'),
+                        help='directory searched for exercises')
+    parser.add_argument('--template',
+                        default=os.path.join(_template_dir, 'generic.pl'),
+                        help='template the exercises must extend')
+    parser.add_argument('--only', default='',
+                        help='only bench exercises whose path contains this')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='gradings per submission')
+    parser.add_argument('--timeout', type=float, default=30.,
+                        help='timeout of a single build or grading (s)')
+    parser.add_argument('--env', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='environment variable for builder and grader')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON baseline to compare with')
+    parser.add_argument('--threshold', type=float, default=.25,
+                        help='relative increase considered as a regression')
+    parser.add_argument('--backend', action='append', default=[],
+                        choices=sorted(backends.BACKENDS) + ['auto'],
+                        help='also grade in process with this execution '
+                        'backend (may be repeated)')
+    args = parser.parse_args()
+    env = dict(item.split('=', 1) for item in args.env)
+
+    results = {}
+    for path in plsandbox.discover(args.exercises, args.template):
+        name = os.path.relpath(path, args.exercises)
+        if args.only not in name:
+            continue
+        try:
+            results[name] = bench_exercise(path, args.repeat, args.timeout,
+                                           env, args.backend)
+        except plsandbox.PLError as e:
+            print("{} : {}".format(name, e), file=sys.stderr)
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.threshold)
+        for line in found:
+            print("REGRESSION " + line)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+Time budget of a test session, and scheduling of baked test cases.
+
+A session may be given a budget of CPU time (`TestSession.set_budget`, or
+the `PL_GRADER_BUDGET` environment variable, in seconds). Once it is spent,
+the following tests are not run: they are reported as such and do not count
+in the grade. A test which is running when the budget expires is not
+interrupted.
+
+When a budget is set, `TestSession.run_cases` runs cases in order of
+priority rather than in declaration order (feedback keeps the declaration
+order): cases which often fail and take little time first, so that most of
+the grade is known early. Priorities come from the costs and failures
+recorded in a statistics file (`PL_GRADER_STATS` environment variable),
+updated after each session. Concurrent sessions may overwrite each other's
+updates, which only makes the statistics less precise.
+"""
+
+import os
+import time
+from typing import Dict, List, Optional
+
+_budget_env_var = 'PL_GRADER_BUDGET'
+_stats_env_var = 'PL_GRADER_STATS'
+
+
+class Budget:
+    """CPU time budget, started at creation."""
+
+    def __init__(self, seconds: float):
+        """
+        :param seconds: Available CPU time (as measured by
+            `time.process_time`).
+        """
+        self.seconds = seconds
+        self.start = time.process_time()
+
+    def spent(self) -> float:
+        return time.process_time() - self.start
+
+    def expired(self) -> bool:
+        return self.spent() >= self.seconds
+
+
+def default_budget() -> Optional[Budget]:
+    """Budget set by the `PL_GRADER_BUDGET` environment variable, if any (an
+    invalid value is ignored, with a warning on stderr)."""
+    seconds = os.environ.get(_budget_env_var)
+    if not seconds:
+        return None
+    try:
+        return Budget(float(seconds))
+    except ValueError:
+        import sys
+        print("Valeur invalide de {} ({!r}) : pas de limite de temps".format(
+            _budget_env_var, seconds), file=sys.stderr)
+        return None
+
+
+def case_key(case: dict) -> str:
+    """Identifier of a baked case in the statistics file."""
+    import hashlib
+    import json
+    text = json.dumps(case, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class CaseStats:
+    """
+    Costs and failures of test cases, persisted in a JSON file mapping case
+    keys to `{"runs": n, "time": total CPU time, "failures": n}`.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        :param path: Statistics file (defaults to the `PL_GRADER_STATS`
+            environment variable; statistics are not persisted if unset).
+        """
+        self.path = path if path is not None else os.environ.get(
+            _stats_env_var)
+        self.stats: Dict[str, dict] = {}
+        if self.path and os.path.exists(self.path):
+            import json
+            try:
+                with open(self.path) as f:
+                    self.stats = json.load(f)
+            except (OSError, ValueError):
+                self.stats = {}
+
+    def record(self, key: str, cost: float, failed: bool) -> None:
+        entry = self.stats.setdefault(key, {'runs': 0, 'time': 0.,
+                                            'failures': 0})
+        entry['runs'] += 1
+        entry['time'] += cost
+        entry['failures'] += failed
+
+    def priority(self, key: str, default_cost: float) -> float:
+        """
+        Priority of a case: its failure rate per second of CPU time. Unknown
+        cases have a failure rate of 1/2 and the default cost.
+        """
+        entry = self.stats.get(key)
+        if entry is None or not entry['runs']:
+            rate, cost = .5, default_cost
+        else:
+            # smoothed failure rate, so that a case which never failed yet
+            # may still come before a much more expensive one
+            rate = (entry['failures'] + .5) / (entry['runs'] + 1)
+            cost = entry['time'] / entry['runs']
+        return rate / max(cost, 1e-6)
+
+    def order(self, keys: List[str]) -> List[int]:
+        """Indices of `keys` by decreasing priority (stable)."""
+        costs = sorted(entry['time'] / entry['runs']
+                       for entry in self.stats.values() if entry['runs'])
+        default_cost = costs[len(costs) // 2] if costs else 1e-3
+        return sorted(range(len(keys)),
+                      key=lambda i: -self.priority(keys[i], default_cost))
+
+    def save(self) -> None:
+        """Writes the statistics file (atomically), if any."""
+        if not self.path:
+            return
+        import json
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.stats, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
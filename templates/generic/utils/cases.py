@@ -0,0 +1,182 @@
+# coding: utf-8
+"""
+Test cases baked at build time.
+
+Exercises may declare their test cases in a `testcases` script instead of
+computing expected values in the `grader` script. The builder executes this
+script once per exercise instance (with the random generator seeded by the
+`seed` context key, so random cases are reproducible), computes the expected
+outputs, results and exceptions of each case (either given explicitly or
+obtained by running the reference code), and stores them compactly in the
+context under the `cases` key. The grader then only runs the student code
+and compares, see `TestSession.run_cases`.
+
+The `testcases` script may call:
+- `begin_test_group(title)`: following cases belong to a new test group;
+- `set_reference(code)`: reference code used to compute the expected values
+  of the following cases;
+- `case(expression=None, **kwargs)`: declares a case, with keyword arguments
+  `title`, `globals`, `inputs`, `argv`, `weight`, and optionally explicit
+  expected values `output`, `result` and `exception` (an exception class).
+
+Example::
+
+    testcases==#|python|
+    from random import sample
+    set_reference(solution)
+    begin_test_group("Valeurs aléatoires")
+    for h in sample(range(100, 200), 3):
+        case(title=f"Rebonds depuis {h} cm", globals={'h': h})
+    ==
+"""
+
+import ast
+import builtins
+import random
+from typing import Any, Dict, List, Optional
+
+
+class CaseError(Exception):
+    """Exception raised when test cases cannot be baked."""
+    pass
+
+
+def _literal(value: Any, what: str) -> str:
+    """Returns the repr of `value`, checking that it can be read back."""
+    text = repr(value)
+    try:
+        if ast.literal_eval(text) != value:
+            raise ValueError
+    except Exception:
+        raise CaseError("{} ne peut pas être enregistré dans le contexte : "
+                        "{}".format(what, text))
+    return text
+
+
+class CaseCollector:
+    """
+    Collects the test cases declared by a `testcases` script and computes
+    their expected values.
+    """
+
+    def __init__(self):
+        self.cases: List[dict] = []
+        self.group: Optional[str] = None
+        self.reference: Optional[str] = None
+
+    def begin_test_group(self, title: str) -> None:
+        self.group = title
+
+    def set_reference(self, code: Optional[str]) -> None:
+        self.reference = code
+
+    def case(self, expression: Optional[str] = None, **kwargs) -> None:
+        """
+        Declares a test case and computes its expected values.
+
+        :param expression: Expression to evaluate (optional).
+        :param kwargs: Context (`globals`, `inputs`, `argv`), description
+            (`title`, `weight`) and expected values (`output`, `result`,
+            `exception`).
+        """
+        unknown = kwargs.keys() - {'title', 'weight', 'globals', 'inputs',
+                                   'argv', 'output', 'result', 'exception'}
+        if unknown:
+            raise CaseError("Paramètres inconnus : " + ", ".join(unknown))
+        state = kwargs.get('globals', {})
+        inputs = list(kwargs.get('inputs', []))
+        argv = list(kwargs.get('argv', []))
+        expected = {key: kwargs[key] for key in ('output', 'result', 'exception')
+                    if key in kwargs}
+
+        if self.reference is not None:
+            from test import execute_reference
+            ref = execute_reference(self.reference, expression, state,
+                                    inputs, argv)
+            expected.setdefault('output', ref.output)
+            if expression is not None and ref.exception is None:
+                expected.setdefault('result', ref.result)
+            expected.setdefault('exception', ref.exception)
+
+        # compact representation: absent keys take default values
+        case = {}
+        if self.group is not None:
+            case['group'] = self.group
+        for key in ('title', 'weight'):
+            if key in kwargs:
+                case[key] = kwargs[key]
+        if expression is not None:
+            case['expression'] = expression
+        if state:
+            case['globals'] = _literal(state, "Le contexte")
+        if inputs:
+            case['inputs'] = inputs
+        if argv:
+            case['argv'] = argv
+        if 'output' in expected:
+            case['output'] = expected['output']
+        if 'result' in expected:
+            if expression is None:
+                raise CaseError("Résultat attendu sans expression à évaluer")
+            case['result'] = _literal(expected['result'], "Le résultat")
+        if expected.get('exception') is not None:
+            case['exception'] = expected['exception'].__name__
+        self.cases.append(case)
+
+    def namespace(self) -> Dict[str, Any]:
+        """Functions made available to the `testcases` script."""
+        return {'begin_test_group': self.begin_test_group,
+                'set_reference': self.set_reference,
+                'case': self.case}
+
+
+def bake(script: str, context: dict) -> List[dict]:
+    """
+    Executes a `testcases` script and returns the baked cases.
+
+    The random generator is seeded with `context['seed']`, which is set to a
+    new random value if absent.
+
+    :param script: The `testcases` script.
+    :param context: Exercise context, available to the script as
+        `pl_context`.
+    :return: List of cases, as stored in the context.
+    """
+    if 'seed' not in context:
+        context['seed'] = random.randrange(2 ** 31)
+    random.seed(context['seed'])
+
+    collector = CaseCollector()
+    namespace = collector.namespace()
+    namespace['pl_context'] = context
+    try:
+        exec(script, namespace)
+    except CaseError:
+        raise
+    except Exception as e:
+        raise CaseError("Erreur dans la déclaration des tests : {!r}".format(e))
+    return collector.cases
+
+
+def decode_case(case: dict) -> Dict[str, Any]:
+    """
+    Turns a baked case into keyword arguments for `TestSession.run`.
+
+    Each case runs in its own context: absent globals, inputs and arguments
+    are empty.
+
+    :param case: A case as returned by `bake`.
+    :return: Dictionary of keyword arguments (including `expression`).
+    """
+    kwargs = {'expression': case.get('expression'),
+              'globals': ast.literal_eval(case.get('globals', '{}')),
+              'inputs': list(case.get('inputs', [])),
+              'argv': list(case.get('argv', []))}
+    for key in ('title', 'weight', 'output'):
+        if key in case:
+            kwargs[key] = case[key]
+    if 'result' in case:
+        kwargs['result'] = ast.literal_eval(case['result'])
+    if 'exception' in case:
+        kwargs['exception'] = getattr(builtins, case['exception'], Exception)
+    return kwargs
@@ -0,0 +1,252 @@
+# coding: utf-8
+"""
+Checkpoints of test sessions, to recover partial results of a killed grader.
+
+When the `PL_GRADER_CHECKPOINT` environment variable names a file, the
+grader appends to it one JSON line per event of the session, as it goes:
+
+- `{"event": "group", "id": ..., "title": ..., "weight": ...}` when a test
+  group is opened (again, with the same id, when its tests are not run in
+  a row, see `TestSession.run_cases`), and `{"event": "endgroup"}` when it
+  is closed;
+- `{"event": "start", "title": ..., "weight": ...}` before a test is run;
+- `{"event": "test", "title": ..., "status": ..., "skipped": ...,
+  "grade": ..., "weight": ..., "messages": [...]}` as soon as a test is
+  complete, with the plain-text messages of its failed assertions;
+- `{"event": "amend", ...}`, with the same fields, when an assertion is
+  added to the last test after its execution (e.g.
+  `TestSession.assert_output`), replacing its `test` event;
+- `{"event": "end", "grade": ...}` once the session is complete.
+
+Lines are written unbuffered, so that they survive the grader being killed
+(timeout, memory limit) even when the signal cannot be handled (see
+`sandboxio.on_interrupt` for those which can). `recover` turns a checkpoint
+into a grade and a compact feedback, as an interrupted session would have
+produced (with the same grade computation, see `test.session_grade`):
+completed tests count, the test which was running counts as failed, and the
+following ones are ignored. Run this module with the
+arguments of grader.py to output them according to the sandbox contract:
+
+    python3 checkpoint.py context.json answers.json processed.json feedback.html
+
+A recovered grade is not trusted: the student code runs in the grader's
+process, so that it could write to the open checkpoint file (the path is
+removed from the environment of the student code, but the file remains
+reachable, e.g. through the garbage collector). Recovered grades are
+bounded to [0, 100], and should be reviewed rather than taken as
+authoritative (see the regrade tool).
+
+When regrading a cohort with one checkpoint file per submission,
+`completed_keys` lists the submissions whose grading completed, so that a
+crashed regrade can be resumed without grading them again.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+_env_var = 'PL_GRADER_CHECKPOINT'
+
+# maximal length of each message kept in the checkpoint
+_max_message_length = 500
+
+
+class Checkpoint:
+    """Append-only checkpoint file of a test session (see the module's
+    documentation)."""
+
+    def __init__(self, path: str):
+        """
+        :param path: Checkpoint file, truncated if it exists (a session is
+            always graded from the start).
+        """
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8', buffering=1)
+
+    def _append(self, event: str, **fields) -> None:
+        if self.file.closed:
+            return
+        fields['event'] = event
+        self.file.write(json.dumps(fields, ensure_ascii=False) + '\n')
+
+    def _append_test(self, event: str, test) -> None:
+        from formatting import truncate
+        from renderers import plain_message
+        grade, weight = test.get_grade()
+        messages = [truncate(plain_message(assertion), _max_message_length)
+                    for assertion in test.assertions if not assertion.status]
+        self._append(event, title=test.title, status=bool(test.status),
+                     skipped=test.skipped, grade=grade, weight=weight,
+                     messages=messages)
+
+    def group(self, group) -> None:
+        self._append('group', id=group.num, title=group.title,
+                     weight=group.weight)
+
+    def end_group(self) -> None:
+        self._append('endgroup')
+
+    def start(self, test) -> None:
+        self._append('start', title=test.title, weight=test.weight)
+
+    def test(self, test) -> None:
+        """Records a completed test."""
+        self._append_test('test', test)
+
+    def amend(self, test) -> None:
+        """Records the last test again, after an assertion was added."""
+        self._append_test('amend', test)
+
+    def finish(self, grade: float) -> None:
+        """Marks the session as complete and closes the file."""
+        self._append('end', grade=grade)
+        self.file.close()
+
+
+def default_checkpoint() -> Optional[Checkpoint]:
+    """Checkpoint set by the `PL_GRADER_CHECKPOINT` environment variable, if
+    any, which is removed from the environment of the student code."""
+    path = os.environ.pop(_env_var, None)
+    return Checkpoint(path) if path else None
+
+
+def read(path: str) -> List[dict]:
+    """
+    Reads the events of a checkpoint file, ignoring a truncated last line.
+
+    :return: List of events, empty if the file does not exist.
+    """
+    events = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    break
+    except OSError:
+        pass
+    return events
+
+
+def is_complete(events: List[dict]) -> bool:
+    return bool(events) and events[-1]['event'] == 'end'
+
+
+def _render_test(test: dict, indent: str = '') -> str:
+    from formatting import escape
+    if test.get('interrupted'):
+        status = 'interrompu'
+    elif test['skipped']:
+        status = 'non exécuté'
+    else:
+        status = 'succès' if test['status'] else 'échec'
+    title = test['title'] or ('Test en cours' if test.get('interrupted')
+                              else '')
+    lines = ['{}{} : {}'.format(indent, title, status)]
+    lines.extend('{}&nbsp;&nbsp;{}'.format(
+        indent, escape(message).replace('\n', '<br/>'))
+        for message in test['messages'])
+    return '<br/>'.join(lines)
+
+
+def recover(path: str) -> Tuple[float, str]:
+    """
+    Computes the grade and a compact HTML feedback of a (possibly
+    interrupted) session from its checkpoint.
+
+    :param path: Checkpoint file.
+    :return: tuple `(grade, feedback)`, the grade being out of 100
+        (bounded, since the file may have been forged, see the module's
+        documentation).
+    """
+    from formatting import escape
+    from test import group_grade, session_grade
+    events = read(path)
+    items = []  # top-level tests and groups (dictionaries with 'tests')
+    groups = {}  # groups by id, to add the tests of reopened groups
+    group = None
+    for event in events:
+        kind = event['event']
+        tests = group['tests'] if group is not None else items
+        if kind == 'group':
+            group = groups.get(event.get('id'))
+            if group is None:
+                group = dict(event, tests=[])
+                items.append(group)
+                if 'id' in event:
+                    groups[event['id']] = group
+        elif kind == 'endgroup':
+            group = None
+        elif kind == 'test':
+            tests.append(event)
+        elif kind == 'amend' and tests and 'tests' not in tests[-1]:
+            tests[-1] = event
+    interrupted = not is_complete(events)
+    running = interrupted and bool(events) and events[-1]['event'] == 'start'
+    if running:
+        # the test being run counts as failed
+        test = dict(events[-1], status=False, skipped=False, grade=0,
+                    weight=events[-1]['weight'] or 1, messages=[],
+                    interrupted=True)
+        (group['tests'] if group is not None else items).append(test)
+
+    grades = []
+    cards = []
+    for item in items:
+        if 'tests' in item:
+            grades.append(group_grade(
+                [(test['grade'], test['weight']) for test in item['tests']],
+                item['weight']))
+            passed = all(test['status'] for test in item['tests']
+                         if not test['skipped'])
+            body = '<br/>'.join(
+                ['<strong>{}</strong> : {}'.format(
+                    escape(item['title']), 'succès' if passed else 'échec')]
+                + [_render_test(test, '&nbsp;&nbsp;')
+                   for test in item['tests']])
+        else:
+            grades.append((item['grade'], item['weight']))
+            body = _render_test(item)
+        cards.append('<div class="card"><p>{}</p></div>'.format(body))
+    if running:
+        cards.append('<div class="card"><p>Correction interrompue : seuls '
+                     'les tests terminés sont pris en compte, le test en '
+                     'cours est considéré comme échoué.</p></div>')
+    elif interrupted:
+        cards.append('<div class="card"><p>Correction interrompue : seuls '
+                     'les tests terminés sont pris en compte.</p></div>')
+    return min(max(session_grade(grades), 0), 100), '\n'.join(cards)
+
+
+def completed_keys(directory: str, extension: str = '.jsonl'
+                   ) -> Dict[str, float]:
+    """
+    Lists the complete checkpoints of a cohort regrade.
+
+    :param directory: Directory containing one checkpoint per submission,
+        named after its key (e.g. `<student>.jsonl`).
+    :param extension: Extension of checkpoint files.
+    :return: Dictionary mapping the keys of complete checkpoints to their
+        grades.
+    """
+    res = {}
+    for name in os.listdir(directory):
+        if not name.endswith(extension):
+            continue
+        events = read(os.path.join(directory, name))
+        if is_complete(events):
+            res[name[:-len(extension)]] = events[-1]['grade']
+    return res
+
+
+if __name__ == "__main__":
+    import sys
+    import sandboxio
+
+    if not os.environ.get(_env_var):
+        print("La variable d'environnement {} doit désigner le fichier de "
+              "points de reprise".format(_env_var), file=sys.stderr)
+        sys.exit(1)
+    grade, feedback = recover(os.environ[_env_var])
+    sandboxio.output(grade, feedback)
@@ -5,12 +5,11 @@
 #
 #  Copyright 2019 Cisse Mamadou [mciissee@gmail.com]
 
-import importlib
-import inspect
 import json
-import random
 import sys
-import uuid
+
+# importlib, inspect, random and uuid are imported lazily: they are only
+# needed at build time, while this module is loaded by every grader run.
 
 
 def components_source():
@@ -19,6 +18,7 @@ def components_source():
     on the sandbox before a build
     """
 
+    import inspect
     mod = sys.modules[__name__]
     return inspect.getsource(mod)
 
@@ -55,6 +55,7 @@ class Component:
             setattr(self, k, v)
 
         if getattr(self, 'cid', '') == '':
+            import uuid
             self.cid = str(uuid.uuid4())
 
     def __str__(self):
@@ -86,6 +87,7 @@ class Component:
             decorator = data.get('decorator')
 
         if decorator:
+            import importlib
             module = importlib.import_module(decorator.lower())
             return getattr(module, decorator)(**data)
 
@@ -162,6 +164,7 @@ class SortList(Component):
 
         Then it will randomize the items
         """
+        import random
 
         # since self._answer starts with '_'
         # it will be hidden to the student
@@ -180,6 +183,7 @@ class SortList(Component):
 
         The method will split the items by using the argument separator.
         """
+        import uuid
         items = self.items.split(separator)
         self.items = []
         for e in items:
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Correction en lot des rendus d'un TP, à partir d'un module de référence.
+
+Chaque fichier .py du répertoire des rendus est corrigé dans son propre
+processus (au plus --processus à la fois, chacun limité à --delai secondes),
+de sorte qu'un rendu qui plante, boucle ou modifie son environnement
+n'affecte pas les autres. Pour chaque fonction publique du module de
+référence, le rendu est testé avec les doctests de la référence, et les
+fonctions manquantes, qui plantent, qui donnent des résultats faux, qui ne
+sont pas récursives (parmi celles indiquées par --recursives) ou dont la
+récursivité est infinie sont relevées, comme le fait corrlib.feedback. Le
+résumé est écrit au format CSV et/ou JSON.
+
+Exemple :
+
+    python3 corrbatch.py reference.py rendus/ --recursives somme,puissance \\
+        --csv resume.csv --json resume.json --autopep8
+"""
+import csv
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from doctest import DocTestRunner
+from inspect import getmembers, isfunction
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+
+from corrlib import (ErreurChargement, charger_fichier,
+                     charger_module_etudiant, completer_module, doctests_de,
+                     est_recursive, pretty_print)
+
+# catégories de fonctions problématiques (voir corrlib.feedback)
+CATEGORIES = ["manquantes", "plantent", "fausses", "non récursives",
+              "récursivité infinie"]
+
+# colonnes du résumé CSV
+COLONNES = ["etudiant", "statut", "tests", "echecs"] + CATEGORIES + \
+    ["message"]
+
+
+class _Testeur(DocTestRunner):
+    """DocTestRunner qui retient les exceptions levées par les exemples."""
+
+    def __init__(self):
+        DocTestRunner.__init__(self, verbose=False)
+        self.exceptions = []
+
+    def report_unexpected_exception(self, out, test, example, exc_info):
+        self.exceptions.append(exc_info[0])
+
+
+def fonctions_attendues(reference):
+    """Renvoie les fonctions publiques définies dans le module de
+    référence."""
+    return [fonction for nom, fonction in getmembers(reference, isfunction)
+            if not nom.startswith("_")
+            and fonction.__module__ == reference.__name__]
+
+
+def _resultat(fichier, statut="ok", message=""):
+    """Renvoie un résultat de correction vierge pour le fichier donné."""
+    resultat = {"etudiant": os.path.splitext(os.path.basename(fichier))[0],
+                "statut": statut, "tests": 0, "echecs": 0,
+                "message": message}
+    resultat.update((categorie, []) for categorie in CATEGORIES)
+    return resultat
+
+
+def _est_recursive_sur(tests, module):
+    """Renvoie True si l'un des exemples des doctests donnés, exécutés dans
+    le module spécifié, effectue des appels récursifs."""
+    for test in tests:
+        for exemple in test.examples:
+            globales = dict(vars(module))
+            try:
+                if est_recursive(lambda: exec(exemple.source, globales)):
+                    return True
+            except Exception:
+                pass
+    return False
+
+
+def corriger(fichier, reference, recursives=(), autopep8=False):
+    """Corrige le rendu d'un étudiant.
+
+    :param fichier: le fichier .py de l'étudiant
+    :param reference: le fichier .py de référence, dont les fonctions
+    publiques sont attendues et testées par leurs doctests
+    :param recursives: les noms des fonctions qui doivent être récursives
+    :param autopep8: True pour corriger automatiquement (par autopep8) les
+    mélanges de tabulations et d'espaces
+    :return: un dictionnaire décrivant le résultat (voir COLONNES)
+    """
+    resultat = _resultat(fichier)
+    module_reference = charger_fichier(reference, "reference")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(fichier)))
+    try:
+        module = charger_module_etudiant(fichier, autopep8=autopep8,
+                                         lever=True)
+    except ErreurChargement as exc:
+        return dict(resultat, statut="non chargé", message=str(exc))
+    except Exception as exc:
+        return dict(resultat, statut="non chargé",
+                    message="Exception au chargement : {!r}".format(exc))
+
+    fonctions = fonctions_attendues(module_reference)
+    resultat["manquantes"] = sorted(
+        completer_module(module, [fonction.__name__ for fonction in fonctions]))
+    for fonction in fonctions:
+        nom = fonction.__name__
+        if nom in resultat["manquantes"]:
+            continue
+        # doctests de la référence, exécutés dans le module de l'étudiant
+        tests = [doctests_de(fonction, vars(module))]
+        testeur = _Testeur()
+        for test in tests:
+            testeur.run(test, clear_globs=False)
+        resultat["tests"] += testeur.tries
+        resultat["echecs"] += testeur.failures
+        if RecursionError in testeur.exceptions:
+            resultat["récursivité infinie"].append(nom)
+        elif testeur.exceptions:
+            resultat["plantent"].append(nom)
+        elif testeur.failures:
+            resultat["fausses"].append(nom)
+        if nom in recursives and not _est_recursive_sur(tests, module):
+            resultat["non récursives"].append(nom)
+    return resultat
+
+
+def _travailleur(connexion, fichier, reference, options):
+    """Corrige un rendu dans un processus dédié, et envoie le résultat par
+    la connexion."""
+    sys.stdout = open(os.devnull, "w")  # affichages de l'étudiant
+    try:
+        resultat = corriger(fichier, reference, **options)
+    except BaseException as exc:
+        resultat = _resultat(fichier, "erreur",
+                             "Erreur du correcteur : {!r}".format(exc))
+    connexion.send(resultat)
+    connexion.close()
+
+
+def corriger_repertoire(repertoire, reference, processus=None, delai=30.,
+                        **options):
+    """Corrige tous les fichiers .py d'un répertoire, chacun dans son propre
+    processus.
+
+    :param repertoire: le répertoire des rendus
+    :param reference: le fichier .py de référence (voir corriger)
+    :param processus: le nombre maximal de corrections simultanées (par
+    défaut, le nombre de processeurs)
+    :param delai: la durée maximale de correction d'un rendu, en secondes
+    :param options: options de corriger (recursives, autopep8)
+    :return: la liste des résultats, par ordre alphabétique des fichiers
+    """
+    processus = processus or os.cpu_count() or 1
+    a_faire = sorted(os.path.join(repertoire, nom)
+                     for nom in os.listdir(repertoire) if nom.endswith(".py")
+                     and os.path.abspath(os.path.join(repertoire, nom))
+                     != os.path.abspath(reference))
+    resultats = {}
+    actifs = {}  # connexion -> (processus, fichier, échéance)
+    a_faire.reverse()
+    while a_faire or actifs:
+        while a_faire and len(actifs) < processus:
+            fichier = a_faire.pop()
+            lecture, ecriture = Pipe(duplex=False)
+            p = Process(target=_travailleur,
+                        args=(ecriture, fichier, reference, options),
+                        daemon=True)
+            p.start()
+            ecriture.close()
+            actifs[lecture] = (p, fichier, time.monotonic() + delai)
+
+        echeance = min(e for _, _, e in actifs.values())
+        for connexion in wait(list(actifs),
+                              max(0., echeance - time.monotonic())):
+            p, fichier, _ = actifs.pop(connexion)
+            try:
+                resultats[fichier] = connexion.recv()
+            except EOFError:
+                p.join()
+                resultats[fichier] = _resultat(
+                    fichier, "erreur", "Arrêt du processus de correction "
+                    "(code {})".format(p.exitcode))
+            connexion.close()
+            p.join()
+
+        maintenant = time.monotonic()
+        for connexion, (p, fichier, e) in list(actifs.items()):
+            if e <= maintenant:
+                p.kill()
+                p.join()
+                connexion.close()
+                del actifs[connexion]
+                resultats[fichier] = _resultat(
+                    fichier, "délai dépassé",
+                    "Correction interrompue après {:g} s".format(delai))
+    return [resultats[fichier] for fichier in sorted(resultats)]
+
+
+def ecrire_csv(resultats, chemin):
+    """Écrit le résumé des résultats au format CSV (listes de fonctions
+    séparées par des espaces)."""
+    with open(chemin, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, COLONNES)
+        writer.writeheader()
+        for resultat in resultats:
+            writer.writerow({cle: " ".join(valeur)
+                             if isinstance(valeur, list) else valeur
+                             for cle, valeur in resultat.items()})
+
+
+def ecrire_json(resultats, chemin):
+    """Écrit les résultats au format JSON."""
+    with open(chemin, "w", encoding="utf-8") as f:
+        json.dump(resultats, f, ensure_ascii=False, indent=1)
+
+
+def afficher(resultat):
+    """Affiche une ligne de résumé du résultat d'un étudiant."""
+    problemes = ["{} : {}".format(categorie, ", ".join(resultat[categorie]))
+                 for categorie in CATEGORIES if resultat[categorie]]
+    if resultat["statut"] != "ok":
+        problemes.insert(0, resultat["statut"])
+    pretty_print("{} ({}/{} tests réussis){}".format(
+        resultat["etudiant"], resultat["tests"] - resultat["echecs"],
+        resultat["tests"], "".join("; " + p for p in problemes)),
+        not problemes)
+
+
+def main(arguments=None):
+    parser = ArgumentParser(
+        prog="corrbatch",
+        description="Correction en lot des rendus d'un TP.",
+        formatter_class=ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("reference", help="le fichier .py de référence")
+    parser.add_argument("repertoire", help="le répertoire des rendus (.py)")
+    parser.add_argument("-r", "--recursives", type=str, default="",
+                        help="les fonctions qui doivent être récursives, "
+                        "séparées par des virgules")
+    parser.add_argument("-p", "--processus", type=int, default=None,
+                        help="le nombre de corrections simultanées (par "
+                        "défaut, le nombre de processeurs)")
+    parser.add_argument("-d", "--delai", type=float, default=30.,
+                        help="la durée maximale de correction d'un rendu (s)")
+    parser.add_argument("--autopep8", action="store_true",
+                        help="corriger automatiquement les mélanges de "
+                        "tabulations et d'espaces par autopep8")
+    parser.add_argument("--csv", type=str, default="",
+                        help="le fichier CSV du résumé")
+    parser.add_argument("--json", type=str, default="",
+                        help="le fichier JSON des résultats")
+    args = parser.parse_args(arguments)
+
+    recursives = [nom.strip() for nom in args.recursives.split(",")
+                  if nom.strip()]
+    resultats = corriger_repertoire(args.repertoire, args.reference,
+                                    args.processus, args.delai,
+                                    recursives=recursives,
+                                    autopep8=args.autopep8)
+    for resultat in resultats:
+        afficher(resultat)
+    if args.csv:
+        ecrire_csv(resultats, args.csv)
+    if args.json:
+        ecrire_json(resultats, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,11 @@ Auteur : Anthony Labarre
 import os
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from bdb import Bdb
-from doctest import DocTestRunner, DocTestFinder
+from doctest import DocTest, DocTestParser, DocTestRunner
 from importlib import import_module
+from importlib.util import module_from_spec, spec_from_file_location
 from platform import system
+from shutil import copyfile
 from subprocess import check_call
 from sys import settrace
 from traceback import format_exc
@@ -19,50 +21,92 @@ PAD = " " * 6  # la taille de "[ ? ]" + un espace
 SIGN = ["[ \033[1;31mx\033[0m ]", "[ \033[1;32mv\033[0m ]"]
 if system() == "Windows":
     SIGN = ["[ x ]", "[ v ]"]
+# exemples des doctests déjà analysés, par docstring (voir doctests_de)
+_exemples_analyses = {}
 
 
-def charger_module_etudiant(chemin, correction_deja_tentee=False):
-    """Charge et renvoie le module spécifié."""
+class ErreurChargement(Exception):
+    """Exception levée lorsque le module d'un étudiant ne peut pas être
+    chargé."""
+    pass
+
+
+def charger_module_etudiant(chemin, correction_deja_tentee=False,
+                            autopep8=None, lever=False):
+    """Charge et renvoie le module spécifié, par son nom ou par le chemin de
+    son fichier .py (il est alors chargé sous le nom "etudiant", sans être
+    ajouté à sys.modules, de sorte que plusieurs modules d'étudiants ne se
+    mélangent pas).
+
+    :param chemin: le nom du module, ou le chemin d'un fichier .py
+    :param correction_deja_tentee: True si autopep8 a déjà été appliqué
+    :param autopep8: True pour corriger automatiquement les mélanges de
+    tabulations et d'espaces par autopep8 s'il est disponible, False pour ne
+    pas le faire, None pour poser la question
+    :param lever: True pour lever ErreurChargement si le module ne peut pas
+    être chargé, False pour afficher l'erreur et quitter le programme
+    :return: le module chargé
+    :raise ErreurChargement: si le module ne peut pas être chargé (et que
+    lever vaut True)
+    """
     try:
+        if chemin.endswith(".py"):
+            return charger_fichier(chemin, "etudiant")
         return import_module(chemin)
-    except TabError:
-        print(
-            "\nImpossible de charger le module de l'étudiant à cause d'un "
-            "mélange de tabulations et d'espaces", end=""
-        )
+    except TabError as exc:
+        message = ("Impossible de charger le module de l'étudiant à cause "
+                   "d'un mélange de tabulations et d'espaces")
         if correction_deja_tentee:
-            print(
-                ", même après tentative de correction automatique par autopep8"
-            )
-            exit(-1)
+            echec_chargement(
+                message + ", même après tentative de correction automatique "
+                "par autopep8", exc, lever)
 
         if which("autopep8"):
-            reponse = prompt(
-                ".\n\tJ'ai détecté autopep8, voulez-vous que je tente de corriger "
-                "le fichier automatiquement?", ["o", "n"]
-            )
-            if reponse == "o":
-                correction_autopep8(chemin + ".py")
-                return charger_module_etudiant(chemin, True)
-
-        else:
-            print("; réglez le problème et relancez-moi ensuite.\n")
-
-        exit(-1)
-    except IndentationError:
-        print(
-            "\nImpossible de charger le module de l'étudiant à cause d'une "
-            "erreur d'indentation."
-        )
+            if autopep8 is None:
+                autopep8 = prompt(
+                    "\n" + message + ".\n\tJ'ai détecté autopep8, voulez-vous "
+                    "que je tente de corriger le fichier automatiquement?",
+                    ["o", "n"]
+                ) == "o"
+            if autopep8:
+                correction_autopep8(
+                    chemin if chemin.endswith(".py") else chemin + ".py")
+                return charger_module_etudiant(chemin, True, autopep8, lever)
+            echec_chargement(message, exc, lever)
+
+        echec_chargement(
+            message + " ; réglez le problème et relancez-moi ensuite", exc,
+            lever)
+    except IndentationError as exc:
+        echec_chargement(
+            "Impossible de charger le module de l'étudiant à cause d'une "
+            "erreur d'indentation : {}".format(exc), exc, lever, True)
+    except SyntaxError as exc:
+        echec_chargement(
+            "Impossible de charger le module de l'étudiant à cause d'une "
+            "erreur de syntaxe : {}".format(exc), exc, lever, True)
+
+
+def echec_chargement(message, exc, lever, details=False):
+    """Signale l'échec du chargement du module d'un étudiant (voir
+    charger_module_etudiant) : lève ErreurChargement si lever vaut True, et
+    sinon affiche le message (suivi de la dernière erreur si details vaut
+    True) et quitte le programme."""
+    if lever:
+        raise ErreurChargement(message) from exc
+    print("\n" + message + ".")
+    if details:
         montrer_derniere_erreur()
-        exit(-1)
-    except SyntaxError:
-        print(
-            "\nImpossible de charger le module de l'étudiant à cause d'une "
-            "erreur de syntaxe."
-        )
-        montrer_derniere_erreur()
-        exit(-1)
+    exit(-1)
+
+
+def charger_fichier(chemin, nom):
+    """Charge et renvoie le module défini par le fichier chemin, sous le nom
+    spécifié, sans l'ajouter à sys.modules."""
+    spec = spec_from_file_location(nom, chemin)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
 
 def completer_module(nom_module, fonctions_attendues):
@@ -93,6 +137,7 @@ def correction_autopep8(fichier):
     """Copie fichier vers fichier.BAK et tente de corriger automatiquement ce
     qui peut l'être via autopep8."""
     print("\tCopie de", fichier, "vers", fichier + ".BAK")
+    copyfile(fichier, fichier + ".BAK")
     print("\tCorrection de", fichier, "par autopep8")
     check_call(["autopep8", "-i", fichier])
 
@@ -183,14 +228,28 @@ def points_pour_doctests(un_module, fonction):
     :return: le nombre de tests qui ont été exécutés et le nombre de tests qui
     ont échoué
     """
-    total, echecs = 0, 0
     testeur = DocTestRunner(verbose=False)
-    for test in DocTestFinder().find(getattr(un_module, fonction.__name__)):
-        testeur.run(test)
-        total += testeur.tries
-        echecs += testeur.failures
+    testeur.run(doctests_de(getattr(un_module, fonction.__name__),
+                            vars(un_module)))
+    return testeur.tries, testeur.failures
 
-    return total, echecs
+
+def doctests_de(fonction, globs):
+    """Renvoie les doctests de la docstring de la fonction spécifiée, à
+    exécuter dans l'espace de noms globs (copié). Les docstrings ne sont
+    analysées qu'une fois.
+
+    :param fonction: la fonction dont la docstring contient les tests
+    :param globs: l'espace de noms des tests (typiquement, vars(un_module))
+    :return: un doctest.DocTest
+    """
+    docstring = fonction.__doc__ or ""
+    exemples = _exemples_analyses.get(docstring)
+    if exemples is None:
+        exemples = DocTestParser().get_examples(docstring, fonction.__name__)
+        _exemples_analyses[docstring] = exemples
+    return DocTest(exemples, dict(globs), fonction.__name__, None, None,
+                   docstring)
 
 
 def pretty_print(msg, success):
@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+Doctest examples as a source of tests.
+
+Exercises may give examples of use of the expected code in the doctest
+format, in their `doctests` key::
+
+    doctests==
+    >>> somme([1, 2, 3])
+    6
+    >>> somme([])
+    0
+    ==
+
+The builder parses them once per exercise instance (`parse`) and stores
+them compactly in the context under the `doctest_examples` key, so that the
+grader needs neither to parse them again nor to import the (slow to import)
+doctest module, except to compare outputs with doctest options (`check`).
+`TestSession.run_doctests` then runs each example as a test, in the
+namespace of the student code, as if it was typed in the interpreter after
+running the code.
+"""
+
+from typing import Callable, Dict, List
+
+# parsed examples, by doctest text
+_cache: Dict[str, List[list]] = {}
+
+
+def parse(text: str) -> List[list]:
+    """
+    Parses the doctest examples in `text` (memoized).
+
+    :param text: Text containing doctest examples (e.g. a docstring).
+    :return: List of examples `[source, want, exception, flags]`, where
+        `exception` is the name of the expected exception (or None) and
+        `flags` the doctest option flags enabled by directives.
+    """
+    examples = _cache.get(text)
+    if examples is None:
+        import doctest
+        examples = []
+        for example in doctest.DocTestParser().get_examples(text):
+            flags = 0
+            for flag, enabled in example.options.items():
+                if enabled:
+                    flags |= flag
+            exception = None
+            if example.exc_msg is not None:
+                # e.g. "ValueError: message" or "module.Error"
+                exception = example.exc_msg.split(':')[0].strip()
+                exception = exception.rsplit('.', 1)[-1]
+            examples.append([example.source, example.want, exception, flags])
+        _cache[text] = examples
+    return examples
+
+
+def check(flags: int = 0) -> Callable[[str, str], bool]:
+    """
+    Returns a comparison function of expected and actual outputs following
+    doctest rules with the given option flags (identical outputs are
+    accepted without importing the doctest module).
+    """
+    def cmp(want: str, got: str) -> bool:
+        if want == got:
+            return True
+        import doctest
+        return doctest.OutputChecker().check_output(want, got, flags)
+    return cmp
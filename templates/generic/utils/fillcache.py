@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Filling of a reference cache directory, outside of the sandbox.
+
+The grader only reads the cache directory named by `PL_REFERENCE_CACHE`
+(see the refcache module), since entries written by a grader could have
+been planted by the student code it runs. This trusted step builds an
+exercise and grades its reference solution in the tool's process, writing
+the outcome of each reference execution to the directory:
+
+    python3 fillcache.py CACHE exercise.pl solution.py
+
+The directory can then be mounted read-only in the sandboxes grading the
+exercise.
+"""
+
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import plsandbox
+import refcache
+from backends import InProcessBackend
+
+
+def fill(directory: str, exercise: str, solution: str,
+         timeout: float = 60.) -> int:
+    """
+    Fills a cache directory with the reference executions of an exercise,
+    by grading its reference solution (trusted) in the current process.
+
+    :param directory: Cache directory.
+    :param exercise: .pl file of the exercise.
+    :param solution: Reference solution.
+    :return: Number of entries written.
+    """
+    context, files, _ = plsandbox.load_pl(exercise)
+    cache = refcache.ReferenceCache(os.path.abspath(directory),
+                                    writable=True)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='plrefcache-') as sandbox:
+        plsandbox.prepare_sandbox(files, sandbox)
+        built, _ = plsandbox.build(sandbox, context, timeout)
+        backend = InProcessBackend(sandbox)
+        # the cache used by the grader's modules
+        refcache._default_cache = cache
+        try:
+            backend.grade(solution, built['grader'], built)
+        finally:
+            os.chdir(cwd)
+    return sum(os.path.exists(cache._path(key)) for key in cache.memory)
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('cache', help='cache directory')
+    parser.add_argument('exercise', help='.pl file of the exercise')
+    parser.add_argument('solution', help='file of the reference solution')
+    parser.add_argument('--timeout', type=float, default=60.,
+                        help='timeout of the build and grading (s)')
+    args = parser.parse_args()
+    with open(args.solution, encoding='utf-8') as f:
+        solution = f.read()
+    try:
+        count = fill(args.cache, args.exercise, solution, args.timeout)
+    except plsandbox.PLError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print("{} entries written".format(count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# coding: utf-8
+"""
+Change detection between global states.
+
+`Test.summarize_changes` compares the state of the tested program before
+and after each run. Comparing with `!=` alone is both wasteful and
+incorrect in some cases:
+
+- objects of classes without `__eq__` (typically classes defined by the
+  student) compare by identity, so that a deep copy of an unchanged object
+  always looks modified;
+- `__eq__` may raise, or return a non-boolean value (e.g. arrays).
+
+`changed` compares values with identity short-circuits (values kept
+unchanged by a deep copy, such as strings, numbers and tuples of those, are
+shared) and per-type fast paths: containers are first compared with `!=`
+(in C), and only walked, up to the first changed item, when it reports a
+difference. Structural fingerprints (see `fingerprint`) are only computed
+for values which `!=` reports as different. Objects compared by identity
+are compared attribute by attribute, which is the only case where unchanged
+values are walked (`!=` would report them all as modified).
+
+Run this module to benchmark it on large nested structures.
+"""
+
+import pickle
+from hashlib import blake2b
+from typing import Any, Optional
+
+# types compared directly with !=
+_scalar_types = frozenset((type(None), bool, int, float, complex, str, bytes,
+                           range))
+
+# maximal nesting depth of fingerprinted values
+_max_depth = 100
+
+# missing key of a dictionary
+_missing = object()
+
+
+class _Unknown(Exception):
+    """Raised when a value cannot be fingerprinted."""
+    pass
+
+
+def _feed(h, value: Any, depth: int, seen: set) -> None:
+    """Feeds a structural description of `value` to the hash `h`."""
+    if depth > _max_depth:
+        raise _Unknown
+    cls = type(value)
+    h.update(cls.__qualname__.encode() + b'\0')
+    if cls in _scalar_types:
+        h.update(value.encode('utf-8', 'surrogatepass') if cls is str
+                 else value if cls is bytes else repr(value).encode())
+        h.update(b'\0')
+        return
+    if id(value) in seen:
+        h.update(b'<cycle>')
+        return
+    seen.add(id(value))
+    try:
+        if cls in (list, tuple, dict):
+            try:
+                # fast path: containers of builtin values are serialized by
+                # pickle in C
+                h.update(pickle.dumps(value, 4))
+                return
+            except Exception:
+                pass
+            items = value.items() if cls is dict else value
+            h.update(str(len(value)).encode() + b'[')
+            for item in items:
+                _feed(h, item, depth + 1, seen)
+            h.update(b']')
+        elif cls in (set, frozenset):
+            # order-insensitive: sorted fingerprints of the elements
+            digests = sorted(_digest(item, depth + 1, seen) for item in value)
+            h.update(str(len(value)).encode() + b'{' + b''.join(digests))
+        elif hasattr(value, '__dict__') or hasattr(cls, '__slots__'):
+            attributes = dict(getattr(value, '__dict__', {}))
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(value, name):
+                    attributes[name] = getattr(value, name)
+            _feed(h, attributes, depth + 1, seen)
+        else:
+            raise _Unknown
+    finally:
+        seen.discard(id(value))
+
+
+def _digest(value: Any, depth: int, seen: set) -> bytes:
+    h = blake2b(digest_size=16)
+    _feed(h, value, depth, seen)
+    return h.digest()
+
+
+def fingerprint(value: Any) -> Optional[bytes]:
+    """
+    Returns a structural fingerprint of `value`: equal values of builtin
+    types (and objects whose attributes are equal) have equal fingerprints,
+    and different values have different fingerprints with overwhelming
+    probability.
+
+    Dictionaries with the same items in a different order, and equal values
+    of different types (e.g. 1 and 1.0), have different fingerprints.
+
+    :param value: Any value.
+    :return: A 16-byte digest, or None if the value cannot be fingerprinted
+        (e.g. functions, modules, files).
+    """
+    try:
+        return _digest(value, 0, set())
+    except (_Unknown, RecursionError):
+        return None
+
+
+def _by_identity(cls: type) -> bool:
+    """Whether instances of `cls` are compared by identity (no `__eq__`)."""
+    return cls.__eq__ is object.__eq__ and cls.__ne__ is object.__ne__
+
+
+def _differ(old: Any, new: Any, depth: int) -> bool:
+    """Generic comparison: `!=`, confirmed structurally when `!=` reports a
+    difference or fails."""
+    try:
+        if not bool(old != new):
+            return False
+    except Exception:
+        pass
+    old_fp = fingerprint(old)
+    return old_fp is None or old_fp != fingerprint(new)
+
+
+def changed(old: Any, new: Any, depth: int = 0) -> bool:
+    """
+    Returns whether `new` differs from `old`, where `old` is usually a deep
+    copy of `new` taken before running some code.
+
+    :param old: Previous value.
+    :param new: Current value.
+    :param depth: Current nesting depth (recursive calls).
+    :return: False if the values are identical, equal or structurally equal
+        (see `fingerprint`), True otherwise.
+    """
+    if old is new:
+        return False
+    cls = type(old)
+    if cls is not type(new):
+        return _differ(old, new, depth)
+    if cls in _scalar_types:
+        return old != new
+    if cls in (list, tuple, dict):
+        if len(old) != len(new):
+            return True
+        try:
+            # fast path, in C: equal containers are not walked
+            if not bool(old != new):
+                return False
+        except Exception:
+            pass
+        if depth >= _max_depth:
+            return True
+        # the difference may come from items compared by identity: look for
+        # an item which really changed (stops at the first one); with equal
+        # lengths, finding every old key in the new dictionary means that
+        # the keys are the same
+        if cls is dict:
+            for key, value in old.items():
+                other = new.get(key, _missing)
+                if other is _missing or (
+                        value is not other
+                        and changed(value, other, depth + 1)):
+                    return True
+            return False
+        for a, b in zip(old, new):
+            if a is not b and changed(a, b, depth + 1):
+                return True
+        return False
+    if (_by_identity(cls) and hasattr(old, '__dict__')
+            and depth < _max_depth):
+        # `!=` is always true for distinct objects compared by identity:
+        # compare their attributes instead
+        return changed(vars(old), vars(new), depth + 1)
+    return _differ(old, new, depth)
+
+
+def _benchmark(repeat: int = 3) -> None:
+    """Compares `changed` with plain `!=` on large nested structures."""
+    import time
+    from copy import deepcopy
+
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    state = {
+        'matrix': [[i * j for j in range(100)] for i in range(2000)],
+        'records': {str(i): {'id': i, 'tags': ['a', 'b'], 'score': i / 3}
+                    for i in range(50000)},
+        'text': 'x' * 10 ** 7,
+        'numbers': tuple(range(10 ** 6)),
+        'points': [Point(i, -i) for i in range(20000)],
+    }
+    before = deepcopy(state)
+    state['records']['17']['score'] = 0.
+
+    def run(function, key):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            res = function(before[key], state[key])
+            best = min(best, time.perf_counter() - start)
+        return best * 1000, res
+
+    # points are unchanged, but != compares them by identity
+    print("{:<10} {:>18} {:>18}".format('', '!=', 'changed'))
+    for key in state:
+        print("{:<10} {:8.1f} ms {!s:<6} {:8.1f} ms {!s:<6}".format(
+            key, *run(lambda old, new: old != new, key), *run(changed, key)))
+    start = time.perf_counter()
+    for value in state.values():
+        fingerprint(value)
+    print("{:<10} {:8.1f} ms  (all values)".format(
+        'fingerprint', (time.perf_counter() - start) * 1000))
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+Read-only data shared between tests (fixtures).
+
+Values declared with `TestSession.set_fixture` are frozen once: lists and
+dictionaries are replaced by `FrozenList` and `FrozenDict` instances, sets
+by frozensets and tuples are frozen item by item. Frozen values are their
+own copies (`copy.copy` and `copy.deepcopy` return them unchanged), so that
+they are shared by all tests instead of being deep-copied before each run.
+
+Methods which would modify a frozen value raise a `FixtureError` (a
+`TypeError`), and the attempt is recorded so that the test can report it
+(see `Test.run`). Modifications bypassing these methods (such as
+`list.append(value, x)`) are not detected.
+"""
+
+from typing import Any, List
+
+
+class FixtureError(TypeError):
+    """Exception raised when student code tries to modify a fixture."""
+    pass
+
+
+# names of the fixtures whose modification was attempted since the last call
+# to reset_attempts()
+attempts: List[str] = []
+
+
+def reset_attempts() -> None:
+    attempts.clear()
+
+
+def _refuse(value, *args, **kwargs):
+    attempts.append(value.name)
+    raise FixtureError("{} est une donnée partagée en lecture seule".format(
+        value.name))
+
+
+class FrozenList(list):
+    """Read-only list (see the module's documentation)."""
+    __slots__ = ('name',)
+
+    def __init__(self, iterable=(), name: str = ''):
+        super().__init__(iterable)
+        self.name = name
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _refuse
+    append = extend = insert = pop = remove = clear = sort = reverse = _refuse
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenList, (list(self), self.name)
+
+
+class FrozenDict(dict):
+    """Read-only dictionary (see the module's documentation)."""
+    __slots__ = ('name',)
+
+    def __init__(self, mapping=(), name: str = ''):
+        super().__init__(mapping)
+        self.name = name
+
+    __setitem__ = __delitem__ = __ior__ = _refuse
+    clear = pop = popitem = setdefault = update = _refuse
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self), self.name)
+
+
+# types of values which are immutable as such
+_immutable_types = (type(None), bool, int, float, complex, str, bytes, range,
+                    frozenset)
+
+
+def freeze(value: Any, name: str) -> Any:
+    """
+    Returns a read-only equivalent of `value`.
+
+    :param value: Value made of builtin types (numbers, strings, lists,
+        tuples, dictionaries, sets).
+    :param name: Name of the fixture, used in error messages.
+    :return: Frozen value, equal to `value`.
+    :raise ValueError: If `value` contains values of other types.
+    """
+    if isinstance(value, (FrozenList, FrozenDict)) or \
+            type(value) in _immutable_types:
+        return value
+    if type(value) is list:
+        return FrozenList((freeze(item, name) for item in value), name)
+    if type(value) is tuple:
+        return tuple(freeze(item, name) for item in value)
+    if type(value) is dict:
+        return FrozenDict(((key, freeze(item, name))
+                           for key, item in value.items()), name)
+    if type(value) is set:
+        return frozenset(value)
+    raise ValueError("Type non pris en charge pour la donnée partagée "
+                     "{} : {}".format(name, type(value).__name__))
@@ -0,0 +1,133 @@
+# coding: utf-8
+"""
+Bounded formatting of values for feedback.
+
+Student code may leave arbitrarily large values in the global state (or
+produce arbitrarily large outputs), which are shown in feedback. Values are
+thus formatted with `reprlib`-style limits on nesting depth, number of items
+and string size, and HTML-escaped, so that the size of the feedback does not
+depend on the size of the state.
+
+Within a `scope()` (typically the rendering of a session), formatted values
+are memoized by identity, so that a large value shown in the feedback of
+several tests is only formatted once.
+"""
+
+import reprlib
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+# limits on formatted values (see reprlib.Repr)
+LIMITS = {
+    "maxlevel": 3,
+    "maxlist": 10, "maxtuple": 10, "maxset": 10, "maxfrozenset": 10,
+    "maxdeque": 10, "maxarray": 10,
+    "maxdict": 10,
+    "maxstring": 80,
+    "maxlong": 40,
+    "maxother": 80,
+}
+
+# maximal length of formatted texts (program outputs, messages...)
+MAX_TEXT_LENGTH = 2000
+
+# integers with more bits are not converted to decimal (which is quadratic,
+# and limited by sys.set_int_max_str_digits)
+_max_int_bits = 4096
+
+
+class BoundedRepr(reprlib.Repr):
+    """`reprlib.Repr` with the feedback limits, also bounding huge
+    integers."""
+
+    def __init__(self):
+        super().__init__()
+        for name, limit in LIMITS.items():
+            setattr(self, name, limit)
+
+    def repr_int(self, x, level):
+        if x.bit_length() > _max_int_bits:
+            return "<entier de {} bits>".format(x.bit_length())
+        return super().repr_int(x, level)
+
+    # read-only fixtures (see the fixtures module)
+    repr_FrozenList = reprlib.Repr.repr_list
+    repr_FrozenDict = reprlib.Repr.repr_dict
+
+
+_repr = BoundedRepr()
+
+
+def escape(text: str) -> str:
+    """Escapes HTML special characters in `text` (like `html.escape` with
+    quote=False, without importing the html package)."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+# memoized formatted values, by identity (None outside of a scope)
+_memo: Optional[Dict[Tuple[int, bool, bool], Tuple[Any, str]]] = None
+
+
+@contextmanager
+def scope():
+    """
+    Memoizes formatted values by identity until the end of the (outermost)
+    scope. Values must not be modified within the scope.
+    """
+    global _memo
+    if _memo is not None:
+        yield
+        return
+    _memo = {}
+    try:
+        yield
+    finally:
+        _memo = None
+
+
+def bounded_repr(value: Any) -> str:
+    """Bounded representation of `value` (not escaped)."""
+    return _repr.repr(value)
+
+
+def format_value(value: Any, quote: bool = True, html: bool = True) -> str:
+    """
+    Formats `value` for feedback, with bounded size.
+
+    :param value: Any value.
+    :param quote: Whether strings are quoted (as with repr) or not (as with
+        str).
+    :param html: Whether the result is HTML-escaped.
+    :return: Bounded representation of `value`.
+    """
+    key = (id(value), quote, html)
+    if _memo is not None and key in _memo:
+        return _memo[key][1]
+    if isinstance(value, str) and not quote:
+        text = truncate(value, LIMITS["maxstring"])
+    else:
+        text = _repr.repr(value)
+    if html:
+        text = escape(text)
+    if _memo is not None:
+        # the value is kept so that its identity is not reused
+        _memo[key] = (value, text)
+    return text
+
+
+def truncate(text: str, limit: int = MAX_TEXT_LENGTH) -> str:
+    """Truncates `text` to about `limit` characters, mentioning its full
+    length."""
+    if len(text) <= limit:
+        return text
+    return "{}... ({} caractères au total)".format(text[:limit], len(text))
+
+
+def format_text(text: str, limit: int = MAX_TEXT_LENGTH,
+                html: bool = True) -> str:
+    """
+    Formats a text (e.g. a program output) for feedback: truncates it to
+    `limit` characters and HTML-escapes it.
+    """
+    text = truncate(text, limit)
+    return escape(text) if html else text
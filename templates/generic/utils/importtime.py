@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Import-time budget check for the grader.
+
+Every submission is graded by a fresh interpreter, so the time spent
+importing `grader` (and through it `test`, `mockinput`, `sandboxio`...) is
+paid once per submission. This script measures it with `python -X importtime`
+and fails if it exceeds a budget, or if a module which is supposed to be
+imported lazily gets imported eagerly.
+
+Usage: python3 importtime.py [--budget MS] [--runs N] [--module NAME]
+"""
+
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from statistics import median
+
+_template_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_utils_dir = os.path.join(_template_dir, 'utils')
+
+# modules which must not be imported when loading the grader
+LAZY_MODULES = ('ast', 'ast_analyzer', 'difflib', 'importlib.util', 'inspect',
+                'jinja2', 'jsonpickle', 'random', 'traceback', 'unittest.mock',
+                'uuid')
+
+
+def _run(code: str):
+    """Run `code` in a fresh interpreter with `-X importtime`, from the
+    template directory, and return the (stdout, stderr) pair."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [_template_dir, _utils_dir] + env.get('PYTHONPATH', '').split(
+            os.pathsep))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=_template_dir, env=env, capture_output=True,
+                          text=True, check=True)
+    return proc.stdout, proc.stderr
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Parse the output of `-X importtime` into a dictionary mapping module
+    names to `(self, cumulative, depth)` tuples (times in microseconds)."""
+    res = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumul_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        res[name.strip()] = (int(self_us), int(cumul_us), depth)
+    return res
+
+
+def total_time(modules: dict) -> int:
+    """Total import time in microseconds (sum of top-level imports)."""
+    return sum(cumul for _, cumul, depth in modules.values() if depth == 0)
+
+
+def measure(module: str, runs: int = 5):
+    """
+    Measure the import time of `module` (in microseconds) in `runs` fresh
+    interpreters, net of the interpreter's own startup imports.
+
+    :return: tuple `(median_time, modules, loaded)` where `modules` is the
+        parsed importtime report of the last run restricted to modules
+        imported by `module`, and `loaded` the list of all loaded modules.
+    """
+    code = "import sys, {}; print(' '.join(sys.modules))".format(module)
+    times = []
+    for _ in range(runs):
+        _, base = _run('pass')
+        out, err = _run(code)
+        base_modules = parse_importtime(base)
+        modules = {name: val for name, val in parse_importtime(err).items()
+                   if name not in base_modules}
+        times.append(total_time(modules))
+    return median(times), modules, out.split()
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--module', default='grader',
+                        help='module whose import time is measured')
+    parser.add_argument('--budget', type=float, default=50.,
+                        help='maximum import time in milliseconds')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of measures (the median is kept)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest modules to display')
+    args = parser.parse_args()
+
+    elapsed, modules, loaded = measure(args.module, args.runs)
+    slowest = sorted(modules.items(), key=lambda item: -item[1][0])
+    print("Slowest modules (self time):")
+    for name, (self_us, cumul_us, _) in slowest[:args.top]:
+        print("  {:<30} {:>8.1f} ms {:>8.1f} ms".format(
+            name, self_us / 1000, cumul_us / 1000))
+
+    ok = True
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        print("Eagerly imported modules: " + ", ".join(eager))
+        ok = False
+    print("Import time of {}: {:.1f} ms (budget: {:.1f} ms)".format(
+        args.module, elapsed / 1000, args.budget))
+    if elapsed / 1000 > args.budget:
+        print("Budget exceeded")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Line coverage of the student code by the tests of a session.
+
+When the `PL_GRADER_COVERAGE` environment variable is set, the student code
+is compiled once under the file name `<student>` and the lines it executes
+during each test (`Test.run`, code and expression, but neither the
+reference code nor the student module) are collected and aggregated over
+the session. The report is written as JSON next to the feedback file
+(`feedback.coverage.json` for `feedback.html`), and if the variable is set
+to `html`, an annotated listing of the code (lines never executed
+highlighted) is also appended to the feedback, e.g. for teachers checking
+which branches of a submission the tests did not exercise.
+
+Collection uses the cheapest available mechanism: with Python 3.12 or
+later, `sys.monitoring` line events, restricted to the code objects of the
+student code and disabled for each line once it has been executed, so that
+loops run at full speed after their first iteration (a few percent of
+overhead on loop-heavy exercises). Otherwise, a `sys.settrace` tracer only
+traces the frames of the student code and stops tracing lines in a frame
+once all lines of its code are covered, but a loop followed by lines not
+executed yet is traced on every iteration (several times slower), so that
+coverage should only be left on in production with Python 3.12 or later (a
+warning is written on stderr when it is enabled without `sys.monitoring`).
+
+Authors may check that the tests of an exercise cover its reference
+solution (or any other code) by grading it locally:
+
+    python3 linecov.py exercise.pl solution.py [--json]
+
+which exits with status 2 if some lines were never executed.
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+_env_var = 'PL_GRADER_COVERAGE'
+
+# file name of the compiled student code
+FILENAME = '<student>'
+
+
+def _code_objects(code) -> list:
+    """Code objects of some compiled code, including nested ones."""
+    res, todo = [], [code]
+    while todo:
+        code = todo.pop()
+        res.append(code)
+        todo.extend(const for const in code.co_consts
+                    if hasattr(const, 'co_code'))
+    return res
+
+
+def _lines(code) -> Set[int]:
+    """Numbers of the lines holding instructions of a code object."""
+    if hasattr(code, 'co_lines'):
+        return {line for _, _, line in code.co_lines() if line}
+    from dis import findlinestarts
+    return {line for _, line in findlinestarts(code) if line}
+
+
+class _Monitor:
+    """Collector based on `sys.monitoring` (Python 3.12+)."""
+
+    def __init__(self, codes: list, lines: Set[int]):
+        self.codes = codes
+        self.lines = lines
+        self.tool = sys.monitoring.COVERAGE_ID
+
+    def _line(self, code, line: int):
+        self.lines.add(line)
+        # the event is not emitted again for this line
+        return sys.monitoring.DISABLE
+
+    def start(self) -> None:
+        monitoring = sys.monitoring
+        monitoring.use_tool_id(self.tool, 'linecov')
+        monitoring.register_callback(self.tool, monitoring.events.LINE,
+                                     self._line)
+        for code in self.codes:
+            monitoring.set_local_events(self.tool, code,
+                                        monitoring.events.LINE)
+
+    def stop(self) -> None:
+        monitoring = sys.monitoring
+        for code in self.codes:
+            monitoring.set_local_events(self.tool, code, 0)
+        monitoring.register_callback(self.tool, monitoring.events.LINE, None)
+        monitoring.free_tool_id(self.tool)
+
+
+class _Tracer:
+    """Collector based on `sys.settrace`."""
+
+    def __init__(self, codes: list, lines: Set[int]):
+        self.lines = lines
+        # lines of each code object not executed yet
+        self.remaining = {code: _lines(code) - lines for code in codes}
+        self.previous = None
+
+    def _call(self, frame, event, arg):
+        remaining = self.remaining.get(frame.f_code)
+        if not remaining:
+            return None
+        lines = self.lines
+
+        def trace_lines(frame, event, arg):
+            if event == 'line':
+                lines.add(frame.f_lineno)
+                remaining.discard(frame.f_lineno)
+                if not remaining:
+                    frame.f_trace_lines = False
+            return trace_lines
+        return trace_lines
+
+    def start(self) -> None:
+        self.previous = sys.gettrace()
+        sys.settrace(self._call)
+
+    def stop(self) -> None:
+        sys.settrace(self.previous)
+
+
+class LineCoverage:
+    """Lines of some code executed by the tests of a session."""
+
+    def __init__(self, code: str, show: bool = False):
+        """
+        :param code: Student code.
+        :param show: Whether the annotated listing is appended to the
+            feedback (see `TestSession.measure_coverage`).
+        """
+        self.code = code
+        self.show = show
+        self.lines: Set[int] = set()
+        self._compiled = None
+        self._collector = None
+
+    def compiled(self):
+        """Code object of the student code (compiled on first use), whose
+        execution is measured."""
+        if self._compiled is None:
+            self._compiled = compile(self.code, FILENAME, 'exec')
+        return self._compiled
+
+    @contextmanager
+    def collect(self):
+        """Collects the lines executed in this context."""
+        if self._collector is None:
+            codes = _code_objects(self.compiled())
+            # the tracer is used when another tool (e.g. coverage.py)
+            # holds the coverage tool identifier
+            cls = _Monitor if hasattr(sys, 'monitoring') and \
+                sys.monitoring.get_tool(sys.monitoring.COVERAGE_ID) is None \
+                else _Tracer
+            self._collector = cls(codes, self.lines)
+        self._collector.start()
+        try:
+            yield self
+        finally:
+            self._collector.stop()
+
+    def executable(self) -> Set[int]:
+        """Numbers of the lines holding code."""
+        res = set()
+        for code in _code_objects(self.compiled()):
+            res |= _lines(code)
+        return res
+
+    def report(self) -> Dict[str, object]:
+        """Coverage report, as a JSON-serializable dictionary."""
+        executable = self.executable()
+        executed = self.lines & executable
+        return {'executable': sorted(executable),
+                'executed': sorted(executed),
+                'missing': sorted(executable - executed),
+                'percent': round(100 * len(executed) / len(executable), 1)
+                if executable else 100.}
+
+    def _annotated(self) -> List[tuple]:
+        """Lines of the code, with their numbers and whether they were
+        executed (None for lines without code)."""
+        executable = self.executable()
+        return [(number, line, number in self.lines
+                 if number in executable else None)
+                for number, line in enumerate(self.code.splitlines(), 1)]
+
+    def render_text(self) -> str:
+        """Listing of the code, lines never executed marked with `!`."""
+        marks = {True: ' ', False: '!', None: ' '}
+        return '\n'.join('{}{:4} {}'.format(marks[executed], number, line)
+                         for number, line, executed in self._annotated())
+
+    def render_html(self) -> str:
+        """HTML card with the listing of the code, lines never executed
+        highlighted."""
+        from formatting import escape
+        report = self.report()
+        lines = []
+        for number, line, executed in self._annotated():
+            text = '{:4}  {}'.format(number, escape(line))
+            if executed is False:
+                text = ('<span style="background-color:LightPink;">{}'
+                        '</span>').format(text)
+            lines.append(text)
+        return ('<div class="card"><p>Couverture du code par les tests : '
+                '{} lignes exécutées sur {} ({:g} %)</p>'
+                '<pre>{}</pre></div>').format(
+                    len(report['executed']), len(report['executable']),
+                    report['percent'], '\n'.join(lines))
+
+    def write(self, path: str) -> None:
+        """Writes the report as JSON."""
+        import json
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+def default_coverage(code: str) -> Optional[LineCoverage]:
+    """Coverage set by the `PL_GRADER_COVERAGE` environment variable, if
+    any (see the module's documentation about the cost of collecting it
+    without `sys.monitoring`)."""
+    mode = os.environ.get(_env_var, '')
+    if not mode:
+        return None
+    if not hasattr(sys, 'monitoring'):
+        print("{} sans sys.monitoring (Python < 3.12) : la couverture est "
+              "collectée avec sys.settrace (plusieurs fois plus "
+              "lent)".format(_env_var), file=sys.stderr)
+    return LineCoverage(code, show=mode == 'html')
+
+
+def sidecar_path(feedback_path: str) -> str:
+    """Path of the coverage report written next to `feedback_path`."""
+    return os.path.splitext(feedback_path)[0] + '.coverage.json'
+
+
+def main() -> int:
+    import json
+    import tempfile
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    import plsandbox
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('exercise', help='.pl file of the exercise')
+    parser.add_argument('code', help='file of the code to grade')
+    parser.add_argument('--json', action='store_true',
+                        help='output the JSON report instead of a listing')
+    parser.add_argument('--timeout', type=float, default=60.,
+                        help='timeout of the build and grading (s)')
+    args = parser.parse_args()
+
+    with open(args.code, encoding='utf-8') as f:
+        code = f.read()
+    context, files, _ = plsandbox.load_pl(args.exercise)
+    with tempfile.TemporaryDirectory(prefix='pllinecov-') as directory:
+        plsandbox.prepare_sandbox(files, directory)
+        built, _ = plsandbox.build(directory, context, args.timeout)
+        graded = plsandbox.grade(directory, built, code, args.timeout,
+                                 env={_env_var: 'json'})
+        path = sidecar_path(os.path.join(directory, 'feedback.html'))
+        if not os.path.exists(path):
+            print("No coverage report:\n" + (graded.process.stderr
+                                              or graded.feedback),
+                  file=sys.stderr)
+            return 1
+        with open(path) as f:
+            report = json.load(f)
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        coverage = LineCoverage(code)
+        coverage.lines = set(report['executed'])
+        print(coverage.render_text())
+        print("Grade: {}, lines executed: {} of {} ({:g} %)".format(
+            graded.grade, len(report['executed']),
+            len(report['executable']), report['percent']))
+    # in both modes, lines never executed are reported by the exit code
+    return 0 if not report['missing'] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Load test of a grader node.
+
+Submissions drawn from a mix of exercises and behaviours (the canned
+submissions of the benchmark: correct, wrong, slow, crashing and
+output-flooding programs) arrive at a target rate for a given duration, and
+are graded by one of the following targets:
+
+- `sandbox`: each submission is graded through the sandbox contract
+  (context and answers files, grader.py run with its four file arguments,
+  see plsandbox), by at most `--concurrency` simultaneous processes;
+- `async`: submissions are graded by `aiograder.AsyncGrader`s (one per
+  exercise) running in this process, as a grading service would;
+- `batch`: all submissions are queued at once and graded by `--concurrency`
+  regrade workers (see regrade), arrival times being ignored.
+
+The load is open-loop: arrivals do not wait for previous submissions to be
+graded, so that the latency of a submission (from its arrival to its
+result) includes the time spent waiting for a free worker, and an
+overloaded node shows as growing latencies rather than as a lower arrival
+rate. Throughput, latency percentiles, error rate and peak memory per
+grading are reported, overall and per behaviour.
+
+Usage: python3 loadtest.py [--target sandbox|async|batch] [--rate R]
+                           [--duration S] [--concurrency N] [--mix SPEC]
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+import plsandbox
+from benchmark import SUBMISSIONS, percentile
+
+_template_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_repository_dir = os.path.dirname(os.path.dirname(_template_dir))
+
+Request = namedtuple('Request', ['exercise', 'kind', 'code'])
+Request.__doc__ = """A submission of the load: exercise (name), behaviour and
+student code."""
+
+Outcome = namedtuple('Outcome', ['request', 'grade', 'latency', 'service',
+                                 'maxrss', 'error'])
+Outcome.__doc__ = """Result of a submission: grade (None on error), latency
+from arrival to result and grading time (s), peak memory of the grading (kB,
+None if unknown) and error message (or None)."""
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parses a behaviour mix such as 'correct=5,wrong=2,slow=1'."""
+    mix = {}
+    for item in spec.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind != 'correct' and kind not in SUBMISSIONS:
+            raise ValueError("Unknown behaviour: {}".format(kind))
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def arrivals(rate: float, duration: float, poisson: bool,
+             rng: random.Random) -> List[float]:
+    """Arrival times (s from the start) of submissions at `rate` per second,
+    evenly spaced or following a Poisson process."""
+    times, t = [], 0.
+    while True:
+        t += rng.expovariate(rate) if poisson else 1 / rate
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+class Catalogue:
+    """Built exercises of the load, with the submissions of each
+    behaviour."""
+
+    def __init__(self, paths: List[str], root: str, timeout: float):
+        self.directory = tempfile.mkdtemp(prefix='plload-')
+        self.exercises: Dict[str, Tuple[List[str], dict]] = {}
+        self.submissions: Dict[str, Dict[str, str]] = {}
+        for path in paths:
+            name = os.path.relpath(path, root)
+            context, files, _ = plsandbox.load_pl(path)
+            directory = os.path.join(self.directory, str(len(self.exercises)))
+            plsandbox.prepare_sandbox(files, directory)
+            built, _ = plsandbox.build(directory, context, timeout)
+            self.exercises[name] = files, built
+            self.submissions[name] = dict(SUBMISSIONS)
+            solution = plsandbox.solution_of(context)
+            if solution is not None:
+                self.submissions[name]['correct'] = solution
+
+    def requests(self, count: int, mix: Dict[str, float],
+                 rng: random.Random) -> List[Request]:
+        """Draws `count` submissions, uniformly among exercises and
+        following `mix` among behaviours (exercises without solution have
+        no correct submission)."""
+        res = []
+        names = sorted(self.exercises)
+        while len(res) < count:
+            name = rng.choice(names)
+            kinds = [kind for kind in mix if kind in self.submissions[name]]
+            if not kinds:
+                raise ValueError("No behaviour of the mix applies to " + name)
+            kind = rng.choices(kinds, [mix[kind] for kind in kinds])[0]
+            res.append(Request(name, kind, self.submissions[name][kind]))
+        return res
+
+    def close(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def run_sandbox(catalogue: Catalogue, requests: List[Request],
+                times: List[float], concurrency: int,
+                timeout: float) -> List[Outcome]:
+    """Grades each request through the sandbox contract, in one of
+    `concurrency` sandbox copies per exercise."""
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+    slots = {}
+    for name, (files, _) in catalogue.exercises.items():
+        slots[name] = queue.Queue()
+        for i in range(concurrency):
+            slots[name].put(plsandbox.prepare_sandbox(files, os.path.join(
+                catalogue.directory, 'slots', name, str(i))))
+
+    def grade(request: Request, arrival: float) -> Outcome:
+        directory = slots[request.exercise].get()
+        try:
+            built = catalogue.exercises[request.exercise][1]
+            res = plsandbox.grade(directory, built, request.code, timeout)
+        except plsandbox.PLError as e:
+            return Outcome(request, None, time.perf_counter() - arrival,
+                           None, None, str(e))
+        finally:
+            slots[request.exercise].put(directory)
+        error = None
+        if res.grade is None:
+            error = 'timeout' if res.process.timeout else \
+                (res.process.stderr.strip().splitlines() or ['no grade'])[-1]
+        return Outcome(request, res.grade, time.perf_counter() - arrival,
+                       res.process.elapsed, res.process.maxrss, error)
+
+    futures = []
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        for request, t in zip(requests, times):
+            delay = start + t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(grade, request, start + t))
+    return [future.result() for future in futures]
+
+
+def run_async(catalogue: Catalogue, requests: List[Request],
+              times: List[float], concurrency: int,
+              timeout: float) -> List[Outcome]:
+    """Grades the requests with an `AsyncGrader` of this process per
+    exercise, each in its own sandbox (sharing `concurrency` simultaneous
+    gradings)."""
+    import asyncio
+    import resource
+    from contextlib import AsyncExitStack
+    import aiograder
+    directories = {}
+    for i, (name, (files, _)) in enumerate(catalogue.exercises.items()):
+        directories[name] = plsandbox.prepare_sandbox(
+            files, os.path.join(catalogue.directory, 'async', str(i)))
+    cwd = os.getcwd()
+
+    async def grade(graders, slots, request: Request,
+                    arrival: float) -> Outcome:
+        await asyncio.sleep(max(0., arrival - time.perf_counter()))
+        built = catalogue.exercises[request.exercise][1]
+        begin = time.perf_counter()
+        try:
+            async with slots:
+                grade_value, _ = await graders[request.exercise].grade(
+                    request.code, built['grader'], built)
+            error = None
+        except aiograder.BackendError as e:
+            grade_value, error = None, str(e).strip()[-200:]
+        end = time.perf_counter()
+        return Outcome(request, grade_value, end - arrival, end - begin,
+                       None, error)
+
+    async def main() -> List[Outcome]:
+        slots = asyncio.Semaphore(concurrency)
+        async with AsyncExitStack() as stack:
+            graders = {name: await stack.enter_async_context(
+                           aiograder.AsyncGrader(directory, concurrency,
+                                                 timeout))
+                       for name, directory in directories.items()}
+            start = time.perf_counter()
+            return await asyncio.gather(*[
+                grade(graders, slots, request, start + t)
+                for request, t in zip(requests, times)])
+    try:
+        outcomes = asyncio.run(main())
+    finally:
+        os.chdir(cwd)
+    # peak memory of the largest worker
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return [outcome._replace(maxrss=maxrss) for outcome in outcomes]
+
+
+def run_batch(catalogue: Catalogue, requests: List[Request],
+              concurrency: int, timeout: float,
+              root: str) -> List[Outcome]:
+    """Grades the requests with regrade workers (arrival times are ignored,
+    latencies being grading times)."""
+    from multiprocessing import Pool
+    import regrade
+    queue_dir = os.path.join(catalogue.directory, 'queue')
+    regrade.plan(queue_dir, [{'key': str(i), 'exercise': request.exercise,
+                              'code': request.code}
+                             for i, request in enumerate(requests)],
+                 max(1, len(requests) // (4 * concurrency)))
+    work_args = (queue_dir, root, timeout, 300., 1, 0.)
+    with Pool(concurrency) as pool:
+        pool.map(regrade._work_in_process, [work_args] * concurrency)
+    results = regrade.merge(queue_dir)
+    outcomes = []
+    for i, request in enumerate(requests):
+        res = results.get(str(i), {'grade': None, 'error': 'not graded'})
+        outcomes.append(Outcome(request, res['grade'], res.get('elapsed', 0.),
+                                res.get('elapsed'), res.get('maxrss'),
+                                res.get('error') and
+                                res['error'].strip().splitlines()[-1]))
+    return outcomes
+
+
+def summarize(outcomes: List[Outcome], elapsed: float) -> dict:
+    """Throughput, latency percentiles, error rate and peak memory of
+    `outcomes`, graded in `elapsed` seconds."""
+    latencies = [outcome.latency for outcome in outcomes]
+    memories = [outcome.maxrss for outcome in outcomes
+                if outcome.maxrss is not None]
+    errors = [outcome for outcome in outcomes if outcome.error is not None]
+    return {'count': len(outcomes),
+            'throughput': len(outcomes) / elapsed if elapsed else 0.,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies),
+            'errors': len(errors),
+            'error_rate': len(errors) / len(outcomes),
+            'maxrss_p50': percentile(memories, 50) if memories else None,
+            'maxrss_max': max(memories) if memories else None}
+
+
+def print_report(summaries: Dict[str, dict]) -> None:
+    header = "{:<10} {:>6} {:>8} {:>7} {:>7} {:>7} {:>7} {:>7} {:>10}"
+    row = "{:<10} {:>6} {:>8.2f} {:>7.3f} {:>7.3f} {:>7.3f} {:>7.3f} " \
+          "{:>7.1%} {:>10}"
+    print(header.format('kind', 'count', 'per s', 'p50', 'p90', 'p99', 'max',
+                        'errors', 'maxrss'))
+    for kind, s in summaries.items():
+        print(row.format(kind, s['count'], s['throughput'], s['p50'],
+                         s['p90'], s['p99'], s['max'], s['error_rate'],
+                         s['maxrss_max'] if s['maxrss_max'] is not None
+                         else '-'))
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--exercises',
+                        default=os.path.join(_repository_dir, 'exercises'),
+                        help='directory searched for exercises')
+    parser.add_argument('--template',
+                        default=os.path.join(_template_dir, 'generic.pl'),
+                        help='template the exercises must extend')
+    parser.add_argument('--only', default='',
+                        help='only use exercises whose path contains this')
+    parser.add_argument('--target', default='sandbox',
+                        choices=('sandbox', 'async', 'batch'),
+                        help='how submissions are graded')
+    parser.add_argument('--rate', type=float, default=2.,
+                        help='submissions per second')
+    parser.add_argument('--duration', type=float, default=30.,
+                        help='duration of the arrivals (s)')
+    parser.add_argument('--poisson', action='store_true',
+                        help='Poisson arrivals instead of evenly spaced ones')
+    parser.add_argument('--concurrency', type=int,
+                        default=os.cpu_count() or 1,
+                        help='simultaneous gradings')
+    parser.add_argument('--mix',
+                        default='correct=4,wrong=3,slow=1,crashing=1,'
+                        'flooding=1',
+                        help='weights of the submission behaviours')
+    parser.add_argument('--timeout', type=float, default=30.,
+                        help='timeout of a single build or grading (s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random draws')
+    parser.add_argument('--json', help='write the summaries to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    paths = [path for path in plsandbox.discover(args.exercises,
+                                                 args.template)
+             if args.only in os.path.relpath(path, args.exercises)]
+    if not paths:
+        print("No exercise found", file=sys.stderr)
+        return 1
+    times = arrivals(args.rate, args.duration, args.poisson, rng)
+    if not times:
+        print("No submission arrives within the duration: increase --rate "
+              "or --duration", file=sys.stderr)
+        return 1
+    catalogue = Catalogue(paths, args.exercises, args.timeout)
+    try:
+        requests = catalogue.requests(len(times), parse_mix(args.mix), rng)
+        start = time.perf_counter()
+        if args.target == 'sandbox':
+            outcomes = run_sandbox(catalogue, requests, times,
+                                   args.concurrency, args.timeout)
+        elif args.target == 'async':
+            outcomes = run_async(catalogue, requests, times,
+                                 args.concurrency, args.timeout)
+        else:
+            outcomes = run_batch(catalogue, requests, args.concurrency,
+                                 args.timeout, args.exercises)
+        elapsed = time.perf_counter() - start
+    finally:
+        catalogue.close()
+
+    summaries = {'all': summarize(outcomes, elapsed)}
+    for kind in sorted({outcome.request.kind for outcome in outcomes}):
+        summaries[kind] = summarize([outcome for outcome in outcomes
+                                     if outcome.request.kind == kind],
+                                    elapsed)
+    print_report(summaries)
+    errors = {}
+    for outcome in outcomes:
+        if outcome.error is not None:
+            errors[outcome.error] = errors.get(outcome.error, 0) + 1
+    for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print("{:>5} x {}".format(count, error))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Mutation testing of the validation script of an exercise.
+
+A validation script is too weak when wrong code gets the grade of a correct
+one. `mutants` derives variants of the reference solution of an exercise by
+changing one thing at a time in its syntax tree:
+
+- `operator`: an arithmetic operator replaced by another (`+` and `-`, `*`
+  and `/`, `//` and `/`, `%` and `//`, `**` and `*`), in expressions and
+  augmented assignments;
+- `comparison`: a comparison flipped (`<` and `<=`, `>` and `>=`, `==` and
+  `!=`, `in` and `not in`, `is` and `is not`);
+- `range`: an argument of `range` shifted by one (off-by-one errors);
+
+and `run` grades each of them with the validation script of the exercise
+(through `grader.grade_this`): mutants which get the grade of the solution
+survive, and point at cases the tests miss (unless the mutant is equivalent
+to the solution, e.g. a flipped comparison of values which are never
+equal).
+
+Since there are often hundreds of mutants per exercise, the exercise is
+built once, the validation script is compiled once, and the solution is
+first graded in the tool's process, which imports the grader modules,
+loads the feedback templates and fills the cache of reference executions
+(see the refcache module, and the fillcache tool to persist it for the
+grader).
+Mutants are then graded in parallel, each in a child process forked from
+this warmed-up process (see aiograder), killed after `--timeout` seconds (a
+mutant which times out is detected, as the platform would not grade it
+either):
+
+    python3 mutation.py exercise.pl [--solution solution.py] [--jobs N]
+
+The solution is read from the exercise if it is not given (its `solution`
+key, or a `solution = "..."` assignment in its grader, see
+`plsandbox.solution_of`).
+"""
+
+import ast
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple
+from copy import deepcopy
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import plsandbox
+
+Mutant = namedtuple('Mutant', ['kind', 'line', 'description', 'code'])
+Mutant.__doc__ = """Variant of some code: kind of mutation, line of the
+mutated node, description of the mutation and mutated code."""
+
+MutantResult = namedtuple('MutantResult', ['mutant', 'grade', 'error'])
+MutantResult.__doc__ = """Grade of a mutant (None if it could not be
+graded, `error` then telling why)."""
+
+_operators = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+              ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**'}
+_operator_swaps = {ast.Add: ast.Sub, ast.Sub: ast.Add, ast.Mult: ast.Div,
+                   ast.Div: ast.Mult, ast.FloorDiv: ast.Div,
+                   ast.Mod: ast.FloorDiv, ast.Pow: ast.Mult}
+
+_comparisons = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+                ast.Eq: '==', ast.NotEq: '!=', ast.In: 'in',
+                ast.NotIn: 'not in', ast.Is: 'is', ast.IsNot: 'is not'}
+_comparison_swaps = {ast.Lt: ast.LtE, ast.LtE: ast.Lt, ast.Gt: ast.GtE,
+                     ast.GtE: ast.Gt, ast.Eq: ast.NotEq, ast.NotEq: ast.Eq,
+                     ast.In: ast.NotIn, ast.NotIn: ast.In,
+                     ast.Is: ast.IsNot, ast.IsNot: ast.Is}
+
+# a mutation: kind, description and function mutating (a copy of) the node
+Mutation = Tuple[str, str, Callable[[ast.AST], None]]
+
+
+def _shifted(node: ast.expr, delta: int) -> ast.expr:
+    """Expression `node + delta`."""
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return ast.Constant(node.value + delta)
+    return ast.BinOp(node, ast.Add() if delta > 0 else ast.Sub(),
+                     ast.Constant(abs(delta)))
+
+
+def _mutations(node: ast.AST) -> Iterator[Mutation]:
+    """Mutations applicable to a node."""
+    if isinstance(node, (ast.BinOp, ast.AugAssign)):
+        swap = _operator_swaps.get(type(node.op))
+        if swap is not None:
+            def apply(node, swap=swap):
+                node.op = swap()
+            yield ('operator', '{} replaced by {}'.format(
+                _operators[type(node.op)], _operators[swap]), apply)
+    elif isinstance(node, ast.Compare):
+        for i, op in enumerate(node.ops):
+            swap = _comparison_swaps.get(type(op))
+            if swap is not None:
+                def apply(node, i=i, swap=swap):
+                    node.ops[i] = swap()
+                yield ('comparison', '{} replaced by {}'.format(
+                    _comparisons[type(op)], _comparisons[swap]), apply)
+    elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+          and node.func.id == 'range'):
+        for i in range(len(node.args)):
+            for delta in (1, -1):
+                def apply(node, i=i, delta=delta):
+                    node.args[i] = _shifted(node.args[i], delta)
+                yield ('range', 'argument {} of range {:+d}'.format(
+                    i + 1, delta), apply)
+
+
+def mutants(code: str) -> List[Mutant]:
+    """
+    Mutants of some code, one per applicable mutation (see the module's
+    documentation), without duplicates.
+
+    :raise SyntaxError: If the code cannot be parsed.
+    """
+    tree = ast.parse(code)
+    original = ast.unparse(tree)
+    seen = {original}
+    res = []
+    for index, node in enumerate(ast.walk(tree)):
+        for kind, description, apply in _mutations(node):
+            mutated = deepcopy(tree)
+            # ast.walk visits the copy in the same order
+            target = next(islice(ast.walk(mutated), index, None))
+            apply(target)
+            text = ast.unparse(mutated) + '\n'
+            if text in seen:
+                continue
+            seen.add(text)
+            res.append(Mutant(kind, getattr(node, 'lineno', None),
+                              description, text))
+    return res
+
+
+def prepare(exercise: str, directory: str, timeout: float = 60.) -> dict:
+    """Builds an exercise in a sandbox directory, returning its built
+    context."""
+    context, files, _ = plsandbox.load_pl(exercise)
+    plsandbox.prepare_sandbox(files, directory)
+    built, _ = plsandbox.build(directory, context, timeout)
+    return built
+
+
+async def _grade_all(directory: str, codes: List[str], tests, context: dict,
+                     jobs: Optional[int], timeout: Optional[float]) -> list:
+    from aiograder import AsyncGrader
+    async with AsyncGrader(directory, concurrency=jobs, timeout=timeout,
+                           backend='fork') as grader:
+        return await asyncio.gather(
+            *(grader.grade(code, tests, context) for code in codes),
+            return_exceptions=True)
+
+
+def run(directory: str, context: dict, solution: str,
+        jobs: Optional[int] = None, timeout: Optional[float] = 10.
+        ) -> Tuple[float, List[MutantResult]]:
+    """
+    Grades the mutants of a solution.
+
+    :param directory: Sandbox directory of the built exercise (becomes the
+        current directory).
+    :param context: Built context of the exercise.
+    :param solution: Reference solution.
+    :param jobs: Number of mutants graded simultaneously (defaults to the
+        number of CPUs).
+    :param timeout: Time after which the grading of a mutant is stopped (s).
+    :return: tuple `(grade, results)`, where `grade` is the grade of the
+        solution and `results` the results of its mutants.
+    """
+    from backends import InProcessBackend
+    # the script is compiled once for all gradings (exec accepts code
+    # objects as well as source)
+    tests = compile(context['grader'], '<grader>', 'exec')
+    backend = InProcessBackend(directory)
+    grade, _ = backend.grade(solution, tests, context)
+    variants = mutants(solution)
+    grades = asyncio.run(_grade_all(directory, [m.code for m in variants],
+                                    tests, context, jobs, timeout))
+    results = [MutantResult(mutant, None, str(outcome))
+               if isinstance(outcome, Exception)
+               else MutantResult(mutant, outcome[0], None)
+               for mutant, outcome in zip(variants, grades)]
+    return grade, results
+
+
+def survivors(grade: float, results: List[MutantResult]
+              ) -> List[MutantResult]:
+    """Mutants graded at least as well as the solution."""
+    return [result for result in results
+            if result.grade is not None and result.grade >= grade]
+
+
+def print_report(solution: str, grade: float,
+                 results: List[MutantResult]) -> None:
+    lines = solution.splitlines()
+    alive = survivors(grade, results)
+    errors = sum(result.grade is None for result in results)
+    print("Solution grade: {}".format(grade))
+    if grade < 100:
+        print("Warning: the solution does not get the maximal grade, the "
+              "solution or the validation script is wrong")
+    print("Mutants: {}, detected: {} (of which not graded: {}), "
+          "surviving: {}".format(len(results), len(results) - len(alive),
+                                 errors, len(alive)))
+    if results:
+        print("Mutation score: {:.0f} %".format(
+            100 * (len(results) - len(alive)) / len(results)))
+    for result in alive:
+        mutant = result.mutant
+        source = lines[mutant.line - 1].strip() \
+            if mutant.line and mutant.line <= len(lines) else ''
+        print("  line {} [{}] {}: {}".format(mutant.line, mutant.kind,
+                                            mutant.description, source))
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('exercise', help='.pl file of the exercise')
+    parser.add_argument('--solution',
+                        help='file of the reference solution (defaults to '
+                             'the solution of the exercise)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='number of mutants graded simultaneously '
+                             '(defaults to the number of CPUs)')
+    parser.add_argument('--timeout', type=float, default=10.,
+                        help='timeout of the grading of a mutant (s)')
+    parser.add_argument('--json', action='store_true',
+                        help='output the results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='plmutation-') as directory:
+        try:
+            context = prepare(args.exercise, directory)
+        except plsandbox.PLError as e:
+            print(e, file=sys.stderr)
+            return 1
+        if args.solution:
+            with open(args.solution, encoding='utf-8') as f:
+                solution = f.read()
+        else:
+            solution = plsandbox.solution_of(context)
+        if not solution:
+            print("No solution: use --solution or define the solution of "
+                  "the exercise", file=sys.stderr)
+            return 1
+        cwd = os.getcwd()
+        try:
+            grade, results = run(directory, context, solution, args.jobs,
+                                 args.timeout)
+        finally:
+            os.chdir(cwd)
+    if args.json:
+        print(json.dumps({'grade': grade, 'mutants': [
+            dict(result.mutant._asdict(), grade=result.grade,
+                 error=result.error) for result in results]},
+            ensure_ascii=False, indent=1))
+    else:
+        print_report(solution, grade, results)
+    return 2 if survivors(grade, results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
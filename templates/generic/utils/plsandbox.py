@@ -0,0 +1,354 @@
+# coding: utf-8
+"""
+Local reproduction of the sandbox contract, for tools which build and grade
+exercises outside of the platform (benchmarks, load tests, batch regrading).
+
+- `load_pl` reads a `.pl` file and the files it extends into a context
+  dictionary (only the subset of the PL syntax used in this repository);
+- `prepare_sandbox` creates a directory containing the files declared with
+  `@` in the exercise and its templates, as the platform does;
+- `build` and `grade` run `builder.py` and `grader.py` in that directory
+  with the usual file arguments and collect their outputs.
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+_utils_dir = os.path.dirname(os.path.abspath(__file__))
+
+# files provided by the platform itself rather than declared with @
+PLATFORM_FILES = [os.path.join(_utils_dir, 'components.py')]
+
+_multiline_re = re.compile(r'^([\w.]+)\s*==\s*(#\|\w+\|)?\s*$')
+_component_re = re.compile(r'^([\w.]+)\s*=:\s*(\w+)\s*$')
+_value_re = re.compile(r'^([\w.]+)\s*=\s*(.*)$')
+_file_re = re.compile(r'^@\s*(\S+)')
+
+
+class PLError(Exception):
+    """Exception raised when a .pl file cannot be loaded."""
+    pass
+
+
+def resolve(path: str, base_dir: str) -> str:
+    """
+    Resolves a path found in a .pl file located in `base_dir`.
+
+    Paths are tried relatively to `base_dir` then to each of its ancestors
+    (exercises may have been moved to subdirectories), and paths starting
+    with '/' relatively to the ancestors only.
+
+    :return: Absolute path of an existing file.
+    """
+    directory = os.path.abspath(base_dir)
+    while True:
+        candidate = os.path.normpath(os.path.join(directory, path.lstrip('/')))
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise PLError("Fichier introuvable : {} (depuis {})".format(
+                path, base_dir))
+        directory = parent
+
+
+def _set(context: dict, key: str, value) -> None:
+    """Sets `key` in `context`, where dotted keys denote component
+    attributes."""
+    if '.' in key:
+        name, attr = key.split('.', 1)
+        context.setdefault(name, {})[attr] = value
+    else:
+        context[key] = value
+
+
+def parse_pl(path: str) -> Tuple[dict, List[str], Optional[str]]:
+    """
+    Parses a single .pl file.
+
+    :return: tuple `(context, files, extends)`, where `files` are the
+        absolute paths of files declared with @, and `extends` the absolute
+        path of the extended file (or None).
+    """
+    from components import SELECTORS
+    base_dir = os.path.dirname(os.path.abspath(path))
+    context, files, extends = {}, [], None
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        match = _multiline_re.match(stripped)
+        if match:
+            end = i
+            while end < len(lines) and lines[end].rstrip() != '==':
+                end += 1
+            _set(context, match.group(1), '\n'.join(lines[i:end]) + '\n')
+            i = end + 1
+            continue
+        match = _file_re.match(stripped)
+        if match:
+            files.append(resolve(match.group(1), base_dir))
+            continue
+        match = _component_re.match(stripped)
+        if match:
+            name, cls = match.groups()
+            context[name] = {'cid': str(uuid.uuid4()),
+                             'selector': SELECTORS.get(cls, cls)}
+            continue
+        match = _value_re.match(stripped)
+        if match:
+            key, value = match.groups()
+            if key == 'extends':
+                extends = resolve(value.strip(), base_dir)
+            else:
+                _set(context, key, value.strip())
+            continue
+        raise PLError("{}:{}: ligne incorrecte : {}".format(path, i, line))
+    return context, files, extends
+
+
+def load_pl(path: str) -> Tuple[dict, List[str], List[str]]:
+    """
+    Loads a .pl file and the files it extends (keys of the extending file
+    take precedence, component attributes are merged).
+
+    :return: tuple `(context, files, chain)` where `chain` lists the
+        absolute paths of the loaded .pl files, from `path` to the root
+        template.
+    """
+    chain, contexts, files = [], [], []
+    current = os.path.abspath(path)
+    while current is not None:
+        if current in chain:
+            raise PLError("Héritage cyclique : " + current)
+        chain.append(current)
+        context, own_files, current = parse_pl(current)
+        contexts.append(context)
+        files = own_files + files
+    merged = {}
+    for context in reversed(contexts):
+        for key, value in context.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key].update(value)
+            else:
+                merged[key] = value
+    return merged, files, chain
+
+
+def solution_of(context: dict) -> Optional[str]:
+    """
+    Returns the reference solution of an exercise: its `solution` key, or a
+    `solution = "..."` string assignment in its grader or testcases script.
+    """
+    import ast
+    if 'solution' in context:
+        return context['solution']
+    for key in ('grader', 'testcases'):
+        try:
+            tree = ast.parse(context.get(key, ''))
+        except SyntaxError:
+            continue
+        for node in tree.body:
+            if (isinstance(node, ast.Assign)
+                    and any(isinstance(target, ast.Name)
+                            and target.id == 'solution'
+                            for target in node.targets)
+                    and isinstance(node.value, ast.Constant)
+                    and isinstance(node.value.value, str)):
+                return node.value.value
+    return None
+
+
+def discover(directory: str, template: str) -> List[str]:
+    """Returns the sorted paths of the .pl files under `directory` whose
+    extends chain reaches `template`."""
+    template = os.path.abspath(template)
+    found = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith('.pl'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                _, _, chain = load_pl(path)
+            except PLError:
+                continue
+            if template in chain and path != template:
+                found.append(path)
+    return sorted(found)
+
+
+def prepare_sandbox(files: List[str], directory: str) -> str:
+    """Copies `files` (and the platform files) at the root of `directory`,
+    which is created if needed."""
+    os.makedirs(directory, exist_ok=True)
+    for path in PLATFORM_FILES + files:
+        shutil.copy(path, os.path.join(directory, os.path.basename(path)))
+    return directory
+
+
+ProcessResult = namedtuple('ProcessResult', ['returncode', 'stdout', 'stderr',
+                                             'elapsed', 'maxrss', 'timeout'])
+ProcessResult.__doc__ = """Outcome of a sandboxed script: return code, standard
+streams, wall-clock time (s), peak memory (kB) and whether it was killed."""
+
+
+# The peak memory reported by wait4 includes the memory of the parent at fork
+# time, so on Linux scripts are started through this launcher which reports
+# the VmHWM (peak resident memory since exec) of the process when it exits.
+_launcher = """
+import atexit, runpy, sys
+def _report():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                with open('.maxrss', 'w') as f:
+                    f.write(line.split()[1])
+atexit.register(_report)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+_use_launcher = os.path.exists('/proc/self/status')
+
+
+def run_script(args: List[str], directory: str, timeout: float = 60.,
+               env: Optional[Dict[str, str]] = None,
+               grace: float = 1.) -> ProcessResult:
+    """
+    Runs `python3 *args` in `directory` and measures its wall-clock time and
+    peak resident memory.
+
+    After `timeout` seconds, the script is sent SIGTERM (so that the grader
+    can output partial feedback), then killed `grace` seconds later.
+    """
+    out_path = os.path.join(directory, '.stdout')
+    err_path = os.path.join(directory, '.stderr')
+    rss_path = os.path.join(directory, '.maxrss')
+    if os.path.exists(rss_path):
+        os.remove(rss_path)
+    command = [sys.executable] + (['-c', _launcher] if _use_launcher else [])
+    with open(out_path, 'wb') as out, open(err_path, 'wb') as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command + args, cwd=directory,
+                                stdout=out, stderr=err,
+                                env=dict(os.environ, **(env or {})))
+        timed_out = threading.Event()
+
+        def terminate():
+            timed_out.set()
+            proc.terminate()
+            killer.start()
+
+        timer = threading.Timer(timeout, terminate)
+        killer = threading.Timer(grace, proc.kill)
+        timer.start()
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+        finally:
+            timer.cancel()
+            killer.cancel()
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    with open(out_path, errors='replace') as out, \
+            open(err_path, errors='replace') as err:
+        stdout, stderr = out.read(), err.read()
+    maxrss = usage.ru_maxrss
+    if os.path.exists(rss_path):
+        with open(rss_path) as f:
+            maxrss = int(f.read())
+    return ProcessResult(proc.returncode, stdout, stderr, elapsed,
+                         maxrss, timed_out.is_set())
+
+
+def build(directory: str, context: dict, timeout: float = 60.,
+          env: Optional[Dict[str, str]] = None) -> Tuple[dict, ProcessResult]:
+    """
+    Runs builder.py on `context` in `directory`.
+
+    :return: tuple `(built_context, process_result)`.
+    """
+    with open(os.path.join(directory, 'pl.json'), 'w') as f:
+        json.dump(context, f)
+    res = run_script(['builder.py', 'pl.json', 'built.json'], directory,
+                     timeout, env)
+    if res.returncode != 0:
+        raise PLError("Échec de la construction :\n" + res.stderr)
+    with open(os.path.join(directory, 'built.json')) as f:
+        return json.load(f), res
+
+
+def _output_grade(res: ProcessResult) -> Optional[int]:
+    """Grade output by a grader (last line of its output), if any."""
+    try:
+        return int(res.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return None
+
+
+GradeResult = namedtuple('GradeResult', ['grade', 'feedback', 'process',
+                                         'recovered_grade'],
+                         defaults=(None,))
+GradeResult.__doc__ = """Grade output by the grader (None if it failed),
+feedback, process result, and grade recovered from the checkpoint (None
+unless the grader failed after starting the session)."""
+
+
+def grade(directory: str, context: dict, code: str, timeout: float = 60.,
+          env: Optional[Dict[str, str]] = None,
+          checkpoint: Optional[str] = None) -> GradeResult:
+    """
+    Runs grader.py on a built `context` and student `code` in `directory`
+    (the answer is sent through the `editor` component).
+
+    :param checkpoint: Checkpoint file of the session (see the checkpoint
+        module), removed first if it exists. If the grader fails to output a
+        grade (e.g. it was killed) after starting the session, the grade
+        and feedback are recovered from the checkpoint. The recovered
+        grade is kept apart from the grade, as the checkpoint is written
+        while the student code runs and should not be trusted as is.
+    :return: A `GradeResult`, whose grade is None if the grader failed.
+    """
+    if 'editor' not in context:
+        raise PLError("Pas de composant editor dans l'exercice")
+    with open(os.path.join(directory, 'context.json'), 'w') as f:
+        json.dump(context, f)
+    with open(os.path.join(directory, 'answers.json'), 'w') as f:
+        json.dump({context['editor']['cid']: {'code': code}}, f)
+    feedback_path = os.path.join(directory, 'feedback.html')
+    if os.path.exists(feedback_path):
+        os.remove(feedback_path)
+    if checkpoint is not None:
+        # a checkpoint left by a previous grading must not be recovered as
+        # the result of this one
+        checkpoint = os.path.join(directory, checkpoint)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        env = dict(env or {}, PL_GRADER_CHECKPOINT=checkpoint)
+    args = ['context.json', 'answers.json', 'processed.json', 'feedback.html']
+    res = run_script(['grader.py'] + args, directory, timeout, env)
+    grade_value = _output_grade(res)
+    recovered = None
+    if grade_value is None and checkpoint is not None \
+            and os.path.exists(checkpoint):
+        recovered = _output_grade(
+            run_script(['checkpoint.py'] + args, directory, timeout, env))
+    feedback = ''
+    if os.path.exists(feedback_path):
+        with open(feedback_path, errors='replace') as f:
+            feedback = f.read()
+    return GradeResult(grade_value, feedback, res, recovered)
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Static checks of the student code, run before any test.
+
+`check` parses the code once and verifies the structural requirements of
+the exercise, given by the following keys of its context:
+
+- `required_functions`: names of the functions the code must define at top
+  level (list, or string of names separated by commas or spaces);
+- `forbidden`: constructs the code must not use, among the keys of
+  `CONSTRUCTS` (e.g. 'while', 'import'), any other name denoting a function
+  which must not be called (e.g. 'sorted', 'eval').
+
+If the code cannot be compiled (syntax, indentation or tabulation error,
+including those only detected once parsed, such as `return` outside of a
+function or a misplaced `nonlocal`) or does not meet the requirements,
+grading stops there with a grade of 0 and a standard feedback giving the
+location of each problem, before the test session is set up, the student
+module imported or the Jinja2 templates rendered. Otherwise, the parsed
+tree is handed to the session (`TestSession.ast`). Parsing goes through
+`compile` and the built-in `_ast` module, so that the (slower to import)
+`ast` module is not needed.
+"""
+
+import _ast
+from typing import Dict, Iterable, List, Tuple, Union
+
+import formatting
+
+# forbidden constructs, by name
+CONSTRUCTS = {
+    'while': (_ast.While,),
+    'for': (_ast.For, _ast.AsyncFor),
+    'comprehension': (_ast.ListComp, _ast.SetComp, _ast.DictComp,
+                      _ast.GeneratorExp),
+    'lambda': (_ast.Lambda,),
+    'import': (_ast.Import, _ast.ImportFrom),
+    'global': (_ast.Global, _ast.Nonlocal),
+    'class': (_ast.ClassDef,),
+    'try': (_ast.Try,),
+    'with': (_ast.With, _ast.AsyncWith),
+}
+
+# titles of parsing errors, from the most specific class
+_error_titles = ((TabError, "Mélange de tabulations et d'espaces"),
+                 (IndentationError, "Erreur d'indentation"),
+                 (SyntaxError, "Erreur de syntaxe"))
+
+# results of check, by code and requirements
+_cache: Dict[tuple, 'Precheck'] = {}
+
+
+class Precheck:
+    """Result of the static checks of some code."""
+
+    def __init__(self, tree=None, problems: List[str] = ()):
+        """
+        :param tree: Parsed code (None if it cannot be parsed).
+        :param problems: HTML descriptions of the problems found.
+        """
+        self.tree = tree
+        self.problems = list(problems)
+
+    @property
+    def ok(self) -> bool:
+        return self.tree is not None and not self.problems
+
+    def feedback(self) -> str:
+        """Standard HTML feedback listing the problems."""
+        return ''.join('<div class="card"><p>{}</p></div>\n'.format(problem)
+                       for problem in self.problems)
+
+
+def _names(value: Union[None, str, Iterable[str]]) -> Tuple[str, ...]:
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.replace(',', ' ').split()
+    return tuple(value)
+
+
+def _walk(node) -> Iterable:
+    """Yields the nodes of a tree (as `ast.walk`)."""
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        yield node
+        for field in node._fields:
+            child = getattr(node, field, None)
+            if isinstance(child, list):
+                todo.extend(item for item in child
+                            if isinstance(item, _ast.AST))
+            elif isinstance(child, _ast.AST):
+                todo.append(child)
+
+
+def syntax_problem(error: SyntaxError) -> str:
+    """HTML description of a parsing error, with its location."""
+    title = next(title for cls, title in _error_titles
+                 if isinstance(error, cls))
+    location = ''
+    if error.lineno:
+        location = ' ligne {}'.format(error.lineno)
+        if error.offset:
+            location += ', colonne {}'.format(error.offset)
+    res = '<strong>{}</strong>{} : {}'.format(
+        title, location, formatting.escape(error.msg or ''))
+    if error.text:
+        line = error.text.rstrip('\n')
+        indent = len(line) - len(line.lstrip())
+        caret = ''
+        if error.offset:
+            width = max(1, (getattr(error, 'end_offset', None) or 0)
+                        - error.offset) \
+                if getattr(error, 'end_lineno', None) == error.lineno else 1
+            caret = '\n' + ' ' * (error.offset - 1 - indent) + '^' * width
+        res += '<pre>{}{}</pre>'.format(formatting.escape(line[indent:]),
+                                        caret)
+    return res
+
+
+def _structure_problems(tree, required: Tuple[str, ...],
+                        forbidden: Tuple[str, ...]) -> List[str]:
+    problems = []
+    defined = {node.name for node in tree.body
+               if isinstance(node, (_ast.FunctionDef, _ast.AsyncFunctionDef))}
+    for name in required:
+        if name not in defined:
+            problems.append('<strong>Fonction manquante</strong> : le code '
+                            'doit définir la fonction <code>{}</code>'.format(
+                                formatting.escape(name)))
+    if not forbidden:
+        return problems
+    constructs = tuple(cls for name in forbidden
+                       for cls in CONSTRUCTS.get(name, ()))
+    calls = {name for name in forbidden if name not in CONSTRUCTS}
+    found = {}  # (kind, name) -> first line
+    for node in _walk(tree):
+        if constructs and isinstance(node, constructs):
+            kind = next(name for name in forbidden if name in CONSTRUCTS
+                        and isinstance(node, CONSTRUCTS[name]))
+            key = ('construct', kind)
+        elif (calls and isinstance(node, _ast.Call)
+              and isinstance(node.func, _ast.Name) and node.func.id in calls):
+            key = ('call', node.func.id)
+        else:
+            continue
+        found[key] = min(found.get(key, node.lineno), node.lineno)
+    for (kind, name), line in sorted(found.items(), key=lambda item: item[1]):
+        what = ("d'utiliser <code>{}</code>" if kind == 'construct'
+                else "d'appeler la fonction <code>{}</code>")
+        problems.append('<strong>Construction interdite</strong> ligne {} : '
+                        'il est interdit {}'.format(
+                            line, what.format(formatting.escape(name))))
+    return problems
+
+
+def check(code: str, required: Union[None, str, Iterable[str]] = None,
+          forbidden: Union[None, str, Iterable[str]] = None) -> Precheck:
+    """
+    Parses some code and checks its structure (memoized).
+
+    :param code: Student code.
+    :param required: Names of the functions the code must define.
+    :param forbidden: Forbidden constructs and functions (see the module's
+        documentation).
+    """
+    required, forbidden = _names(required), _names(forbidden)
+    key = (code, required, forbidden)
+    res = _cache.get(key)
+    if res is None:
+        try:
+            tree = compile(code, 'student.py', 'exec', _ast.PyCF_ONLY_AST)
+            # errors raised by the compiler rather than the parser
+            compile(tree, 'student.py', 'exec')
+        except SyntaxError as e:
+            if e.text is None and e.lineno:
+                # compiling a tree gives no source line
+                lines = code.splitlines()
+                if e.lineno <= len(lines):
+                    e.text = lines[e.lineno - 1]
+            res = Precheck(None, [syntax_problem(e)])
+        except ValueError as e:  # e.g. null bytes
+            res = Precheck(None, ['<strong>Erreur de syntaxe</strong> : '
+                                  + formatting.escape(str(e))])
+        else:
+            res = Precheck(tree, _structure_problems(tree, required,
+                                                     forbidden))
+        _cache[key] = res
+    return res
+
+
+def check_context(code: str, context: dict) -> Precheck:
+    """Checks some code against the requirements of an exercise's
+    context."""
+    return check(code, context.get('required_functions'),
+                 context.get('forbidden'))
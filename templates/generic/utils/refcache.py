@@ -0,0 +1,178 @@
+# coding: utf-8
+"""
+Memoization of reference (trusted) code executions.
+
+A reference execution only depends on the reference code and on the
+execution context (global variables, available inputs, command-line
+arguments and evaluated expression), so its outcome can be computed once per
+test case and shared by all submissions of a cohort. Entries are kept in
+memory and, if the `PL_REFERENCE_CACHE` environment variable names a
+directory, read from one file per entry in that directory.
+
+Since student code runs in the same process as the grader, anything the
+grader can read or write, the student code can too: a key to authenticate
+entries would not be secret, and a grader writing to the directory would
+let a student plant entries (forged expected values) for the gradings of
+other students. Hence the grader only reads the directory, which should be
+mounted read-only, and entries are filled by a trusted step, grading the
+reference solution of an exercise outside of the sandbox (see the
+fillcache tool):
+
+    python3 fillcache.py CACHE exercise.pl solution.py
+
+Entries are stored as Python literals (`repr`) and read back with
+`ast.literal_eval`, so that reading a planted file cannot execute code;
+outcomes whose values are not literals (e.g. instances of classes) are only
+kept in memory.
+"""
+
+import builtins
+import hashlib
+import os
+import pickle
+from collections import namedtuple
+from types import FunctionType, ModuleType
+from typing import Any, Dict, List, Optional
+
+ReferenceRun = namedtuple('ReferenceRun',
+                          ['output', 'result', 'exception', 'state'])
+ReferenceRun.__doc__ = """Outcome of a reference execution: printed text,
+evaluation result, type of the raised exception (or None) and final global
+variables (restricted to data)."""
+
+_cache_env_var = 'PL_REFERENCE_CACHE'
+
+
+def is_data(name: str, value: Any) -> bool:
+    """Tells whether global variable `name` holds data (as opposed to
+    modules, classes, functions and dunder names)."""
+    return not (name.startswith('__')
+                or isinstance(value, (ModuleType, type, FunctionType))
+                or callable(value))
+
+
+def context_key(code: str, expression: Optional[str], state: Dict[str, Any],
+                inputs: List[str], argv: List[str]) -> Optional[str]:
+    """
+    Computes a key identifying a reference execution.
+
+    Non-data global variables (functions, modules...) only contribute by
+    their names, since the reference code is expected to define its own.
+
+    :return: Hexadecimal key, or None if the context cannot be serialized.
+    """
+    data = sorted((name, value if is_data(name, value) else None)
+                  for name, value in state.items()
+                  if name != '__builtins__')
+    try:
+        context = pickle.dumps((expression, data, inputs, argv), protocol=4)
+    except Exception:
+        return None
+    code_hash = hashlib.sha256(code.encode()).hexdigest()
+    return code_hash[:32] + hashlib.sha256(context).hexdigest()[:32]
+
+
+def _encode(entry: ReferenceRun) -> Optional[str]:
+    """Literal representation of an entry, None if it has none (the
+    exception is represented by the name of a builtin exception)."""
+    exception = entry.exception
+    if exception is not None:
+        if getattr(builtins, exception.__name__, None) is not exception:
+            return None
+        exception = exception.__name__
+    data = (entry.output, entry.result, exception, entry.state)
+    text = repr(data)
+    try:
+        from ast import literal_eval
+        if literal_eval(text) != data:
+            return None
+    except Exception:
+        return None
+    return text
+
+
+def _decode(text: str) -> Optional[ReferenceRun]:
+    """Entry represented by `text` (see `_encode`), None if invalid."""
+    from ast import literal_eval
+    try:
+        output, result, exception, state = literal_eval(text)
+        if exception is not None:
+            exception = getattr(builtins, exception)
+            if not (isinstance(exception, type)
+                    and issubclass(exception, BaseException)):
+                return None
+        if not isinstance(output, str) or not isinstance(state, dict):
+            return None
+    except Exception:
+        return None
+    return ReferenceRun(output, result, exception, state)
+
+
+class ReferenceCache:
+    """
+    Two-level (memory, then optional directory) cache of `ReferenceRun`
+    instances.
+    """
+
+    def __init__(self, directory: Optional[str] = None,
+                 writable: bool = False):
+        """
+        :param directory: Directory where entries are persisted (optional).
+        :param writable: Whether new entries are written to the directory
+            (only for trusted runs, see the module's documentation).
+        """
+        self.directory = directory
+        self.writable = writable
+        self.memory: Dict[str, ReferenceRun] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.txt')
+
+    def get(self, key: Optional[str]) -> Optional[ReferenceRun]:
+        """Returns the cached entry for `key`, or None."""
+        if key is None:
+            return None
+        if key in self.memory or self.directory is None:
+            return self.memory.get(key)
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                entry = _decode(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry is not None:
+            self.memory[key] = entry
+        return entry
+
+    def put(self, key: Optional[str], entry: ReferenceRun) -> None:
+        """Stores `entry` for `key`. Entries are only written to the
+        directory if the cache is writable and they are literals."""
+        if key is None:
+            return
+        self.memory[key] = entry
+        if self.directory is None or not self.writable:
+            return
+        text = _encode(entry)
+        if text is None:
+            return
+        path = self._path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, path)  # atomic, concurrent fills are safe
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+_default_cache: Optional[ReferenceCache] = None
+
+
+def get_cache() -> ReferenceCache:
+    """Returns the process-wide cache, configured from the
+    `PL_REFERENCE_CACHE` environment variable (read-only)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ReferenceCache(os.environ.get(_cache_env_var))
+    return _default_cache
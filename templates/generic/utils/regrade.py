@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Distributed regrading of a cohort, through a work queue on a shared directory.
+
+The submissions to regrade (a JSON Lines file of `{"key": ..., "exercise":
+..., "code": ...}` objects, `exercise` being the path of a .pl file) are
+split into shards, which any number of workers, on any number of nodes
+sharing the queue directory, then grade. No broker is needed: the state of
+the queue is the location of the shard files in its subdirectories,
+
+    pending/<shard>-<attempt>.json           waiting to be graded
+    claimed/<shard>-<attempt>@<worker>.json  being graded by <worker>
+    done/<shard>.json                        graded
+    failed/<shard>-<attempt>.json            given up after too many attempts
+    results/<key>.json                       result of each submission
+
+and every transition is an atomic `os.rename`, so that a shard is claimed by
+exactly one worker. A worker touches its claimed shard while grading it
+(heartbeat); a claim which has not been touched for `--stale` seconds (the
+worker crashed, or its node went down) is moved back to pending by any
+worker, with an incremented attempt number. Results are written per
+submission, so that a retried shard only grades the submissions its
+previous owner did not complete. Each submission is graded in a sandbox as
+on the platform (see plsandbox), with a checkpoint from which the grade is
+recovered if the grader is killed. A recovered grade is written apart (as
+`recovered_grade`, the grade being None), as the checkpoint is written while
+the student code runs: it is only a hint for the review of the submission.
+
+Usage:
+
+    python3 regrade.py plan QUEUE submissions.jsonl [--shard-size N] [--dedup]
+    python3 regrade.py work QUEUE [--processes N]    # on each node
+    python3 regrade.py status QUEUE
+    python3 regrade.py merge QUEUE results.json [--csv results.csv]
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import plsandbox
+
+STATES = ('pending', 'claimed', 'done', 'failed', 'results')
+
+
+def _path(queue: str, state: str, name: str = '') -> str:
+    return os.path.join(queue, state, name)
+
+
+def _write_atomic(path: str, data) -> None:
+    """Writes `data` as JSON to `path` through a temporary file, so that
+    readers never see a partial file."""
+    import uuid
+    temp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp, path)
+
+
+def worker_id() -> str:
+    """Identifier of the current worker, unique across nodes."""
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def read_submissions(path: str) -> Iterator[dict]:
+    """Reads the submissions of a JSON Lines file."""
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            submission = json.loads(line)
+            missing = {'key', 'exercise', 'code'} - set(submission)
+            if missing:
+                raise ValueError("Line {}: missing {}".format(
+                    number, ', '.join(sorted(missing))))
+            yield submission
+
+
+def deduplicate(submissions: List[dict]) -> Tuple[List[dict],
+                                                  Dict[str, List[str]]]:
+    """
+    Keeps one submission of each exercise per exact AST hash (see
+    astfingerprint.exact_hash), as submissions which only differ by their
+    formatting and comments get the same grade.
+
+    :return: tuple `(representatives, duplicates)`, where `duplicates` maps
+        the key of each representative to the keys it stands for.
+    """
+    from astfingerprint import exact_hash
+    import ast
+    representatives, duplicates, seen = [], {}, {}
+    for submission in submissions:
+        try:
+            code_hash = exact_hash(ast.parse(submission['code']))
+        except (SyntaxError, ValueError):
+            code_hash = submission['code']
+        key = seen.setdefault((submission['exercise'], code_hash),
+                              submission['key'])
+        if key == submission['key']:
+            representatives.append(submission)
+        else:
+            duplicates.setdefault(key, []).append(submission['key'])
+    return representatives, duplicates
+
+
+def plan(queue: str, submissions: List[dict], shard_size: int = 20,
+         dedup: bool = False) -> int:
+    """
+    Creates a queue of shards of at most `shard_size` submissions.
+
+    Submissions are sorted by exercise, so that workers build each exercise
+    as few times as possible.
+
+    :param dedup: Whether to grade only one submission of each group of
+        identical ones (see `deduplicate`), `merge` giving its result to the
+        others.
+    :return: Number of shards.
+    """
+    for state in STATES:
+        os.makedirs(_path(queue, state), exist_ok=True)
+    if any(os.listdir(_path(queue, state)) for state in STATES):
+        raise ValueError("The queue {} is not empty".format(queue))
+    if dedup:
+        submissions, duplicates = deduplicate(submissions)
+        _write_atomic(os.path.join(queue, 'duplicates.json'), duplicates)
+    submissions = sorted(submissions, key=lambda s: (s['exercise'], s['key']))
+    count = 0
+    for start in range(0, len(submissions), shard_size):
+        count += 1
+        _write_atomic(_path(queue, 'pending', '{:05}-0.json'.format(count)),
+                      submissions[start:start + shard_size])
+    return count
+
+
+def _parse_name(name: str) -> Tuple[str, int]:
+    """Shard and attempt number of a pending or claimed shard file name."""
+    shard, attempt = name[:-len('.json')].split('@')[0].rsplit('-', 1)
+    return shard, int(attempt)
+
+
+def requeue_stale(queue: str, stale: float, max_attempts: int) -> int:
+    """
+    Moves the claims which have not been touched for `stale` seconds back to
+    pending (or to failed, after `max_attempts` attempts).
+
+    :return: Number of requeued claims.
+    """
+    count = 0
+    now = time.time()
+    for name in os.listdir(_path(queue, 'claimed')):
+        path = _path(queue, 'claimed', name)
+        try:
+            if now - os.stat(path).st_mtime < stale:
+                continue
+        except FileNotFoundError:  # completed or requeued meanwhile
+            continue
+        shard, attempt = _parse_name(name)
+        state = 'pending' if attempt + 1 < max_attempts else 'failed'
+        try:
+            os.rename(path, _path(queue, state, '{}-{}.json'.format(
+                shard, attempt + 1)))
+            count += 1
+        except FileNotFoundError:
+            pass
+    return count
+
+
+def claim(queue: str, worker: str) -> Optional[str]:
+    """Claims a pending shard, returning the path of the claimed file (or
+    None if no shard is pending)."""
+    for name in sorted(os.listdir(_path(queue, 'pending'))):
+        if name.endswith('.tmp'):
+            continue
+        pending = _path(queue, 'pending', name)
+        claimed = _path(queue, 'claimed', '{}@{}.json'.format(
+            name[:-len('.json')], worker))
+        try:
+            # the claim starts now: touched before the rename, a shard which
+            # waited long in pending is not seen as stale once claimed
+            os.utime(pending)
+            os.rename(pending, claimed)
+        except FileNotFoundError:  # claimed by another worker
+            continue
+        try:
+            os.utime(claimed)
+        except FileNotFoundError:  # requeued (or claimed) meanwhile
+            continue
+        return claimed
+    return None
+
+
+class Heartbeat:
+    """Touches a claimed shard periodically, until stopped or until the
+    claim is lost."""
+
+    def __init__(self, path: str, period: float):
+        self.path = path
+        self.period = period
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.period):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:  # requeued as stale
+                self.lost = True
+                return
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def result_path(queue: str, key: str) -> str:
+    return _path(queue, 'results', quote(key, safe='') + '.json')
+
+
+class Grader:
+    """Builds exercises (once each) and grades submissions in sandboxes."""
+
+    def __init__(self, root: str, timeout: float):
+        """
+        :param root: Directory relative to which exercise paths are
+            resolved.
+        :param timeout: Timeout of a build or grading (s).
+        """
+        self.root = root
+        self.timeout = timeout
+        self._temp = tempfile.TemporaryDirectory(prefix='plregrade-')
+        self._built: Dict[str, Tuple[str, dict]] = {}
+
+    def sandbox(self, exercise: str) -> Tuple[str, dict]:
+        """Sandbox directory and built context of an exercise."""
+        if exercise not in self._built:
+            directory = os.path.join(self._temp.name, str(len(self._built)))
+            context, files, _ = plsandbox.load_pl(
+                os.path.join(self.root, exercise))
+            plsandbox.prepare_sandbox(files, directory)
+            built, _ = plsandbox.build(directory, context, self.timeout)
+            self._built[exercise] = directory, built
+        return self._built[exercise]
+
+    def grade(self, submission: dict) -> dict:
+        """Grades a submission, returning its result."""
+        res = {'key': submission['key'], 'exercise': submission['exercise'],
+               'grade': None, 'worker': worker_id()}
+        try:
+            directory, built = self.sandbox(submission['exercise'])
+            checkpoint = os.path.join(directory, 'checkpoint.jsonl')
+            graded = plsandbox.grade(directory, built, submission['code'],
+                                     self.timeout, checkpoint=checkpoint)
+        except plsandbox.PLError as e:
+            res['error'] = str(e)
+            return res
+        res.update(grade=graded.grade, elapsed=graded.process.elapsed,
+                   maxrss=graded.process.maxrss,
+                   timeout=graded.process.timeout,
+                   recovered_grade=graded.recovered_grade,
+                   feedback=graded.feedback)
+        if graded.grade is None:
+            res['error'] = graded.process.stderr[-2000:]
+        return res
+
+    def close(self) -> None:
+        self._temp.cleanup()
+
+
+def process_shard(queue: str, claimed: str, grader: Grader,
+                  heartbeat: Heartbeat) -> bool:
+    """
+    Grades the submissions of a claimed shard which have no result yet.
+
+    :return: Whether the shard was completed while still claimed.
+    """
+    with open(claimed, encoding='utf-8') as f:
+        submissions = json.load(f)
+    for submission in submissions:
+        if heartbeat.lost:
+            return False
+        path = result_path(queue, submission['key'])
+        if os.path.exists(path):  # graded by a previous attempt
+            continue
+        _write_atomic(path, grader.grade(submission))
+    shard, _ = _parse_name(os.path.basename(claimed))
+    try:
+        os.rename(claimed, _path(queue, 'done', shard + '.json'))
+    except FileNotFoundError:  # requeued meanwhile, results are kept
+        return False
+    return True
+
+
+def work(queue: str, root: str = '.', timeout: float = 60.,
+         stale: float = 300., max_attempts: int = 3,
+         poll: float = 0.) -> int:
+    """
+    Grades shards until none is pending or claimed.
+
+    :param queue: Queue directory.
+    :param root: Directory relative to which exercise paths are resolved.
+    :param timeout: Timeout of a build or grading (s).
+    :param stale: Age after which a claim is considered abandoned (s); the
+        heartbeat period is a third of it.
+    :param max_attempts: Number of attempts of a shard before giving up.
+    :param poll: Delay between checks of the queue when shards are claimed
+        by other workers but none is pending (s); 0 to stop instead.
+    :return: Number of shards completed by this worker.
+    """
+    worker = worker_id()
+    grader = Grader(os.path.abspath(root), timeout)
+    completed = 0
+    try:
+        while True:
+            requeue_stale(queue, stale, max_attempts)
+            claimed = claim(queue, worker)
+            if claimed is None:
+                if not poll or not os.listdir(_path(queue, 'claimed')):
+                    return completed
+                time.sleep(poll)
+                continue
+            heartbeat = Heartbeat(claimed, stale / 3)
+            try:
+                completed += process_shard(queue, claimed, grader, heartbeat)
+            finally:
+                heartbeat.stop()
+    finally:
+        grader.close()
+
+
+def status(queue: str) -> Dict[str, int]:
+    """Number of files in each state of the queue."""
+    return {state: sum(not name.endswith('.tmp')
+                       for name in os.listdir(_path(queue, state)))
+            for state in STATES}
+
+
+def merge(queue: str, feedback: bool = False) -> Dict[str, dict]:
+    """
+    Merges the results of the submissions graded so far (the results of
+    deduplicated submissions being those of their representatives, with a
+    `representative` key).
+
+    :param feedback: Whether to keep the feedback of each submission.
+    :return: Dictionary mapping submission keys to their results.
+    """
+    duplicates = {}
+    if os.path.exists(os.path.join(queue, 'duplicates.json')):
+        with open(os.path.join(queue, 'duplicates.json'),
+                  encoding='utf-8') as f:
+            duplicates = json.load(f)
+    results = {}
+    for name in sorted(os.listdir(_path(queue, 'results'))):
+        if not name.endswith('.json'):
+            continue
+        with open(_path(queue, 'results', name), encoding='utf-8') as f:
+            res = json.load(f)
+        if not feedback:
+            res.pop('feedback', None)
+        key = unquote(name[:-len('.json')])
+        results[key] = res
+        for duplicate in duplicates.get(key, ()):
+            results[duplicate] = dict(res, key=duplicate,
+                                      representative=key)
+    return dict(sorted(results.items()))
+
+
+def write_csv(results: Dict[str, dict], path: str) -> None:
+    import csv
+    columns = ['key', 'exercise', 'grade', 'elapsed', 'maxrss', 'timeout',
+               'recovered_grade', 'worker', 'representative', 'error']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        writer.writeheader()
+        for res in results.values():
+            writer.writerow(res)
+
+
+def _work_in_process(args) -> int:
+    return work(*args)
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('plan', help='split submissions into shards')
+    p.add_argument('queue', help='queue directory (shared between nodes)')
+    p.add_argument('submissions', help='JSON Lines file of submissions')
+    p.add_argument('--shard-size', type=int, default=20,
+                   help='submissions per shard')
+    p.add_argument('--dedup', action='store_true',
+                   help='grade only one of identical submissions (up to '
+                   'formatting and comments)')
+    p = commands.add_parser('work', help='grade shards')
+    p.add_argument('queue', help='queue directory')
+    p.add_argument('--root', default='.',
+                   help='directory relative to which exercises are resolved')
+    p.add_argument('--processes', type=int, default=1,
+                   help='worker processes on this node')
+    p.add_argument('--timeout', type=float, default=60.,
+                   help='timeout of a single build or grading (s)')
+    p.add_argument('--stale', type=float, default=300.,
+                   help='age after which a claim is abandoned (s)')
+    p.add_argument('--max-attempts', type=int, default=3,
+                   help='attempts of a shard before giving up')
+    p.add_argument('--poll', type=float, default=5.,
+                   help='delay between checks while other workers grade '
+                   'the last shards (s), 0 to stop at once')
+    p = commands.add_parser('status', help='count shards in each state')
+    p.add_argument('queue', help='queue directory')
+    p = commands.add_parser('merge', help='merge the results')
+    p.add_argument('queue', help='queue directory')
+    p.add_argument('output', help='JSON file of merged results')
+    p.add_argument('--csv', help='also write a CSV summary to this file')
+    p.add_argument('--feedback', action='store_true',
+                   help='keep the feedback of each submission')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        count = plan(args.queue, list(read_submissions(args.submissions)),
+                     args.shard_size, args.dedup)
+        print("{} shards".format(count))
+    elif args.command == 'work':
+        work_args = (args.queue, args.root, args.timeout, args.stale,
+                     args.max_attempts, args.poll)
+        if args.processes > 1:
+            from multiprocessing import Pool
+            with Pool(args.processes) as pool:
+                completed = sum(pool.map(_work_in_process,
+                                         [work_args] * args.processes))
+        else:
+            completed = work(*work_args)
+        print("{} shards completed".format(completed))
+    elif args.command == 'status':
+        for state, count in status(args.queue).items():
+            print("{:<8} {}".format(state, count))
+    else:
+        results = merge(args.queue, args.feedback)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+        if args.csv:
+            write_csv(results, args.csv)
+        counts = status(args.queue)
+        print("{} results ({} shards pending, {} claimed, {} failed)".format(
+            len(results), counts['pending'], counts['claimed'],
+            counts['failed']))
+        recovered = sum(res.get('recovered_grade') is not None
+                        for res in results.values())
+        if recovered:
+            print("{} grades recovered from checkpoints, to review".format(
+                recovered))
+        return 0 if not (counts['pending'] or counts['claimed']
+                         or counts['failed']) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+# coding: utf-8
+"""
+Feedback renderers for test sessions.
+
+A renderer turns a `TestSession` (its tests, groups, assertions, grade and
+timings) into text. `HtmlRenderer` produces the usual Jinja2-based HTML
+feedback; `JsonRenderer`, `TextRenderer` and `MarkdownRenderer` serialize
+the objects directly, without templating. Renderers produce one fragment per
+top-level test or group, so that reports can be streamed to a file with
+`Renderer.write`.
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterator, Optional
+
+from formatting import LIMITS, bounded_repr, truncate
+
+_tag_re = re.compile(r'<[^>]+>')
+
+# attributes of assertions exported by the JSON renderer
+_assert_fields = ('expected', 'missing', 'incorrect', 'exception', 'funcname',
+                  'keywords', 'names')
+
+
+def strip_tags(text: str) -> str:
+    """Removes HTML tags from `text` and unescapes HTML entities."""
+    import html
+    return html.unescape(_tag_re.sub('', text))
+
+
+def jsonable(value: Any, level: int = LIMITS['maxlevel']) -> Any:
+    """Converts `value` to a bounded JSON-serializable value (using a
+    bounded repr for other types, long or deeply nested containers, see the
+    formatting module)."""
+    if value is None or isinstance(value, (bool, float)):
+        return value
+    if isinstance(value, int):
+        return value if value.bit_length() <= 53 else bounded_repr(value)
+    if isinstance(value, str):
+        return truncate(value)
+    if isinstance(value, type):
+        return value.__name__
+    if level <= 0:
+        return bounded_repr(value)
+    if isinstance(value, (list, tuple)) and len(value) <= LIMITS['maxlist']:
+        return [jsonable(item, level - 1) for item in value]
+    if (isinstance(value, dict) and len(value) <= LIMITS['maxdict']
+            and all(isinstance(k, str) for k in value)):
+        return {k: jsonable(v, level - 1) for k, v in value.items()}
+    return bounded_repr(value)
+
+
+def assert_kind(assertion) -> str:
+    """Short name of an assertion's class (e.g. 'Output' for OutputAssert)."""
+    name = type(assertion).__name__
+    return name[:-len('Assert')] if name.endswith('Assert') else name
+
+
+def plain_message(assertion) -> str:
+    """Plain-text message of an assertion (bounded, see the formatting
+    module)."""
+    if assert_kind(assertion) == 'Output' and not assertion.status:
+        if assertion.expected == "":
+            return "Aucun affichage attendu"
+        return "Affichage attendu :\n" + truncate(assertion.expected)
+    return truncate(strip_tags(str(assertion)))
+
+
+def assert_to_dict(assertion) -> Dict[str, Any]:
+    """Serializes an assertion."""
+    res = {'type': assert_kind(assertion), 'status': assertion.status}
+    for field in _assert_fields:
+        if hasattr(assertion, field):
+            res[field] = jsonable(getattr(assertion, field))
+    return res
+
+
+def test_to_dict(test) -> Dict[str, Any]:
+    """Serializes a test, its assertions and timings."""
+    grade, weight = test.get_grade()
+    res = {'id': test.make_id(), 'title': test.title, 'status': test.status,
+           'skipped': test.skipped, 'grade': grade, 'weight': weight,
+           'assertions': [assert_to_dict(a) for a in test.assertions]}
+    if test.expression is not None:
+        res['expression'] = test.expression
+        res['result'] = jsonable(test.result)
+    if test.exception is not None:
+        res['exception'] = {'type': type(test.exception).__name__,
+                            'message': truncate(str(test.exception))}
+    if test.timings.enabled:
+        res['timings'] = test.timings.as_dict()
+    return res
+
+
+def group_to_dict(group) -> Dict[str, Any]:
+    """Serializes a test group and its tests."""
+    grade, weight = group.get_grade()
+    return {'id': group.make_id(), 'title': group.title,
+            'status': group.status, 'grade': grade, 'weight': weight,
+            'tests': [test_to_dict(test) for test in group.tests]}
+
+
+def report_grade(session) -> Optional[float]:
+    """Grade of a session, None if no test was run (see
+    `TestSession.get_grade`)."""
+    try:
+        return session.get_grade()
+    except ZeroDivisionError:
+        return None
+
+
+def grade_line(session) -> str:
+    """Line giving the grade of a session in text reports."""
+    grade = report_grade(session)
+    if grade is None:
+        return 'Aucun test exécuté'
+    return 'Note : {:.0f} / 100'.format(grade)
+
+
+class Renderer:
+    """
+    Base class of session renderers. Subclasses implement `render_test` and
+    `render_group`, and may override `header` and `footer`.
+    """
+    extension = 'txt'
+
+    def header(self, session) -> str:
+        return ''
+
+    def footer(self, session) -> str:
+        return ''
+
+    def separator(self) -> str:
+        return '\n'
+
+    def render_test(self, test) -> str:
+        raise NotImplementedError
+
+    def render_group(self, group) -> str:
+        raise NotImplementedError
+
+    def render_item(self, item) -> str:
+        """Renders a top-level item of a session's history."""
+        if hasattr(item, 'tests'):
+            return self.render_group(item)
+        if hasattr(item, 'assertions'):
+            return self.render_test(item)
+        return item.render()
+
+    def fragments(self, session) -> Iterator[str]:
+        """Yields the successive fragments of the report on `session`."""
+        yield self.header(session)
+        for i, item in enumerate(session.history):
+            if i:
+                yield self.separator()
+            yield self.render_item(item)
+        yield self.footer(session)
+
+    def render(self, session) -> str:
+        """Returns the full report on `session`."""
+        return ''.join(self.fragments(session))
+
+    def write(self, session, path: str) -> None:
+        """Streams the report on `session` to the file at `path`."""
+        with open(path, 'w') as f:
+            for fragment in self.fragments(session):
+                f.write(fragment)
+
+
+class HtmlRenderer(Renderer):
+    """Jinja2-based HTML feedback (see `Test.render`, `TestGroup.render`)."""
+    extension = 'html'
+
+    def render_test(self, test) -> str:
+        return test.render()
+
+    def render_group(self, group) -> str:
+        return group.render()
+
+
+class JsonRenderer(Renderer):
+    """
+    Compact JSON report: `{"grade": ..., "items": [...], "timings": ...}`,
+    where items are serialized tests and groups (the grade is null if no
+    test was run).
+    """
+    extension = 'json'
+
+    def header(self, session) -> str:
+        return '{{"grade":{},"items":['.format(
+            json.dumps(report_grade(session)))
+
+    def separator(self) -> str:
+        return ','
+
+    def footer(self, session) -> str:
+        if session.timings.enabled:
+            return '],"timings":{}}}'.format(
+                json.dumps(session.timing_report(), separators=(',', ':')))
+        return ']}'
+
+    def render_test(self, test) -> str:
+        return json.dumps(dict(test_to_dict(test), kind='test'),
+                          separators=(',', ':'), ensure_ascii=False)
+
+    def render_group(self, group) -> str:
+        return json.dumps(dict(group_to_dict(group), kind='group'),
+                          separators=(',', ':'), ensure_ascii=False)
+
+
+class TextRenderer(Renderer):
+    """Plain-text report, listing failed assertions."""
+    extension = 'txt'
+    success, failure, skipped = 'succès', 'échec', 'non exécuté'
+
+    def header(self, session) -> str:
+        return grade_line(session) + '\n\n'
+
+    def status(self, item) -> str:
+        if getattr(item, 'skipped', False):
+            return self.skipped
+        return self.success if item.status else self.failure
+
+    def render_test(self, test, indent: str = '') -> str:
+        lines = ['{}- {} : {}'.format(indent, strip_tags(test.title or ''),
+                                      self.status(test))]
+        for assertion in test.assertions:
+            if not assertion.status or assertion.params['report_success']:
+                message = plain_message(assertion).replace(
+                    '\n', '\n' + indent + '    ')
+                lines.append('{}    {}'.format(indent, message))
+        return '\n'.join(lines) + '\n'
+
+    def render_group(self, group) -> str:
+        lines = ['{} : {}\n'.format(strip_tags(group.title),
+                                     self.status(group))]
+        lines.extend(self.render_test(test, '  ') for test in group.tests)
+        return ''.join(lines)
+
+
+class MarkdownRenderer(TextRenderer):
+    """Markdown report (failed outputs are shown as code blocks)."""
+    extension = 'md'
+
+    def header(self, session) -> str:
+        return '**{}**\n\n'.format(grade_line(session))
+
+    def render_test(self, test, indent: str = '') -> str:
+        lines = ['{}- **{}** : {}'.format(indent, test.title or '',
+                                          self.status(test))]
+        for assertion in test.assertions:
+            if assertion.status and not assertion.params['report_success']:
+                continue
+            if (assert_kind(assertion) == 'Output' and not assertion.status
+                    and assertion.expected):
+                lines.append('{}    Affichage attendu :\n\n{}    ```\n{}'
+                             '{}    ```'.format(
+                                 indent, indent,
+                                 ''.join(indent + '    ' + line + '\n'
+                                         for line in
+                                         truncate(assertion.expected)
+                                         .splitlines()),
+                                 indent))
+            else:
+                lines.append('{}    {}'.format(indent,
+                                               plain_message(assertion)))
+        return '\n'.join(lines) + '\n'
+
+    def render_group(self, group) -> str:
+        lines = ['### {} : {}\n\n'.format(group.title, self.status(group))]
+        lines.extend(self.render_test(test) for test in group.tests)
+        return ''.join(lines)
+
+
+RENDERERS = {'html': HtmlRenderer, 'json': JsonRenderer, 'text': TextRenderer,
+             'md': MarkdownRenderer}
+
+
+def get_renderer(name: str) -> Renderer:
+    """Returns a renderer instance by format name (html, json, text, md)."""
+    try:
+        return RENDERERS[name]()
+    except KeyError:
+        raise ValueError("Unknown feedback format: {}".format(name))
@@ -0,0 +1,274 @@
+# coding: utf-8
+"""
+Grading history, stored in a local SQLite database for analytics.
+
+When the `PL_RESULT_STORE` environment variable names a database file, the
+grader records each graded submission (exercise, hash of the code, grade,
+grading time) along with the outcome of each of its tests (title, group,
+status, grade, CPU time when timings are enabled) and the kinds of its
+failed assertions. Exercises are identified by their title and a hash of
+their validation script, so that different versions of an exercise are not
+mixed.
+
+The database is in WAL mode, so that concurrent graders do not block each
+other nor the readers, and records are buffered: a grader process writes
+its submission in a single transaction when it exits (after its feedback is
+written, or when it is interrupted, with its partial grade, see
+`sandboxio.on_interrupt`), and long-running processes grading many
+submissions (`batch_size`) write them by batches. Indexes make the usual
+queries (`most_failed_tests`, `grading_time_percentile`,
+`identical_submissions`, `failed_assertion_kinds`) use index scans only,
+whatever the size of the history.
+
+The student code runs in the grader's process, so that it could reach the
+open database (e.g. through the garbage collector) and tamper with the
+history. `default_store` removes the variable from the environment once
+read, so that the path is not readily available, but records should only
+be used for analytics, never to grade or to identify students.
+"""
+
+import os
+import time
+from typing import List, Optional, Tuple
+
+_env_var = 'PL_RESULT_STORE'
+
+_schema = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    exercise TEXT NOT NULL,
+    title TEXT,
+    code_hash TEXT NOT NULL,
+    grade REAL,
+    elapsed REAL,
+    tests INTEGER,
+    failed INTEGER,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    submission INTEGER NOT NULL,
+    exercise TEXT NOT NULL,
+    position INTEGER,
+    test_group TEXT,
+    title TEXT,
+    status INTEGER,
+    skipped INTEGER,
+    grade REAL,
+    weight INTEGER,
+    cpu REAL
+);
+CREATE TABLE IF NOT EXISTS failures (
+    submission INTEGER NOT NULL,
+    exercise TEXT NOT NULL,
+    test TEXT,
+    kind TEXT
+);
+CREATE INDEX IF NOT EXISTS submissions_elapsed
+    ON submissions (exercise, elapsed);
+CREATE INDEX IF NOT EXISTS submissions_code
+    ON submissions (exercise, code_hash);
+CREATE INDEX IF NOT EXISTS tests_submission ON tests (submission);
+CREATE INDEX IF NOT EXISTS tests_failed
+    ON tests (exercise, title) WHERE status = 0 AND skipped = 0;
+CREATE INDEX IF NOT EXISTS failures_kind ON failures (exercise, kind);
+"""
+
+
+def _hash(text: str) -> str:
+    import hashlib
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def exercise_key(context: dict) -> str:
+    """Identifier of an exercise: its title and a hash of its validation
+    script."""
+    return '{} [{}]'.format(context.get('title', ''),
+                            _hash(context.get('grader', ''))[:12])
+
+
+def _session_rows(session) -> Tuple[list, list]:
+    """Rows of the tests and failed assertions of a session, without the
+    submission and exercise columns."""
+    from renderers import assert_kind
+    tests, failures = [], []
+    items = [(None, item) for item in session.history
+             if not hasattr(item, 'tests')]
+    for item in session.history:
+        if hasattr(item, 'tests'):
+            items.extend((item.title, test) for test in item.tests)
+    for position, (group, test) in enumerate(items):
+        if not hasattr(test, 'assertions'):
+            continue
+        grade, weight = test.get_grade()
+        cpu = sum(test.timings.durations.values()) \
+            if test.timings.enabled else None
+        tests.append((position, group, test.title, bool(test.status),
+                      test.skipped, grade, weight, cpu))
+        failures.extend((test.title, assert_kind(assertion))
+                        for assertion in test.assertions
+                        if not assertion.status)
+    return tests, failures
+
+
+class ResultStore:
+    """Buffered writer and queries of a grading history database."""
+
+    def __init__(self, path: str, batch_size: int = 100):
+        """
+        :param path: Database file, created if needed.
+        :param batch_size: Number of submissions buffered before being
+            written (they are also written by `flush` and `close`).
+        """
+        self.path = path
+        self.batch_size = batch_size
+        import sqlite3
+        self.connection = sqlite3.connect(path, timeout=30.)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # a transaction is durable once the WAL is synced at checkpoints
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(_schema)
+        self._pending: List[tuple] = []
+
+    def record(self, session, context: dict, code: str, grade: float,
+               elapsed: Optional[float] = None) -> None:
+        """
+        Records a graded submission (written with the next batch).
+
+        :param session: `TestSession` of the submission (None if no test
+            was run).
+        :param context: Context of the exercise.
+        :param code: Student code.
+        :param grade: Grade of the submission.
+        :param elapsed: Grading time (s).
+        """
+        tests, failures = _session_rows(session) if session is not None \
+            else ([], [])
+        submission = (exercise_key(context), context.get('title'),
+                      _hash(code), grade, elapsed, len(tests),
+                      sum(not row[3] and not row[4] for row in tests),
+                      time.time())
+        self._pending.append((submission, tests, failures))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered submissions in a single transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with self.connection:
+            tests, failures = [], []
+            for submission, test_rows, failure_rows in pending:
+                cursor = self.connection.execute(
+                    'INSERT INTO submissions (exercise, title, code_hash, '
+                    'grade, elapsed, tests, failed, created) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', submission)
+                key = (cursor.lastrowid, submission[0])
+                tests.extend(key + row for row in test_rows)
+                failures.extend(key + row for row in failure_rows)
+            self.connection.executemany(
+                'INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                tests)
+            self.connection.executemany(
+                'INSERT INTO failures VALUES (?, ?, ?, ?)', failures)
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    def exercises(self) -> List[str]:
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT exercise FROM submissions ORDER BY exercise')]
+
+    def most_failed_tests(self, exercise: Optional[str] = None,
+                          limit: int = 10) -> List[Tuple[str, str, int]]:
+        """
+        Tests failed most often.
+
+        :param exercise: Exercise key (see `exercise_key`), None for all.
+        :return: List of `(exercise, test title, failures)`.
+        """
+        where = 'AND exercise = ?' if exercise is not None else ''
+        return self.connection.execute(
+            'SELECT exercise, title, COUNT(*) AS n FROM tests '
+            'WHERE status = 0 AND skipped = 0 {} '
+            'GROUP BY exercise, title ORDER BY n DESC LIMIT ?'.format(where),
+            ((exercise,) if exercise is not None else ()) + (limit,)
+        ).fetchall()
+
+    def grading_time_percentile(self, exercise: str, p: float = 95
+                                ) -> Optional[float]:
+        """Percentile `p` (between 0 and 100) of the grading times of an
+        exercise, by nearest rank (None if there is no submission)."""
+        count, = self.connection.execute(
+            'SELECT COUNT(elapsed) FROM submissions WHERE exercise = ?',
+            (exercise,)).fetchone()
+        if not count:
+            return None
+        rank = max(0, min(count - 1, round(p / 100 * count) - 1))
+        row = self.connection.execute(
+            'SELECT elapsed FROM submissions WHERE exercise = ? '
+            'AND elapsed IS NOT NULL ORDER BY elapsed LIMIT 1 OFFSET ?',
+            (exercise, rank)).fetchone()
+        return row[0]
+
+    def identical_submissions(self, exercise: Optional[str] = None,
+                              min_count: int = 2, limit: int = 20
+                              ) -> List[Tuple[str, str, int]]:
+        """
+        Codes submitted several times.
+
+        :return: List of `(exercise, code hash, count)` of the codes
+            submitted at least `min_count` times, most frequent first.
+        """
+        where = 'WHERE exercise = ?' if exercise is not None else ''
+        return self.connection.execute(
+            'SELECT exercise, code_hash, COUNT(*) AS n FROM submissions {} '
+            'GROUP BY exercise, code_hash HAVING n >= ? '
+            'ORDER BY n DESC LIMIT ?'.format(where),
+            ((exercise,) if exercise is not None else ())
+            + (min_count, limit)).fetchall()
+
+    def failed_assertion_kinds(self, exercise: str
+                               ) -> List[Tuple[str, int]]:
+        """Kinds of the failed assertions of an exercise (e.g. 'Output'),
+        with their numbers of failures, most frequent first."""
+        return self.connection.execute(
+            'SELECT kind, COUNT(*) AS n FROM failures WHERE exercise = ? '
+            'GROUP BY kind ORDER BY n DESC', (exercise,)).fetchall()
+
+
+def default_store() -> Optional[ResultStore]:
+    """
+    Store set by the `PL_RESULT_STORE` environment variable, if any, which
+    is removed from the environment of the student code. Its records are
+    written when the process exits, so that they do not delay the
+    feedback.
+    """
+    path = os.environ.pop(_env_var, None)
+    if not path:
+        return None
+    import atexit
+    store = ResultStore(path, batch_size=1 << 30)
+    atexit.register(store.close)
+    return store
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python3 resultstore.py DATABASE", file=sys.stderr)
+        sys.exit(1)
+    store = ResultStore(sys.argv[1])
+    for exercise in store.exercises():
+        print(exercise)
+        print("  p95 grading time: {:.3f} s".format(
+            store.grading_time_percentile(exercise, 95)))
+        for _, title, count in store.most_failed_tests(exercise, 3):
+            print("  failed {} times: {}".format(count, title))
+        for kind, count in store.failed_assertion_kinds(exercise):
+            print("  {} failed assertions: {}".format(count, kind))
+        for _, code_hash, count in store.identical_submissions(exercise,
+                                                               limit=3):
+            print("  {} identical submissions: {}".format(count, code_hash))
@@ -1,6 +1,6 @@
 # coding: utf-8
 
-import sys, json, jsonpickle
+import os, sys, json
 from components import Component
 
 
@@ -19,31 +19,121 @@ def get_context():
     return context
 
 
-def output(grade, feedback, context=None):
-    """Used to output the grade, feedback and context to the sandbox.
+class FeedbackWriter:
+    """Feedback file written incrementally, so that it survives an
+    interruption of the grader and is never held entirely in memory.
     
-    Parameters:
-        grade - (int) Grade of the student. Should be an integer or implementing __int__.
-        feedback - (str) Feedback shown to the student. Should be a str or implementing __str__.
-        context - (dict - optionnal) Modified context of the exercise."""
-    with open(sys.argv[3], "w+") as f:
-        f.write(jsonpickle.encode(context if context else get_context(), unpicklable=False))
+    Fragments are flushed to the file as soon as they are written. Once the
+    file reaches `max_bytes`, further fragments are dropped (and counted in
+    `omitted`); the final summary block is always written.
     
-    with open(sys.argv[4], "w+") as f:
-        print(str(feedback), file=f)
+    Attributes:
+        partial_grade - (callable) Returns the grade to output if the grader
+            is interrupted (see on_interrupt).
+        pending - (callable) Writes the fragments not written yet (e.g. an
+            unfinished test group), given the interrupting signal name (or
+            None), called before the summary.
+        summary - (callable) Returns the final block of the feedback, given
+            the number of omitted fragments and the interrupting signal name
+            (or None).
+        abort - (callable) Called with the partial grade when the grader is
+            interrupted, before it exits (e.g. to store the result)."""
     
-    print(int(grade))
+    def __init__(self, path, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('PL_FEEDBACK_MAX_BYTES', 1 << 20))
+        self.file = open(path, "w+")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.omitted = 0
+        self.closed = False
+        self.partial_grade = lambda: 0
+        self.pending = lambda interrupted: None
+        self.summary = lambda omitted, interrupted: ""
+        self.abort = lambda grade: None
     
-    sys.exit(0)
-
-
-
-
-
+    def write(self, fragment):
+        """Appends `fragment` to the feedback, unless the size cap is
+        reached."""
+        if self.closed:
+            return
+        size = len(fragment.encode())
+        if self.size + size > self.max_bytes:
+            self.omitted += 1
+            return
+        self.file.write(fragment)
+        self.file.flush()
+        self.size += size
+    
+    def close(self, interrupted=None):
+        """Writes the summary block and closes the file (only once)."""
+        if self.closed:
+            return
+        self.pending(interrupted)
+        self.file.write(self.summary(self.omitted, interrupted) + "\n")
+        self.file.close()
+        self.closed = True
+
+
+def on_interrupt(feedback, signals=('SIGTERM', 'SIGXCPU', 'SIGINT')):
+    """Installs signal handlers outputting a partial grade and the feedback
+    written so far when the grader is interrupted (timeout, CPU limit...).
+    
+    Parameters:
+        feedback - (FeedbackWriter) Feedback of the grader.
+        signals - (tuple) Names of the handled signals, where available."""
+    import signal
+    argv = sys.argv.copy()
+    
+    def handler(signum, frame):
+        # the student code may be running with sys.argv and sys.stdout
+        # patched, and may catch SystemExit: restore them and _exit
+        sys.argv, sys.stdout = argv, sys.__stdout__
+        try:
+            try:
+                grade = feedback.partial_grade()
+            except Exception:
+                grade = 0
+            feedback.close(signal.Signals(signum).name)
+            _write_context(None)
+            print(int(grade), flush=True)
+            # exit handlers are not run by os._exit
+            feedback.abort(grade)
+        finally:
+            os._exit(0)
+    
+    for name in signals:
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handler)
 
 
+def _write_context(context):
+    import jsonpickle  # slow to import, only needed here
+    with open(sys.argv[3], "w+") as f:
+        f.write(jsonpickle.encode(context if context else get_context(), unpicklable=False))
 
 
+def output(grade, feedback, context=None):
+    """Used to output the grade, feedback and context to the sandbox.
+    
+    Parameters:
+        grade - (int) Grade of the student. Should be an integer or implementing __int__.
+        feedback - (str) Feedback shown to the student. Should be a str or implementing __str__,
+            or a FeedbackWriter already holding the feedback.
+        context - (dict - optionnal) Modified context of the exercise."""
+    import timing
+    with timing.grader.phase('output'):
+        _write_context(context)
 
+        if isinstance(feedback, FeedbackWriter):
+            feedback.close()
+        else:
+            with open(sys.argv[4], "w+") as f:
+                print(str(feedback), file=f)
 
+    if timing.ENABLED:
+        timing.write_sidecar(sys.argv[4])
 
+    print(int(grade))
+    
+    sys.exit(0)
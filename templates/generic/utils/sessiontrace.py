@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Traces of test sessions, to replay a single test of a graded submission.
+
+When the `PL_GRADER_TRACE` environment variable names a file, the grader
+writes to it one JSON line per event of the session:
+
+- `{"event": "session", "code": ..., "python": ...}` first, with the student
+  code;
+- `{"event": "context", "hash": ..., "data": ...}` the first time a
+  context is met, where `data` is the zlib-compressed pickle (in base64) of
+  the context of a test before its execution: data global variables (as
+  for `refcache.context_key`, functions and modules only by their names),
+  available inputs and command-line arguments;
+- `{"event": "test", "position": ..., "title": ..., "context": ...,
+  "expression": ..., "setup": ..., "inputs": [...], "argv": [...],
+  "output": ..., "result": ..., "exception": ..., "status": ...,
+  "timings": {...}}` for each test, in the order of the history, with the
+  hash of its context, whether the code was run before the expression
+  (see `Test.parse_context_args`), the inputs it consumed, a digest of its
+  output and bounded
+  representations of its result and exception (timings are those of the
+  timing module, when enabled);
+- `{"event": "end", "grade": ...}` once the session is complete.
+
+Recording only pickles the data of each context, which is usually small and
+shared by consecutive tests, and hashes outputs, so that traces may be left
+on in production. Contexts which cannot be pickled (e.g. instances of
+classes defined by the student) or exceed `_max_context_bytes` are not
+stored, and their tests cannot be replayed.
+
+A test is replayed by restoring its context, running the student code
+first (discarding its output) if the test did or if it evaluates an
+expression and its context held functions or modules, then running the
+test as the grader did and comparing digests:
+
+    python3 sessiontrace.py list trace.jsonl
+    python3 sessiontrace.py replay trace.jsonl [--test N] [--code student.py]
+
+The replay runs in the current process, so that it must be run in a
+sandbox or on trusted code, from a directory where the grader's modules
+(test.py, mockinput.py...) can be imported.
+
+A trace is not trusted either: the student code runs in the grader's
+process, so that it could write to the open trace file (the path is removed
+from the environment of the student code, but the file remains reachable,
+e.g. through the garbage collector). Forged events cannot change the
+grade, but they could mislead a replay, and their contexts are unpickled
+when replaying: one more reason to replay in a sandbox.
+"""
+
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+_env_var = 'PL_GRADER_TRACE'
+
+# maximal size of a pickled context, larger ones are not stored
+_max_context_bytes = 1 << 20
+
+
+def digest(text: str) -> str:
+    """Digest of an output."""
+    from hashlib import blake2b
+    return blake2b(text.encode('utf-8', 'surrogatepass'),
+                   digest_size=16).hexdigest()
+
+
+def _exception_repr(exception: Optional[BaseException]) -> Optional[str]:
+    if exception is None:
+        return None
+    from formatting import truncate
+    return truncate('{}: {}'.format(type(exception).__name__, exception))
+
+
+def _context(test) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    Serializes the context of a test before its execution.
+
+    :return: tuple `(hash, pickle)`, `(None, None)` if the context cannot
+        be stored.
+    """
+    import pickle
+    from hashlib import blake2b
+    from refcache import is_data
+    data, names = {}, []
+    for name, value in test.previous_state.items():
+        if is_data(name, value):
+            data[name] = value
+        elif not name.startswith('__'):
+            names.append(name)
+    try:
+        blob = pickle.dumps((data, sorted(names), test.previous_inputs,
+                             test.argv), protocol=4)
+    except Exception:
+        return None, None
+    if len(blob) > _max_context_bytes:
+        return None, None
+    return blake2b(blob, digest_size=16).hexdigest(), blob
+
+
+class Trace:
+    """Trace file of a test session (see the module's documentation)."""
+
+    def __init__(self, path: str):
+        """
+        :param path: Trace file, truncated if it exists.
+        """
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8', buffering=1)
+        # hashes of the contexts already written
+        self.contexts = set()
+        self.position = 0
+
+    def _write(self, event: str, **fields) -> None:
+        if self.file.closed:
+            return
+        fields['event'] = event
+        self.file.write(json.dumps(fields, ensure_ascii=False) + '\n')
+
+    def begin(self, code: str) -> None:
+        """Records the student code of the session."""
+        self._write('session', code=code, python=sys.version.split()[0])
+
+    def test(self, test) -> None:
+        """Records a test which was run (or skipped)."""
+        position, self.position = self.position, self.position + 1
+        if test.skipped or test.previous_state is None:
+            self._write('test', position=position, title=test.title,
+                        skipped=True)
+            return
+        from formatting import bounded_repr
+        key, blob = _context(test)
+        if key is not None and key not in self.contexts:
+            import base64
+            import zlib
+            self.contexts.add(key)
+            self._write('context', hash=key, data=base64.b64encode(
+                zlib.compress(blob, 1)).decode('ascii'))
+        consumed = len(test.previous_inputs) - len(test.current_inputs)
+        self._write(
+            'test', position=position, title=test.title, context=key,
+            expression=test.expression, interactive=test.interactive,
+            setup=test.setup,
+            verbose_inputs=test.params['verbose_inputs'],
+            inputs=test.previous_inputs[:consumed], argv=test.argv,
+            output=digest(test.output),
+            result=bounded_repr(test.result)
+            if test.expression is not None else None,
+            exception=_exception_repr(test.exception),
+            status=bool(test.status),
+            timings=test.timings.durations if test.timings.enabled else None)
+
+    def finish(self, grade: float) -> None:
+        """Marks the session as complete and closes the file."""
+        self._write('end', grade=grade)
+        self.file.close()
+
+
+def default_trace() -> Optional[Trace]:
+    """Trace set by the `PL_GRADER_TRACE` environment variable, if any,
+    which is removed from the environment of the student code."""
+    path = os.environ.pop(_env_var, None)
+    return Trace(path) if path else None
+
+
+def read(path: str) -> Tuple[str, Dict[str, bytes], List[dict]]:
+    """
+    Reads a trace file, ignoring a truncated last line.
+
+    :return: tuple `(code, contexts, tests)` where `contexts` maps hashes to
+        pickled contexts.
+    """
+    import base64
+    import zlib
+    code, contexts, tests = '', {}, []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                break
+            if event['event'] == 'session':
+                code = event['code']
+            elif event['event'] == 'context':
+                contexts[event['hash']] = zlib.decompress(
+                    base64.b64decode(event['data']))
+            elif event['event'] == 'test':
+                tests.append(event)
+    return code, contexts, tests
+
+
+def replay(code: str, blob: bytes, recorded: dict) -> Dict[str, Any]:
+    """
+    Runs a recorded test again in its context.
+
+    :param code: Student code.
+    :param blob: Pickled context of the test.
+    :param recorded: Test event of the trace.
+    :return: Test event of the replay (with the fields compared by
+        `compare`).
+    """
+    import pickle
+    from formatting import bounded_repr
+    from test import execute
+    data, names, inputs, argv = pickle.loads(blob)
+    state = dict(data)
+    expression = recorded['expression']
+    setup = expression is not None and recorded.get('setup', False)
+    if expression is not None and names and not setup:
+        # functions and modules of the context are defined again by
+        # running the code, as the test they come from did
+        execute(code, None, state, inputs.copy(), list(argv),
+                recorded['verbose_inputs'])
+        state.update(pickle.loads(blob)[0])
+    available = list(inputs)
+    output, result, exception = '', None, None
+    if setup:
+        # as in `Test.run`
+        output, _, exception = execute(code, None, state, available,
+                                       list(argv), recorded['verbose_inputs'])
+    if exception is None:
+        output, result, exception = execute(
+            code, expression, state, available, list(argv),
+            recorded['verbose_inputs'], recorded['interactive'])
+    return dict(
+        inputs=inputs[:len(inputs) - len(available)], output=digest(output),
+        result=bounded_repr(result) if expression is not None else None,
+        exception=_exception_repr(exception))
+
+
+def compare(recorded: dict, replayed: dict) -> List[str]:
+    """Names of the fields of a test whose replay differs from the
+    recording."""
+    return [field for field in ('inputs', 'output', 'result', 'exception')
+            if recorded.get(field) != replayed[field]]
+
+
+def main() -> int:
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1],
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('list', help='list the recorded tests')
+    p.add_argument('trace', help='trace file')
+    p = commands.add_parser('replay', help='replay recorded tests')
+    p.add_argument('trace', help='trace file')
+    p.add_argument('--test', type=int, action='append',
+                   help='position of a test to replay (all by default)')
+    p.add_argument('--code',
+                   help='file of the code to run instead of the recorded '
+                        'one (e.g. to check a fix)')
+    args = parser.parse_args()
+
+    code, contexts, tests = read(args.trace)
+    if args.command == 'list':
+        for test in tests:
+            status = 'skipped' if test.get('skipped') else \
+                'passed' if test['status'] else 'failed'
+            print('{:3} {:10} {}'.format(test['position'], status,
+                                         test['title']))
+        return 0
+
+    if args.code:
+        with open(args.code, encoding='utf-8') as f:
+            code = f.read()
+    selected = [test for test in tests if args.test is None
+                or test['position'] in args.test]
+    if not selected:
+        print("No such test", file=sys.stderr)
+        return 1
+    differ = False
+    for test in selected:
+        if test.get('skipped'):
+            print('{:3} {:10} {}'.format(test['position'], 'skipped',
+                                         test['title']))
+            continue
+        if test['context'] not in contexts:
+            print('{:3} {:10} {}'.format(test['position'], 'no context',
+                                         test['title']))
+            differ = True
+            continue
+        replayed = replay(code, contexts[test['context']], test)
+        fields = compare(test, replayed)
+        differ = differ or bool(fields)
+        print('{:3} {:10} {}'.format(test['position'],
+                                     'differs' if fields else 'identical',
+                                     test['title']))
+        for field in fields:
+            print('      {}: recorded {!r}, replayed {!r}'.format(
+                field, test[field], replayed[field]))
+    return 1 if differ else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
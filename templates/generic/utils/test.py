@@ -1,17 +1,23 @@
-import ast
-import importlib.util
-import inspect
 import operator
 import sys
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
 from copy import deepcopy
 from io import StringIO
+from types import ModuleType
 from typing import Callable, Dict, List, NoReturn, Optional, Union, Any, Tuple
-from unittest import mock
 
-import jinja2
-
-from ast_analyzer import has_no_loop, is_simple_recursive
+from formatting import format_text, format_value
+from budget import Budget, default_budget
 from mockinput import mock_input
+import formatting
+from timing import Timings
+import timing
+
+# Heavy modules (ast, importlib, jinja2, difflib, ast_analyzer) are imported
+# lazily where they are needed: the grader runs in a fresh interpreter for
+# every submission, and most exercises never use some of them.
 
 # _default_template_dir = ''
 _default_template_dir = 'templates/generic/jinja/'
@@ -24,6 +30,141 @@ _default_params = {
     "fail_fast": True,
 }
 
+# aspects compared to the reference code by default (see
+# Test.assert_same_as_reference)
+_default_reference_aspects = ("output", "result", "exception")
+
+
+_template_cache: Dict[str, Any] = {}
+
+
+def _get_template(path: str):
+    """
+    Returns the compiled Jinja2 template stored at `path`, loading it (and
+    jinja2 itself) on first use only.
+
+    In the sandbox, files are copied to the working directory, so the
+    template is looked up there if `path` does not exist.
+
+    :param path: Path to the template file.
+    :return: Compiled `jinja2.Template` instance.
+    """
+    template = _template_cache.get(path)
+    if template is None:
+        import jinja2
+        import os
+        filename = path if os.path.exists(path) else os.path.basename(path)
+        with open(filename, "r") as tempfile:
+            template = jinja2.Template(tempfile.read())
+        _template_cache[path] = template
+    return template
+
+
+@contextmanager
+def _patch_sys(argv: List[str], stdout):
+    """
+    Temporarily replaces `sys.argv` and `sys.stdout` (a lightweight
+    alternative to `unittest.mock.patch.object`).
+    """
+    old_argv, old_stdout = sys.argv, sys.stdout
+    sys.argv, sys.stdout = argv, stdout
+    try:
+        yield
+    finally:
+        sys.argv, sys.stdout = old_argv, old_stdout
+
+
+def execute(code: str, expression: Optional[str], state: Dict[str, Any],
+            inputs: List[str], argv: List[str], verbose_inputs: bool = True,
+            interactive: bool = False
+            ) -> Tuple[str, Any, Optional[Exception]]:
+    """
+    Runs `code` (or evaluates `expression` if it is not None) in the global
+    namespace `state`, while mocking input, `sys.argv` and standard output.
+
+    :param code: Code to run, as source or code object (ignored if
+        `expression` is not None).
+    :param expression: Expression to evaluate (optional).
+    :param state: Global namespace, modified in place.
+    :param inputs: Available input lines, consumed lines are removed.
+    :param argv: Command-line arguments.
+    :param verbose_inputs: Whether input prompts and lines are echoed.
+    :param interactive: Whether `expression` is rather a statement run as
+        in the interactive interpreter (the values of expression statements
+        are printed, as in doctests; the result is then None).
+    :return: tuple `(output, result, exception)`.
+    """
+    out_stream = StringIO()
+    result = exception = None
+    with mock_input(inputs, state, verbose=verbose_inputs):
+        with _patch_sys(argv, out_stream):
+            try:
+                if expression is None:
+                    exec(code, state)
+                elif interactive:
+                    exec(compile(expression, '<doctest>', 'single'), state)
+                else:
+                    result = eval(expression, state)
+            except Exception as e:
+                exception = e
+    return out_stream.getvalue(), result, exception
+
+
+def copy_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a deep copy of the global namespace `state`, sharing the modules
+    it contains (modules imported by the tested code cannot be copied).
+    """
+    memo = {id(value): value for value in state.values()
+            if isinstance(value, ModuleType)}
+    return deepcopy(state, memo)
+
+
+def execute_reference(code: str, expression: Optional[str],
+                      state: Dict[str, Any], inputs: List[str],
+                      argv: List[str], verbose_inputs: bool = True
+                      ) -> 'ReferenceRun':
+    """
+    Runs trusted reference code in a copy of the given context.
+
+    If an expression is provided, the reference code is first executed
+    (discarding its output) so that the expression is evaluated against the
+    reference definitions.
+
+    :param code: Reference code.
+    :param expression: Expression to evaluate (optional).
+    :param state: Global namespace (left unchanged).
+    :param inputs: Available input lines (left unchanged).
+    :param argv: Command-line arguments.
+    :param verbose_inputs: Whether input prompts and lines are echoed.
+    :return: A `refcache.ReferenceRun` instance.
+    """
+    from refcache import ReferenceRun, is_data
+    state = copy_state(state)
+    inputs = inputs.copy()
+    if expression is not None:
+        execute(code, None, state, inputs, argv.copy(), verbose_inputs)
+    output, result, exception = execute(code, expression, state, inputs,
+                                        argv.copy(), verbose_inputs)
+    return ReferenceRun(output, result,
+                        type(exception) if exception else None,
+                        {var: value for var, value in state.items()
+                         if is_data(var, value)})
+
+
+def _timed(phase: str):
+    """
+    Decorator recording the duration of a `Test` method as phase `phase` of
+    the test's timings.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timings.phase(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 
 class GraderError(Exception):
     """Exception raised when an unforeseen error due to the exercise author
@@ -57,6 +198,12 @@ class Test:
         self.code: str = code
         self.weight = weight
         self.expression: Optional[str] = None
+        # whether the expression is run as an interactive statement (see
+        # `execute`)
+        self.interactive: bool = False
+        # whether the code is run before evaluating the expression (see
+        # `parse_context_args`)
+        self.setup: bool = False
         self.params = _default_params.copy()
         self.params.update(params)
         self.number: int = Test._number
@@ -71,6 +218,13 @@ class Test:
         self.current_inputs: List[str] = []
         self.argv: List[str] = []
 
+        # trusted reference code, for differential testing
+        self.reference: Optional[str] = None
+
+        # read-only global variables shared between tests (see the fixtures
+        # module), added to the state before each run
+        self.fixtures: Dict[str, Any] = {}
+
         # execution effects
         self.output: str = ""
         self.exception: Optional[Exception] = None
@@ -86,6 +240,22 @@ class Test:
         self.assertions: List[Assert] = []
         self.status: bool = True
 
+        # whether the test was not run (see skip())
+        self.skipped: bool = False
+
+        # feedback, computed on demand (see summarize_changes(), context()
+        # and results())
+        self._changes = None
+        self._context: Optional[str] = None
+        self._results: Optional[str] = None
+
+        # instrumentation (see the timing module)
+        self.timings: Timings = Timings()
+
+        # line coverage of the code, shared by the tests of a session (see
+        # the linecov module)
+        self.coverage = None
+
     def copy(self):
         """
         Make a copy of `self`, including the current state and available
@@ -95,10 +265,14 @@ class Test:
 
         :return: historyless copy of the current test instance.
         """
-        t = Test(self.code)
-        t.current_state = deepcopy(self.current_state)
+        t = Test(self.code, **self.params)
+        with t.timings.phase('copy'):
+            t.current_state = copy_state(self.current_state)
         t.current_inputs = self.current_inputs.copy()
         t.argv = self.argv.copy()
+        t.reference = self.reference
+        t.fixtures = self.fixtures
+        t.coverage = self.coverage
         return t
 
     """Code execution."""
@@ -115,13 +289,19 @@ class Test:
             - `modified` is a dictionary mapping existing identifiers to their
             (new) values;
             - `inputs` is a list of read input lines.
+
+        Values are compared with `fingerprint.changed`, and the result is
+        computed on first call only.
         """
+        if self._changes is not None:
+            return self._changes
+        from fingerprint import changed
         deleted = list(self.previous_state.keys() - self.current_state.keys())
 
         modified = {
             var1: self.current_state[var1]
             for var1 in self.previous_state.keys() & self.current_state.keys()
-            if self.previous_state[var1] != self.current_state[var1]}
+            if changed(self.previous_state[var1], self.current_state[var1])}
 
         added = {var: self.current_state[var] for var in
                  self.current_state.keys() - self.previous_state.keys()
@@ -130,7 +310,8 @@ class Test:
         n = len(self.previous_inputs) - len(self.current_inputs)
         inputs = self.previous_inputs[:n]
 
-        return added, deleted, modified, inputs
+        self._changes = added, deleted, modified, inputs
+        return self._changes
 
     def run(self, expression: str = None, **kwargs) -> NoReturn:
         """
@@ -149,6 +330,7 @@ class Test:
         :param kwargs: Additional context, description or assertion parameters.
         """
         self.expression = expression
+        self._changes = self._context = self._results = None
 
         # parse description-related keyword arguments
         self.parse_description_args(kwargs)
@@ -157,37 +339,67 @@ class Test:
 
         # parse context-related keyword arguments
         self.parse_context_args(kwargs)
+        if self.fixtures:
+            from fixtures import reset_attempts
+            self.current_state.update(self.fixtures)
+            reset_attempts()
 
         # backup and cleanup starting state
-        self.previous_state = deepcopy(self.current_state)
-        self.previous_state.pop('__builtins__', None)
-        self.previous_inputs = self.current_inputs.copy()
-
-        # prepare StringIO for stdout simulation
-        out_stream = StringIO()
+        with self.timings.phase('copy'):
+            self.previous_state = copy_state(self.current_state)
+            self.previous_state.pop('__builtins__', None)
+            self.previous_inputs = self.current_inputs.copy()
 
         # run the code while mocking input, sys.argv and stdout printing
-        with mock_input(self.current_inputs, self.current_state,
-                        verbose=self.params['verbose_inputs']):
-            with mock.patch.object(sys, 'argv', self.argv):
-                with mock.patch.object(sys, 'stdout', out_stream):
-                    try:
-                        if expression is None:
-                            exec(self.code, self.current_state)
-                        else:
-                            self.result = eval(expression, self.current_state)
-                    except Exception as e:
-                        self.exception = e
+        code, collect = self.code, nullcontext()
+        if self.coverage is not None:
+            code, collect = self.coverage.compiled(), self.coverage.collect()
+        with self.timings.phase('execution'), collect:
+            self.exception = None
+            if self.setup and expression is not None:
+                _, _, self.exception = execute(
+                    code, None, self.current_state, self.current_inputs,
+                    self.argv, self.params['verbose_inputs'])
+            if self.exception is None:
+                self.output, result, self.exception = execute(
+                    code, expression, self.current_state,
+                    self.current_inputs, self.argv,
+                    self.params['verbose_inputs'], self.interactive)
+            else:
+                # the expression is not evaluated, the test fails with the
+                # exception raised by the code (whose output is discarded
+                # all the same)
+                self.output, result = '', None
+        if expression is not None:
+            self.result = result
+        if self.fixtures:
+            from fixtures import attempts
+            if attempts:
+                self.record_assertion(NoFixtureChangeAssert(
+                    False, sorted(set(attempts))))
 
         # cleanup state
         # del self.current_state['__builtins__']
 
-        # store generated output
-        self.output = out_stream.getvalue()
-
         # parse assertion-related keyword arguments
         self.parse_assertion_args(kwargs)
 
+    def skip(self, expression: str = None, **kwargs) -> NoReturn:
+        """
+        Records the test as not run (e.g. when the time budget of the
+        session is spent). Skipped tests do not count in grades, and their
+        assertions are ignored.
+
+        :param expression: Expression which would have been evaluated.
+        :param kwargs: Arguments of `run()` (only description arguments are
+            used).
+        """
+        self.expression = expression
+        self.parse_description_args(kwargs)
+        if self.title is None:
+            self.set_default_title()
+        self.skipped = True
+
     def parse_assertion_args(self, kwargs) -> NoReturn:
         """
         Parse assertion arguments to the `run()` method.
@@ -201,15 +413,26 @@ class Test:
         - types: a dictionary of values whose existence and type to check;
         - allow_global_change: if present and False, forbid changes to globals;
         - output: check output (for strict equality for now);
-        - result: check evaluation result, fails if no expression is passed.
+        - result: check evaluation result, fails if no expression is passed;
+        - reference: compare the run with the reference code, either on the
+          default aspects (reference=True) or on the given aspects (see
+          `assert_same_as_reference`).
         :param kwargs: Argument dictionary.
         """
+        reference = kwargs.get('reference')
+        if isinstance(reference, str):
+            reference = (reference,)
+        elif reference is True:
+            reference = _default_reference_aspects
 
         # manage exceptions
         if 'exception' in kwargs and kwargs['exception'] is not None:
             # if parameter exception=SomeExceptionClass is passed, silently
             # check it is indeed raised
             self.assert_exception(kwargs['exception'])
+        elif reference and 'exception' in reference:
+            # exceptions are compared with the reference's ones below
+            pass
         elif 'allow_exception' not in kwargs or not kwargs['allow_exception']:
             # unless exceptions are explicitly allowed by parameter
             # allow_exception=True, forbid them
@@ -237,6 +460,9 @@ class Test:
                                   "mais pas d'expression fournie")
             else:
                 self.assert_result(kwargs['result'])
+        # compare with the reference code
+        if reference:
+            self.assert_same_as_reference(*reference)
 
     def parse_context_args(self, kwargs):
         """
@@ -245,7 +471,14 @@ class Test:
         Currently allowed arguments are :
         - globals: set global variables (erasing all others);
         - inputs: set available input lines (erasing all others);
-        - argv: set available command-line arguments (erasing all others).
+        - argv: set available command-line arguments (erasing all others);
+        - interactive: run the expression as a statement typed in the
+          interactive interpreter, such as a doctest example (for this run
+          only, see `execute`).
+        - setup: run the code (discarding its output) before evaluating the
+          expression, as for baked cases and doctests (for this run only);
+          an exception raised by the code is the exception of the test, the
+          expression being then not evaluated.
 
         :param kwargs: Argument dictionary.
         """
@@ -258,6 +491,8 @@ class Test:
         # set available program parameters (overrides sys.argv)
         if 'argv' in kwargs:
             self.argv = kwargs['argv']
+        self.interactive = kwargs.get('interactive', False)
+        self.setup = kwargs.get('setup', False)
 
     def parse_description_args(self, kwargs):
         """
@@ -301,6 +536,7 @@ class Test:
                                     tofile='Affichage attendu')
         return ''.join(diff)
 
+    @_timed('assertions')
     def assert_output(self, expected: Any, cmp: Callable = operator.eq) -> bool:
         """
         Assert that the last run's output equals `expected` (using `cmp` as
@@ -316,6 +552,7 @@ class Test:
         self.record_assertion(OutputAssert(status, expected))
         return status
 
+    @_timed('assertions')
     def assert_result(self, expected: Any, cmp: Callable = operator.eq) -> bool:
         """
         Assert that the last run's result equals `expected` (using `cmp` as
@@ -329,6 +566,7 @@ class Test:
         self.record_assertion(ResultAssert(status, expected))
         return status
 
+    @_timed('assertions')
     def assert_variable_values(self, cmp=operator.eq, **expected) -> bool:
         """
         Assert that the values of some variables after the last run equal
@@ -351,6 +589,7 @@ class Test:
             VariableValuesAssert(status, expected, missing, incorrect))
         return status
 
+    @_timed('assertions')
     def assert_variable_types(self, cmp=operator.eq, **expected) -> bool:
         """
         Assert that the types of some variables after the last run equal
@@ -373,6 +612,7 @@ class Test:
             VariableTypesAssert(status, expected, missing, incorrect))
         return status
 
+    @_timed('assertions')
     def assert_no_global_change(self) -> bool:
         """
         Assert that no global variables changed during the last run.
@@ -384,6 +624,7 @@ class Test:
         self.record_assertion(NoGlobalChangeAssert(status))
         return status
 
+    @_timed('assertions')
     def assert_no_exception(self, **params) -> bool:
         """
         Assert that no exception was raised during the last run.
@@ -394,6 +635,7 @@ class Test:
         self.record_assertion(NoExceptionAssert(status, **params))
         return status
 
+    @_timed('assertions')
     def assert_exception(self, exception_type: type(Exception)) -> bool:
         """
         Assert that an exception of type `exception_type` was raised during the
@@ -406,25 +648,88 @@ class Test:
             ExceptionAssert(status, exception_type))
         return status
 
+    @_timed('assertions')
     def assert_no_loop(self, funcname: str,
                        keywords: Tuple[str] = ("for", "while")):
-        func = self.current_state[funcname]
-        print(func, file=sys.stderr)
-        code = inspect.getsource(func)
-        status = has_no_loop(code, keywords)
+        from ast_analyzer import has_no_loop
+        if funcname not in self.current_state:
+            raise GraderError("Fonction {} introuvable".format(funcname))
+        status = has_no_loop(self.code, keywords, scope=funcname)
         self.record_assertion(NoLoopAssert(status, funcname, keywords))
         return status
 
+    @_timed('assertions')
     def assert_simple_recursion(self, funcname: str):
-        func = self.current_state[funcname]
-        status = is_simple_recursive(func)
+        from ast_analyzer import is_simple_recursive
+        if funcname not in self.current_state:
+            raise GraderError("Fonction {} introuvable".format(funcname))
+        status = is_simple_recursive(self.code, funcname)
         self.record_assertion(SimpleRecursionAssert(status, funcname))
         return status
 
+    @_timed('reference')
+    def run_reference(self) -> 'ReferenceRun':
+        """
+        Runs the reference code in the context of the last run (global
+        variables, inputs and command-line arguments available before it),
+        or fetches the outcome of this execution from the reference cache.
+
+        If an expression was evaluated, the reference code is first executed
+        (discarding its output) so that the expression is evaluated against
+        the reference definitions.
+
+        :return: A `refcache.ReferenceRun` instance.
+        """
+        from refcache import context_key, get_cache
+        if self.reference is None:
+            raise GraderError("Comparaison avec une solution demandée, "
+                              "mais pas de solution fournie")
+        cache = get_cache()
+        key = context_key(self.reference, self.expression,
+                          self.previous_state, self.previous_inputs, self.argv)
+        entry = cache.get(key)
+        if entry is None:
+            entry = execute_reference(
+                self.reference, self.expression, self.previous_state,
+                self.previous_inputs, self.argv, self.params['verbose_inputs'])
+            cache.put(key, entry)
+        return entry
+
+    @_timed('assertions')
+    def assert_same_as_reference(self, *aspects: str) -> bool:
+        """
+        Assert that the last run behaves like the reference code run in the
+        same context (see `run_reference`).
+
+        :param aspects: Compared aspects, among 'output', 'result' (only
+            checked if an expression was evaluated), 'exception' (type of
+            the raised exception, if any) and 'globals' (data global variables
+            defined by the reference must exist with the same values).
+            Defaults to output, result and exception.
+        :return: Assertion status.
+        """
+        aspects = aspects or _default_reference_aspects
+        ref = self.run_reference()
+        status = True
+        if 'exception' in aspects:
+            if ref.exception is None:
+                status = self.assert_no_exception(report_success=False)
+            else:
+                status = self.assert_exception(ref.exception)
+        if 'output' in aspects:
+            status = self.assert_output(ref.output) and status
+        if 'result' in aspects and self.expression is not None:
+            status = self.assert_result(ref.result) and status
+        if 'globals' in aspects and ref.state:
+            status = self.assert_variable_values(**ref.state) and status
+        return status
+
     def record_assertion(self, assertion: 'Assert') -> NoReturn:
         """
         Record an assertion (using an Assertion object) in the test's history.
         """
+        if self.skipped:
+            return
         self.assertions.append(assertion)
         self.status = self.status and assertion.status
 
@@ -436,22 +741,27 @@ class Test:
         execution context.
 
         Includes existing global variables and their values, available input
-        lines, and command-line arguments.
+        lines, and command-line arguments. Large values are abbreviated. The
+        description is computed on first call only.
 
         :return: Full-text HTML formatted description of context.
         """
+        if self._context is not None:
+            return self._context
         res = []
 
         if self.previous_state:
             res.append("Variables globales : {}".format(
-                self.previous_state))
+                format_value(self.previous_state)))
         if self.previous_inputs:
             res.append("Entrées disponibles : {}".format(
-                self.previous_inputs))
+                format_value(self.previous_inputs)))
         if self.argv:
-            res.append("Arguments du programme : {}".format(self.argv))
+            res.append("Arguments du programme : {}".format(
+                format_value(self.argv)))
 
-        return "<br/>".join(res)
+        self._context = "<br/>".join(res)
+        return self._context
 
     def results(self) -> str:
         """
@@ -459,25 +769,32 @@ class Test:
 
         Includes results (if an expression was evaluated), created,
         modified and deleted global variables, read input lines, printed
-        text, raised exceptions.
+        text, raised exceptions. Large values and outputs are abbreviated.
+        The description is computed on first call only.
 
         :return: Full-text HTML formatted description of run effects.
         """
+        if self._results is not None:
+            return self._results
         res = []
         added, deleted, modified, inputs = self.summarize_changes()
 
-        if self.expression is not None:
-            res.append("Résultat obtenu : {}".format(self.result))
+        if self.expression is not None and not self.interactive:
+            res.append("Résultat obtenu : {}".format(
+                format_value(self.result, quote=False)))
         if added:
-            res.append("Variables créées : {}".format(added))
+            res.append("Variables créées : {}".format(format_value(added)))
         if modified:
-            res.append("Variables modifiées : {}".format(modified))
+            res.append("Variables modifiées : {}".format(
+                format_value(modified)))
         if deleted:
-            res.append("Variables supprimées : {}".format(deleted))
+            res.append("Variables supprimées : {}".format(
+                format_value(deleted)))
         if inputs:
-            res.append("Lignes saisies : {}".format(inputs))
+            res.append("Lignes saisies : {}".format(format_value(inputs)))
         if self.output:
-            tmp = self.output.replace('\n', "↲<br>\n")
+            tmp = format_text(self.output)
+            tmp = tmp.replace('\n', "↲<br>\n")
             tmp = tmp.replace(' ', '⎵')
             res.append("Texte affiché : "
                        "<pre style='margin:3pt; padding:2pt; "
@@ -485,11 +802,24 @@ class Test:
                        "{}</pre>".format(tmp))
         if self.exception:
             res.append("Exception levée : {} ({})".format(
-                type(self.exception).__name__, self.exception))
+                type(self.exception).__name__,
+                format_text(str(self.exception), 200)))
         if not res:
             res.append("Aucun effet observable")
 
-        return "<br/>".join(res)
+        self._results = "<br/>".join(res)
+        return self._results
+
+    def show_details(self) -> bool:
+        """
+        Whether the feedback on the test includes its context, effects and
+        assertions: only for failed tests, unless `report_success` is set on
+        the test or one of its assertions.
+        """
+        if self.skipped:
+            return False
+        return (not self.status or self.params['report_success']
+                or any(a.params['report_success'] for a in self.assertions))
 
     def set_default_title(self) -> NoReturn:
         """
@@ -502,8 +832,11 @@ class Test:
 
     def get_grade(self):
         """
-        Gets test grade. Currently only 0 or self.weight.
+        Gets test grade. Currently only 0 or self.weight (or 0 out of 0 for
+        skipped tests).
         """
+        if self.skipped:
+            return 0, 0
         return (self.status * self.weight), self.weight
 
     def render(self) -> str:
@@ -512,10 +845,9 @@ class Test:
 
         :return: HTML-formatted report on the test.
         """
-        with open(_default_test_template, "r") as tempfile:
-            templatestring = tempfile.read()
-        template = jinja2.Template(templatestring)
-        return template.render(test=self)
+        with self.timings.phase('render'), formatting.scope():
+            template = _get_template(_default_test_template)
+            return template.render(test=self)
 
     def make_id(self) -> str:
         """
@@ -526,6 +858,44 @@ class Test:
         return 'test_' + str(self.number)
 
 
+def group_grade(grades: List[Tuple[float, int]], weight: int
+                ) -> Tuple[float, int]:
+    """
+    Returns the grade of a group of tests, normalized to the weight of the
+    group.
+
+    :param grades: Pairs `(g, w)` of the tests of the group (see
+        `Test.get_grade`).
+    :param weight: Weight of the group.
+    :return: Tuple `(g, w)` where `g` is a grade between 0 and `w` (0 out of
+        0 if no test of the group was run).
+    """
+    total_grade = total_weight = 0
+    for total, test_weight in grades:
+        total_grade += total
+        total_weight += test_weight
+    if not total_weight:
+        return 0, 0
+    return total_grade / total_weight * weight, weight
+
+
+def session_grade(grades: List[Tuple[float, int]]) -> float:
+    """
+    Returns the grade (out of 100) of an interrupted session, or of a
+    session recovered from its checkpoint (see the checkpoint module).
+
+    :param grades: Pairs `(g, w)` of the top-level tests and groups of the
+        session, the test being run when it was interrupted, if any,
+        counting as failed (in its group, if any).
+    :return: Grade, 0 if no test was run.
+    """
+    total_grade = total_weight = 0
+    for total, weight in grades:
+        total_grade += total
+        total_weight += weight
+    return total_grade / total_weight * 100 if total_weight else 0
+
+
 class TestGroup:
     """
     Groups of Test instances sharing a title.
@@ -583,12 +953,8 @@ class TestGroup:
 
         :return: Tuple `(g, w)` where `g` is a grade between 0 and `w`.
         """
-        total_grade = total_weight = 0
-        for test in self.tests:
-            total, weight = test.get_grade()
-            total_grade += total
-            total_weight += weight
-        return total_grade / total_weight * self.weight, self.weight
+        return group_grade([test.get_grade() for test in self.tests],
+                           self.weight)
 
     def render(self) -> str:
         """
@@ -596,10 +962,9 @@ class TestGroup:
 
         :return: HTML-formatted report on the test group.
         """
-        with open(_default_group_template, "r") as tempfile:
-            templatestring = tempfile.read()
-        template = jinja2.Template(templatestring)
-        return template.render(testgroup=self)
+        template = _get_template(_default_group_template)
+        with formatting.scope():
+            return template.render(testgroup=self)
 
     def update_status(self, status) -> NoReturn:
         """
@@ -618,35 +983,81 @@ class TestSession:
     global parameters, and global grading.
     """
 
-    def __init__(self, code: str, **params):
+    def __init__(self, code: str, tree=None, **params):
         """
         Initialize TestSession instance.
 
         :param code: Main code to test.
+        :param tree: Abstract syntax tree of `code`, if already parsed (see
+            the precheck module).
         :param params: Global session parameters. Currently allowed keys are:
             - report_success (bool, defaults to False): whether or not to
               report passed assertions;
             - fail_fast (bool, defaults to True): whether or not to stop after
               the first error.
         """
+        self.code: str = code
         self.history: List[Union[Test, TestGroup]] = []
         self.last_test: Optional[Test] = None
-        self.next_test: Test = Test(code)
         self.current_test_group: Optional[TestGroup] = None
+        # test being run, if any (see partial_grade)
+        self.running: Optional[Test] = None
 
-        self.ast: ast.AST = ast.parse(code)
-
-        # modname = 'studentmod'
-        # spec = importlib.util.spec_from_loader(modname, loader=None)
-        # module = importlib.util.module_from_spec(spec)
-        # exec(code, module.__dict__)
-        # sys.modules[modname] = module
-        # self.module = module
-
-        self.module = importlib.import_module('student')
+        # parsed code and student module are computed on first access only
+        self._ast = tree
+        self._module = None
 
         self.params = _default_params.copy()
         self.params.update(params)
+        self.next_test: Test = Test(code, **self.params)
+
+        # fixtures of the session (those of test groups are kept by the
+        # next test only, see set_fixture)
+        self.fixtures: Dict[str, Any] = {}
+
+        # CPU time budget (see the budget module)
+        self.budget: Optional[Budget] = default_budget()
+        if self.params.get('budget') is not None:
+            self.set_budget(self.params['budget'])
+
+        # feedback stream (see stream_to), and number of items of the
+        # history already written to it
+        self.stream = None
+        self._streamed: int = 0
+        # whether the stream is held while tests are recorded out of order
+        self._stream_held: bool = False
+
+        # checkpoint of completed tests (see checkpoint_to)
+        self.checkpoint = None
+
+        # trace of completed tests, for replay (see trace_to)
+        self.trace = None
+
+        # line coverage of the code by the tests (see measure_coverage)
+        self.coverage = None
+
+        # instrumentation of session-level phases (see the timing module)
+        self.timings: Timings = Timings()
+        if self.timings.enabled:
+            timing.sessions.append(self)
+
+    @property
+    def ast(self):
+        """Abstract syntax tree of the tested code (parsed on first use)."""
+        if self._ast is None:
+            import ast
+            with self.timings.phase('parse'):
+                self._ast = ast.parse(self.code)
+        return self._ast
+
+    @property
+    def module(self):
+        """Student module, imported on first use."""
+        if self._module is None:
+            import importlib
+            with self.timings.phase('import_student'):
+                self._module = importlib.import_module('student')
+        return self._module
 
     """Group management."""
 
@@ -658,6 +1069,9 @@ class TestSession:
         """
         self.current_test_group = TestGroup(title)
         self.history.append(self.current_test_group)
+        self._reset_fixtures()
+        if self.checkpoint is not None:
+            self.checkpoint.group(self.current_test_group)
 
     def end_test_group(self) -> NoReturn:
         """
@@ -665,23 +1079,250 @@ class TestSession:
         """
         if self.current_test_group and self.last_test:
             self.current_test_group.update_status(self.last_test.status)
+        if self.current_test_group and self.checkpoint is not None:
+            self.checkpoint.end_group()
         self.current_test_group = None
         self.last_test = None
+        self._reset_fixtures()
+        self._write_stream()
+
+    def _reset_fixtures(self) -> NoReturn:
+        """Removes the fixtures of the previous test group from the next
+        test and its state."""
+        state = self.next_test.current_state
+        for name, value in self.next_test.fixtures.items():
+            if name not in self.fixtures and state.get(name) is value:
+                del state[name]
+        self.next_test.fixtures = self.fixtures.copy()
 
     """ Grading """
 
     def get_grade(self):
+        """
+        Returns the grade of the session (out of 100), over the tests which
+        were run.
+        """
         total_grade = total_weight = 0
         for test in self.history:
             total, weight = test.get_grade()
             total_grade += total
             total_weight += weight
+        if not total_weight and any(test.skipped
+                                    for test in self.all_tests()):
+            return 0
         return total_grade / total_weight * 100
 
+    def partial_grade(self) -> float:
+        """
+        Returns the grade of an interrupted session: the test being run, if
+        any, counts as failed in its group (see `session_grade`), tests
+        which did not run are ignored.
+        """
+        interrupted = []
+        if self.running is not None:
+            interrupted.append((0, self.running.weight or 1))
+        grades = []
+        for item in self.history:
+            if item is self.current_test_group:
+                grades.append(group_grade(
+                    [test.get_grade() for test in item.tests] + interrupted,
+                    item.weight))
+                interrupted = []
+            else:
+                grades.append(item.get_grade())
+        return session_grade(grades + interrupted)
+
     """Rendering"""
 
-    def render(self):
-        return "\n".join(test.render() for test in self.history)
+    def render(self, fmt: str = 'html') -> str:
+        """
+        Returns the feedback on the session.
+
+        :param fmt: Feedback format, one of 'html' (default), 'json', 'text'
+            and 'md' (see the renderers module).
+        :return: Report on the session in the requested format.
+        """
+        with self.timings.phase('render'), formatting.scope():
+            if fmt == 'html':
+                res = [test.render() for test in self.history]
+                if self.coverage is not None and self.coverage.show:
+                    res.append(self.coverage.render_html())
+                return "\n".join(res)
+            from renderers import get_renderer
+            return get_renderer(fmt).render(self)
+
+    def stream_to(self, stream) -> NoReturn:
+        """
+        Writes the feedback on each test (or group) to `stream` as soon as it
+        is complete, instead of rendering the whole session at the end.
+
+        :param stream: A `sandboxio.FeedbackWriter`, or any object with a
+            `write(str)` and `close()` methods and `partial_grade`, `pending`
+            and `summary` attributes.
+        """
+        self.stream = stream
+        stream.partial_grade = self.partial_grade
+        stream.pending = self._write_pending
+        stream.summary = self.summary
+        self._write_stream()
+
+    def _write_pending(self, interrupted: Optional[str] = None
+                       ) -> NoReturn:
+        """
+        Writes the remaining items of the history to the feedback stream,
+        including the current test group.
+
+        :param interrupted: Name of the signal which interrupted grading, if
+            any: the current test group then fails if one of its tests was
+            being run.
+        """
+        if (interrupted and self.running is not None
+                and self.current_test_group is not None):
+            self.current_test_group.update_status(False)
+        self._write_stream(complete=True)
+
+    def _write_stream(self, complete: bool = False) -> NoReturn:
+        """
+        Writes the completed items of the history to the feedback stream.
+
+        :param complete: Whether the current test group is complete too.
+        """
+        if self.stream is None or (self._stream_held and not complete):
+            return
+        while self._streamed < len(self.history):
+            item = self.history[self._streamed]
+            if item is self.current_test_group and not complete:
+                break
+            with self.timings.phase('render'), formatting.scope():
+                self.stream.write(item.render() + "\n")
+            self._streamed += 1
+
+    def checkpoint_to(self, checkpoint) -> NoReturn:
+        """
+        Records each test in `checkpoint` as it starts and completes, so that
+        the results of a killed grader can be recovered.
+
+        :param checkpoint: A `checkpoint.Checkpoint` (see the checkpoint
+            module).
+        """
+        self.checkpoint = checkpoint
+
+    def trace_to(self, trace) -> NoReturn:
+        """
+        Records the student code and the context and effects of each test
+        in `trace`, so that a test can be replayed later.
+
+        :param trace: A `sessiontrace.Trace` (see the sessiontrace module).
+        """
+        self.trace = trace
+        trace.begin(self.code)
+
+    def measure_coverage(self, coverage=None) -> NoReturn:
+        """
+        Collects the lines of the code executed by the following tests. If
+        the coverage is to be shown, an annotated listing of the code is
+        appended to the feedback.
+
+        :param coverage: A `linecov.LineCoverage` of the code (by default,
+            a new one which is not shown).
+        """
+        if coverage is None:
+            from linecov import LineCoverage
+            coverage = LineCoverage(self.code)
+        self.coverage = self.next_test.coverage = coverage
+
+    def finish_stream(self) -> NoReturn:
+        """Writes the remaining items and the summary to the feedback
+        stream."""
+        if self.stream is not None:
+            self.stream.close()
+
+    def summary(self, omitted: int = 0, interrupted: Optional[str] = None
+                ) -> str:
+        """
+        Returns a HTML-formatted summary of the session, closing streamed
+        feedback.
+
+        :param omitted: Number of items left out of the feedback because of
+            its size.
+        :param interrupted: Name of the signal which interrupted grading, if
+            any.
+        :return: HTML-formatted summary.
+        """
+        tests = [test for test in self.all_tests() if not test.skipped]
+        passed = sum(test.status for test in tests)
+        # the test being run when grading was interrupted counts as failed
+        running = bool(interrupted) and self.running is not None
+        res = ["Tests réussis : {} sur {}".format(passed,
+                                                  len(tests) + running)]
+        skipped = len(self.all_tests()) - len(tests)
+        if skipped:
+            reason = ""
+            if self.budget is not None and self.budget.expired():
+                reason = " (temps de correction de {:g} s épuisé)".format(
+                    self.budget.seconds)
+            res.append("{} test(s) non exécuté(s), non pris en compte dans "
+                       "la note{}".format(skipped, reason))
+        if omitted:
+            res.append("{} test(s) ou groupe(s) non affiché(s) "
+                       "(taille maximale du retour atteinte)".format(omitted))
+        if running:
+            res.append("Correction interrompue ({}) : le test en cours est "
+                       "considéré comme échoué, les suivants n'ont pas été "
+                       "exécutés".format(interrupted))
+        elif interrupted:
+            res.append("Correction interrompue ({}) : les tests suivants "
+                       "n'ont pas été exécutés".format(interrupted))
+        res = "<div class=\"card\"><p>{}</p></div>".format("<br/>".join(res))
+        if self.coverage is not None and self.coverage.show:
+            res += "\n" + self.coverage.render_html()
+        return res
+
+    def write_report(self, path: str, fmt: str = 'html') -> NoReturn:
+        """
+        Streams the feedback on the session to the file at `path`, one test
+        or group at a time.
+
+        :param path: Path of the report file.
+        :param fmt: Feedback format (see `render`).
+        """
+        from renderers import get_renderer
+        with self.timings.phase('render'), formatting.scope():
+            get_renderer(fmt).write(self, path)
+
+    """Instrumentation"""
+
+    def all_tests(self) -> List[Test]:
+        """
+        Returns all the tests of the session, including those in groups, in
+        execution order.
+        """
+        tests = []
+        for item in self.history:
+            if isinstance(item, TestGroup):
+                tests.extend(item.tests)
+            else:
+                tests.append(item)
+        return tests
+
+    def timing_report(self) -> Dict[str, Any]:
+        """
+        Returns the timings recorded for the session and each of its tests
+        (see the timing module), as a JSON-serializable dictionary.
+
+        :return: dictionary with keys 'session' (session-level phases,
+            which include the tests' rendering), 'tests' (list of per-test
+            phases) and 'total' (phases summed over all tests).
+        """
+        total = Timings(enabled=True)
+        tests = []
+        for test in self.all_tests():
+            total.merge(test.timings)
+            tests.append({'number': test.number, 'title': test.title,
+                          'phases': test.timings.as_dict()})
+        return {'total': total.as_dict(),
+                'session': self.timings.as_dict(),
+                'tests': tests}
 
     """Setters for the next test."""
 
@@ -715,100 +1356,328 @@ class TestSession:
     def set_inputs(self, inputs: List[str]) -> NoReturn:
         self.next_test.current_inputs = inputs.copy()
 
+    def set_fixture(self, name: str, value: Any) -> NoReturn:
+        """
+        Declares a read-only global variable shared by the following tests of
+        the current test group (or of the session, outside of groups).
+
+        The value is frozen once (see the fixtures module) and added to the
+        state before each run instead of being copied. Attempts of the
+        student code to modify it fail, and are reported by a failed
+        assertion.
+
+        :param name: Name of the global variable.
+        :param value: Value made of builtin types (numbers, strings, lists,
+            tuples, dictionaries, sets).
+        """
+        from fixtures import freeze
+        frozen = freeze(value, name)
+        if self.current_test_group is None:
+            self.fixtures[name] = frozen
+        self.next_test.fixtures = dict(self.next_test.fixtures,
+                                       **{name: frozen})
+
+    def set_budget(self, seconds: Optional[float]) -> NoReturn:
+        """
+        Sets the CPU time budget of the session, starting now: once it is
+        spent, the following tests are not run (see the budget module). Use
+        None to remove it.
+
+        :param seconds: Available CPU time in seconds.
+        """
+        self.budget = Budget(seconds) if seconds is not None else None
+
+    def set_reference(self, code: Optional[str]) -> NoReturn:
+        """
+        Sets the trusted reference code to which the next tests are compared
+        when passing reference=... to `run()` or calling
+        `assert_same_as_reference()`. Use None to remove it.
+
+        :param code: Reference code.
+        """
+        self.next_test.reference = code
+
     """Execution"""
 
     def run(self, expression: str = None, **kwargs) -> NoReturn:
-        self.next_test.run(expression, **kwargs)
-        self.last_test = self.next_test
-        self.next_test = self.last_test.copy()
+        if self.budget is not None and self.budget.expired():
+            self.next_test.skip(expression, **kwargs)
+        else:
+            if self.checkpoint is not None:
+                self.checkpoint.start(self.next_test)
+            self.running = self.next_test
+            self.next_test.run(expression, **kwargs)
+            self.running = None
+        self._record(self.next_test)
+
+        if self.params.get('fail_fast', False) and not self.last_test.status:
+            raise StopGrader("Failed assert during fail-fast test.")
+
+    def _record(self, test: Test) -> NoReturn:
+        """Records a test which was run (or skipped) in the history."""
+        self.last_test = test
+        self.next_test = test.copy()
 
         # record last test
         if self.current_test_group:
-            self.current_test_group.append(self.last_test)
-            self.current_test_group.update_status(self.last_test.status)
+            self.current_test_group.append(test)
+            if not test.skipped:
+                self.current_test_group.update_status(test.status)
         else:
-            self.history.append(self.last_test)
+            self.history.append(test)
+        if self.checkpoint is not None:
+            self.checkpoint.test(test)
+        if self.trace is not None:
+            self.trace.test(test)
+        self._write_stream()
+
+    def _open_case_group(self, case: dict) -> NoReturn:
+        """Opens or closes test groups as declared by a baked case."""
+        group = case.get('group')
+        current = self.current_test_group
+        if group is None and current is not None:
+            self.end_test_group()
+        elif group is not None and (current is None
+                                    or current.title != group):
+            self.begin_test_group(group)
 
-        if self.params.get('fail_fast', False) and not self.last_test.status:
+    def _prepare_case(self, kwargs: dict) -> Optional[str]:
+        """
+        Prepares the context of a decoded case.
+
+        :param kwargs: Decoded case (see `cases.decode_case`), whose
+            expression is removed.
+        :return: Expression of the case.
+        """
+        expression = kwargs.pop('expression')
+        # as for the reference at build time, the code is executed
+        # (discarding its output) before evaluating the expression
+        kwargs['setup'] = True
+        return expression
+
+    def _enter_case_group(self, title: Optional[str], segment: int,
+                          groups: Dict[int, TestGroup]) -> NoReturn:
+        """
+        Enters the test group of a baked case run out of declaration order
+        (see `run_cases`): the group is opened, or opened again if some of
+        its cases already ran, so that it is not split.
+
+        :param title: Group of the case, if any.
+        :param segment: Index of the first of the cases declared in a row
+            with the same group.
+        :param groups: Test groups opened so far, by segment.
+        """
+        group = groups.get(segment)
+        current = self.current_test_group
+        if current is not None and current is group:
+            return
+        if current is not None:
+            self.end_test_group()
+        if title is None:
+            return
+        if group is None:
+            self.begin_test_group(title)
+            groups[segment] = self.current_test_group
+        else:
+            self.current_test_group = group
+            self._reset_fixtures()
+            if self.checkpoint is not None:
+                self.checkpoint.group(group)
+
+    def run_cases(self, cases: List[dict]) -> NoReturn:
+        """
+        Runs test cases baked at build time (see the `cases` module), each in
+        its own context, opening test groups as declared.
+
+        If the session has a time budget, cases are run by order of priority
+        (see the budget module), and those which could not be run within
+        the budget are reported as not run. Each test is recorded (e.g. in
+        the checkpoint, if any) as soon as it completes, but feedback
+        follows the declaration order in any case: the feedback stream, if
+        any, is only written once all of them have run (or when grading is
+        interrupted). Since the first cases run are those which most often
+        fail, fail_fast does not stop the cases: grading only stops after
+        all of them, if one failed.
+
+        :param cases: Baked cases, usually `pl_context['cases']`.
+        """
+        from cases import decode_case
+        if self.budget is None:
+            for case in cases:
+                self._open_case_group(case)
+                kwargs = decode_case(case)
+                self.run(self._prepare_case(kwargs), **kwargs)
+            return
+
+        from budget import CaseStats, case_key
+        stats = CaseStats()
+        keys = [case_key(case) for case in cases]
+        titles = [case.get('group') for case in cases]
+        # cases declared in a row with the same group share a test group,
+        # identified by the index of the first one
+        segments = []
+        for i, title in enumerate(titles):
+            same = i > 0 and title == titles[i - 1]
+            segments.append(segments[-1] if same else i)
+        groups: Dict[int, TestGroup] = {}
+        if (cases and self.current_test_group is not None
+                and self.current_test_group.title == titles[0]):
+            groups[0] = self.current_test_group
+        start = len(self.history)
+        ranks: Dict[int, int] = {}  # declaration index of each test, by id
+        failed = False
+        self._stream_held = True
+        try:
+            for i in stats.order(keys):
+                if self.budget.expired():
+                    break
+                self._enter_case_group(titles[i], segments[i], groups)
+                test = self.next_test
+                kwargs = decode_case(cases[i])
+                if self.checkpoint is not None:
+                    self.checkpoint.start(test)
+                begin = time.process_time()
+                self.running = test
+                test.run(self._prepare_case(kwargs), **kwargs)
+                self.running = None
+                stats.record(keys[i], time.process_time() - begin,
+                             not test.status)
+                ranks[id(test)] = i
+                self._record(test)
+                failed = failed or not test.status
+            stats.save()
+
+            run = set(ranks.values())
+            for i, case in enumerate(cases):
+                if i in run:
+                    continue
+                self._enter_case_group(titles[i], segments[i], groups)
+                test = self.next_test
+                kwargs = decode_case(case)
+                test.skip(kwargs.pop('expression'), **kwargs)
+                ranks[id(test)] = i
+                self._record(test)
+            if cases:
+                # the group of the last case stays open, as in declaration
+                # order
+                self._enter_case_group(titles[-1], segments[-1], groups)
+        finally:
+            self._stream_held = False
+
+        for group in groups.values():
+            group.tests.sort(key=lambda test: ranks.get(id(test), -1))
+
+        def rank(item: Union[Test, TestGroup]) -> int:
+            tests = item.tests if isinstance(item, TestGroup) else [item]
+            return min(ranks.get(id(test), -1) for test in tests)
+
+        self.history[start:] = sorted(self.history[start:], key=rank)
+        self._write_stream()
+        if self.params.get('fail_fast', False) and failed:
             raise StopGrader("Failed assert during fail-fast test.")
 
+    def run_doctests(self, examples: Union[str, List[list]],
+                     title: str = "Exemples", weight: int = 1) -> NoReturn:
+        """
+        Runs doctest examples in a new test group, one test per example. The
+        examples are run in turn in the namespace of the student code, as
+        typed in the interpreter after running it, and their outputs are
+        compared as by doctest (an expected exception is only checked by
+        type).
+
+        :param examples: Doctest text, or examples parsed by
+            `doctests.parse` (usually `pl_context['doctest_examples']`).
+        :param title: Title of the test group.
+        :param weight: Weight of each example.
+        """
+        import builtins
+        from doctests import check, parse
+        if isinstance(examples, str):
+            examples = parse(examples)
+        self.begin_test_group(title)
+        for i, (source, want, exception, flags) in enumerate(examples):
+            kwargs = {'title': "Exemple : <code>{}</code>".format(
+                          formatting.escape(source.strip())),
+                      'weight': weight, 'interactive': True}
+            if i == 0:
+                # the code is executed (discarding its output) before the
+                # first example, the next ones run in the resulting state
+                kwargs.update(globals={}, inputs=[], argv=[], setup=True)
+            if exception is not None:
+                kwargs['exception'] = getattr(builtins, exception, Exception)
+            self.run(source, **kwargs)
+            if exception is None and not self.last_test.skipped:
+                self.assert_output(want, check(flags))
+        self.end_test_group()
+
     """Assertions."""
 
     # TODO: unhappy about code duplication in assertion mechanism, fix this.
 
+    def _check(self, status: bool) -> NoReturn:
+        """
+        Records an assertion just made on the last test in the checkpoint,
+        and stops grading if it failed in fail-fast mode.
+
+        :param status: Status of the assertion.
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.amend(self.last_test)
+        if self.params.get('fail_fast', False) and not status:
+            self.end_test_group()
+            raise StopGrader("Failed assert during fail-fast test.")
+
     def assert_output(self, expected,
                       cmp: Callable = operator.eq):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_output(expected, cmp)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_output(expected, cmp))
 
     def assert_result(self, expected,
                       cmp: Callable = operator.eq):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_result(expected, cmp)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_result(expected, cmp))
 
     def assert_variable_values(self, cmp=lambda x, y: x == y, **expected):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_variable_values(cmp, **expected)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_variable_values(cmp, **expected))
 
     def assert_variable_types(self, cmp=lambda x, y: x == y, **expected):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_variable_types(cmp, **expected)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_variable_types(cmp, **expected))
 
     def assert_no_global_change(self):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_no_global_change()
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_no_global_change())
 
     def assert_no_exception(self, **params):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_no_exception(**params)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_no_exception(**params))
 
     def assert_exception(self, exception_type):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_exception(exception_type)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_exception(exception_type))
+
+    def assert_same_as_reference(self, *aspects):
+        if self.last_test is None:
+            raise GraderError("Can't assert before running the code.")
+        self._check(self.last_test.assert_same_as_reference(*aspects))
 
     def assert_no_loop(self, funcname, keywords=("while", "for")):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_no_loop(funcname, keywords)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_no_loop(funcname, keywords))
 
     def assert_simple_recursion(self, funcname):
         if self.last_test is None:
             raise GraderError("Can't assert before running the code.")
-        status = self.last_test.assert_simple_recursion(funcname)
-        if self.params.get('fail_fast', False) and not status:
-            self.end_test_group()
-            raise StopGrader("Failed assert during fail-fast test.")
+        self._check(self.last_test.assert_simple_recursion(funcname))
 
 
 class TextLabel:
@@ -852,7 +1721,7 @@ class OutputAssert(Assert):
         elif self.expected == "":
             return "Aucun affichage attendu"
         else:
-            tmp = self.expected.replace('\n', "↲\n")
+            tmp = format_text(self.expected).replace('\n', "↲\n")
             tmp = tmp.replace(' ', '⎵')
             return ("Affichage attendu :\n"
                     "<pre style='margin:3pt; padding:2pt; "
@@ -883,7 +1752,7 @@ class ExceptionAssert(Assert):
             return "L'exception attendue a été levée"
         else:
             return "Une exception de type {} était attendue".format(
-                self.exception)
+                format_value(self.exception))
 
 
 class ResultAssert(Assert):
@@ -896,7 +1765,8 @@ class ResultAssert(Assert):
         if self.status:
             return "Résultat correct"
         else:
-            return "Résultat attendu : {!r}".format(self.expected)
+            return "Résultat attendu : {}".format(
+                format_value(self.expected))
 
 
 class VariableValuesAssert(Assert):
@@ -916,8 +1786,8 @@ class VariableValuesAssert(Assert):
             for var in self.missing:
                 details.append("{} manquante".format(var))
             for var in self.incorrect:
-                details.append("{} devrait valoir {!r}".format(
-                    var, self.expected[var]))
+                details.append("{} devrait valoir {}".format(
+                    var, format_value(self.expected[var])))
             res += "; ".join(details)
         return res
 
@@ -939,8 +1809,8 @@ class VariableTypesAssert(Assert):
             for var in self.missing:
                 details.append("{} manquante".format(var))
             for var in self.incorrect:
-                details.append("{} devrait être de type {!r}".format(
-                    var, self.expected[var]))
+                details.append("{} devrait être de type {}".format(
+                    var, format_value(self.expected[var])))
             res += "; ".join(details)
         return res
 
@@ -957,6 +1827,20 @@ class NoGlobalChangeAssert(Assert):
             return "Variables globales modifiées"
 
 
+class NoFixtureChangeAssert(Assert):
+
+    def __init__(self, status, names, **params):
+        super().__init__(status, params)
+        self.names = names
+
+    def __str__(self):
+        if self.status:
+            return "Données partagées inchangées"
+        else:
+            return "Modification de données en lecture seule : {}".format(
+                ", ".join(self.names))
+
+
 class NoLoopAssert(Assert):
 
     def __init__(self, status: bool, funcname: str, keywords: Tuple[str],
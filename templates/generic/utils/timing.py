@@ -0,0 +1,147 @@
+# coding: utf-8
+"""
+Per-phase timing instrumentation of the grader.
+
+Timings are only recorded if the `PL_GRADER_TIMINGS` environment variable
+is set: to any non-empty value for durations, or to `alloc` to also record
+the memory allocated during each phase (through tracemalloc, which slows
+down execution noticeably). When disabled, `Timings.phase` returns a shared
+no-op context manager, so instrumented code pays one method call per phase.
+
+Recorded timings are written by `sandboxio.output` to a JSON sidecar file
+next to the feedback file (`feedback.timings.json` for `feedback.html`).
+"""
+
+import os
+import time
+from typing import Dict, List
+
+_env_var = 'PL_GRADER_TIMINGS'
+_mode = os.environ.get(_env_var, '')
+
+ENABLED: bool = bool(_mode)
+ALLOCATIONS: bool = _mode == 'alloc'
+
+
+class _NullPhase:
+    """No-op context manager returned when timings are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase:
+    """Context manager measuring one occurrence of a phase."""
+    __slots__ = ('timings', 'name', 'start', 'memory')
+
+    def __init__(self, timings: 'Timings', name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.timings._active.add(self.name)
+        if self.timings.allocations:
+            import tracemalloc
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        allocated = None
+        if self.timings.allocations:
+            import tracemalloc
+            allocated = tracemalloc.get_traced_memory()[0] - self.memory
+        self.timings._active.discard(self.name)
+        self.timings.add(self.name, duration, allocated)
+        return False
+
+
+class Timings:
+    """
+    Cumulated durations (and optionally allocated memory) of named phases.
+
+    Phases are measured with `with timings.phase(name): ...`; a phase nested
+    in a phase of the same name is not counted twice.
+    """
+
+    def __init__(self, enabled: bool = None, allocations: bool = None):
+        """
+        :param enabled: Whether timings are recorded (defaults to the
+            `PL_GRADER_TIMINGS` environment variable).
+        :param allocations: Whether allocated memory is recorded.
+        """
+        self.enabled = ENABLED if enabled is None else enabled
+        self.allocations = self.enabled and (
+            ALLOCATIONS if allocations is None else allocations)
+        if self.allocations:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.allocated: Dict[str, int] = {}
+        self._active = set()
+
+    def phase(self, name: str):
+        """Returns a context manager measuring phase `name`."""
+        if not self.enabled or name in self._active:
+            return _null_phase
+        return _Phase(self, name)
+
+    def add(self, name: str, duration: float, allocated: int = None) -> None:
+        """Records one occurrence of phase `name`."""
+        self.durations[name] = self.durations.get(name, 0.) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if allocated is not None:
+            self.allocated[name] = self.allocated.get(name, 0) + allocated
+
+    def merge(self, other: 'Timings') -> None:
+        """Adds the phases recorded by `other` to this instance."""
+        for name, duration in other.durations.items():
+            self.durations[name] = self.durations.get(name, 0.) + duration
+            self.counts[name] = (self.counts.get(name, 0)
+                                 + other.counts[name])
+        for name, allocated in other.allocated.items():
+            self.allocated[name] = self.allocated.get(name, 0) + allocated
+
+    def as_dict(self) -> Dict[str, dict]:
+        """Phases as a JSON-serializable dictionary."""
+        res = {}
+        for name, duration in self.durations.items():
+            res[name] = {'time': duration, 'count': self.counts[name]}
+            if name in self.allocated:
+                res[name]['alloc'] = self.allocated[name]
+        return res
+
+
+# process-wide phases (context loading, grading, output...)
+grader = Timings()
+
+# objects exposing a timing_report() method, registered if timings are
+# enabled (typically TestSession instances)
+sessions: List = []
+
+
+def report() -> dict:
+    """All recorded timings, as a JSON-serializable dictionary."""
+    return {'grader': grader.as_dict(),
+            'sessions': [session.timing_report() for session in sessions]}
+
+
+def sidecar_path(feedback_path: str) -> str:
+    """Path of the timings file written next to `feedback_path`."""
+    return os.path.splitext(feedback_path)[0] + '.timings.json'
+
+
+def write_sidecar(feedback_path: str) -> None:
+    """Writes all recorded timings next to `feedback_path`."""
+    import json
+    with open(sidecar_path(feedback_path), 'w') as f:
+        json.dump(report(), f, indent=1)